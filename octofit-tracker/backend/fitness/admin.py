@@ -1,13 +1,92 @@
 from django.contrib import admin
-from .models import UserProfile, Team, ActivityType, Activity, Challenge, WorkoutSuggestion
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Max, Min, Q
+from django.utils.functional import cached_property
+
+from .models import (
+    UserProfile, Team, ActivityType, Activity, ArchivedActivity, DailyActivityRollup, Challenge, ChallengeProgress,
+    ChallengeTeamProgress, WorkoutSuggestion, Job
+)
+from .queries import related_count
 
 # Register your models here.
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that counts at most COUNT_LIMIT rows.
+
+    Smaller results are counted exactly. Past the limit an unfiltered list
+    is estimated from its primary key range, which two index lookups
+    answer, and a filtered one reports the limit, instead of a COUNT(*)
+    over millions of rows. Asking for a page past the limit of a filtered
+    list counts it exactly, so every page stays reachable.
+    """
+    COUNT_LIMIT = 10000
+    capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        count = queryset[:self.COUNT_LIMIT + 1].count()
+        if count <= self.COUNT_LIMIT:
+            return count
+        if queryset.query.where:
+            self.capped = True
+            return self.COUNT_LIMIT
+        # Separate aggregates, as SQLite only answers a lone MIN() or MAX() from the index.
+        # Ids lost to deletes and archival make this an overestimate.
+        low = queryset.aggregate(low=Min('pk'))['low']
+        high = queryset.aggregate(high=Max('pk'))['high']
+        return high - low + 1
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.capped:
+                raise
+        self.capped = False
+        self.__dict__['count'] = self.object_list.order_by().count()
+        self.__dict__.pop('num_pages', None)
+        return super().validate_number(number)
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows.
+
+    Search matches prefixes. A search field on a related model
+    (``user__username``) becomes an ``IN (SELECT ...)`` over the related
+    table, so this table is filtered on its indexed foreign key rather than
+    joined to the related table row by row. The prefix test itself is a
+    case-insensitive LIKE, which SQLite answers by scanning the searched
+    column rather than from an index.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.get_search_fields(request):
+            lookup = field.lstrip('^')
+            if '__' in lookup:
+                name, related_lookup = lookup.split('__', 1)
+                related = self.model._meta.get_field(name).related_model
+                ids = related._default_manager.filter(**{f'{related_lookup}__istartswith': term}).values('pk')
+                condition |= Q(**{f'{name}__in': ids})
+            else:
+                condition |= Q(**{f'{lookup}__istartswith': term})
+        return queryset.filter(condition), False
+
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ScalableAdmin):
     list_display = ['user', 'fitness_level', 'total_points', 'created_at']
     list_filter = ['fitness_level', 'created_at']
-    search_fields = ['user__username', 'user__first_name', 'user__last_name']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '^user__first_name', '^user__last_name']
+    raw_id_fields = ['user']
 
 @admin.register(ActivityType)
 class ActivityTypeAdmin(admin.ModelAdmin):
@@ -15,34 +94,117 @@ class ActivityTypeAdmin(admin.ModelAdmin):
     list_filter = ['category']
     search_fields = ['name']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'points_per_minute' in form.changed_data:
+            self.message_user(
+                request, "Existing activities will be re-priced in the background; see Jobs for progress."
+            )
+
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(ScalableAdmin):
     list_display = ['user', 'activity_type', 'duration_minutes', 'intensity', 'points_awarded', 'date_logged']
+    # The date filter's choices are fixed ranges; a date_hierarchy would scan the table for its years
     list_filter = ['activity_type', 'intensity', 'date_logged']
-    search_fields = ['user__username', 'activity_type__name']
-    date_hierarchy = 'date_logged'
+    list_select_related = ['user', 'activity_type']
+    search_fields = ['^user__username', '^activity_type__name']
+    raw_id_fields = ['user', 'batch']
+
+@admin.register(ArchivedActivity)
+class ArchivedActivityAdmin(ScalableAdmin):
+    list_display = ['user', 'activity_type', 'duration_minutes', 'intensity', 'points_awarded', 'date_logged',
+                    'archived_at']
+    list_filter = ['activity_type', 'intensity']
+    list_select_related = ['user', 'activity_type']
+    search_fields = ['^user__username', '^activity_type__name']
+
+    # Archived rows are history: editing or deleting them here would bypass the points ledger
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(DailyActivityRollup)
+class DailyActivityRollupAdmin(ScalableAdmin):
+    list_display = ['user', 'date', 'activity_type', 'count', 'minutes', 'points']
+    list_filter = ['activity_type']
+    list_select_related = ['user', 'activity_type']
+    search_fields = ['^user__username']
+    raw_id_fields = ['user']
 
 @admin.register(Team)
-class TeamAdmin(admin.ModelAdmin):
-    list_display = ['name', 'captain', 'member_count', 'is_active', 'created_at']
+class TeamAdmin(ScalableAdmin):
+    list_display = ['name', 'captain', 'member_count', 'total_points', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
-    search_fields = ['name', 'captain__username']
-    filter_horizontal = ['members']
+    list_select_related = ['captain']
+    search_fields = ['^name', '^captain__username']
+    # A select widget would render every user; these render the chosen ids only
+    raw_id_fields = ['captain', 'members']
 
+    def get_queryset(self, request):
+        # One correlated COUNT per displayed row, inside the changelist query
+        return super().get_queryset(request).annotate(member_count=related_count(Team.members.through, 'team_id'))
+
+    @admin.display(description='Members', ordering='member_count')
     def member_count(self, obj):
-        return obj.members.count()
-    member_count.short_description = 'Members'
+        return obj.member_count
 
 @admin.register(Challenge)
 class ChallengeAdmin(admin.ModelAdmin):
     list_display = ['title', 'challenge_type', 'target_metric', 'target_value', 'start_date', 'end_date', 'is_active']
     list_filter = ['challenge_type', 'target_metric', 'is_active', 'start_date']
     search_fields = ['title', 'description']
-    filter_horizontal = ['participants', 'team_participants']
+    raw_id_fields = ['participants']
+    autocomplete_fields = ['team_participants']
+
+@admin.register(ChallengeProgress)
+class ChallengeProgressAdmin(admin.ModelAdmin):
+    list_display = ['challenge', 'user', 'value', 'completed_at']
+    list_filter = ['challenge']
+    list_select_related = ['challenge', 'user']
+    search_fields = ['user__username', 'challenge__title']
+    raw_id_fields = ['user']
+
+@admin.register(ChallengeTeamProgress)
+class ChallengeTeamProgressAdmin(admin.ModelAdmin):
+    list_display = ['challenge', 'team', 'value', 'completed_at']
+    list_filter = ['challenge']
+    list_select_related = ['challenge', 'team']
+    search_fields = ['team__name', 'challenge__title']
+    autocomplete_fields = ['team']
 
 @admin.register(WorkoutSuggestion)
 class WorkoutSuggestionAdmin(admin.ModelAdmin):
     list_display = ['title', 'user', 'difficulty_level', 'recommended_duration', 'is_completed', 'created_at']
     list_filter = ['difficulty_level', 'is_completed', 'created_at']
+    list_select_related = ['user']
     search_fields = ['title', 'user__username']
+    raw_id_fields = ['user']
     filter_horizontal = ['activity_types']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'kind', 'status', 'progress_display', 'stage', 'attempts', 'worker',
+                    'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['kind', 'params', 'status', 'state', 'processed', 'total', 'attempts', 'error',
+                       'worker', 'heartbeat_at', 'created_at', 'started_at', 'finished_at']
+    actions = ['requeue']
+
+    def progress_display(self, obj):
+        if obj.progress is None:
+            return '-'
+        return f"{obj.progress}% ({obj.processed}/{obj.total})"
+    progress_display.short_description = 'Progress'
+
+    def stage(self, obj):
+        return obj.state.get('stage', '-')
+
+    @admin.action(description='Retry selected failed jobs from their last checkpoint')
+    def requeue(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='pending', error='', finished_at=None)
+        self.message_user(request, f"Requeued {updated} failed job(s)")
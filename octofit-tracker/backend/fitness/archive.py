@@ -0,0 +1,108 @@
+"""
+Archival of old activities.
+
+``archive_activities`` moves activities logged before a horizon from the live
+``Activity`` table into ``ArchivedActivity``, keeping their ids, points and
+batch. Their points stay in the user and team totals and their days stay in
+the daily rollups. Rows are removed from the live table with a plain SQL
+DELETE, which sends no ``post_delete``, so the points ledger does not
+subtract them. Recent-feed queries, stats and points writes then only touch
+the live table.
+
+Reads reach the archive through the ``ActivityHistory`` view, and only when
+their date range starts at or before ``archive_boundary()``, the newest
+archived ``date_logged``. Challenge progress rebuilds and bulk-upload replays
+read the view too, so archival may cross any challenge window or batch.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Activity, ActivityHistory, ArchivedActivity
+from .caching import get_cache
+from .replicas import primary_reads
+from .rollups import logged_at
+
+BOUNDARY_KEY = 'fitness:archive:boundary'
+# How long a process trusts its cached boundary; other workers' archive runs show up after this
+BOUNDARY_TIMEOUT = 60
+
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'activity_type_id', 'duration_minutes', 'intensity', 'distance',
+    'calories_burned', 'notes', 'date_logged', 'points_awarded', 'batch_id',
+)
+
+_MISSING = object()
+
+
+def archive_boundary():
+    """Newest archived date_logged, or None when nothing is archived"""
+    cache = get_cache()
+    boundary = cache.get(BOUNDARY_KEY, _MISSING)
+    if boundary is _MISSING:
+        with primary_reads():
+            boundary = ArchivedActivity.objects.aggregate(newest=Max('date_logged'))['newest']
+        cache.set(BOUNDARY_KEY, boundary, BOUNDARY_TIMEOUT)
+    return boundary
+
+
+def reaches_archive(start_date):
+    """Whether a range starting at ``start_date`` (None: unbounded) includes archived activities"""
+    boundary = archive_boundary()
+    if boundary is None:
+        return False
+    if not start_date:
+        return True
+    try:
+        start = logged_at({'date_logged': start_date})
+    except ValidationError:
+        # Let the live query report the bad value
+        return False
+    return start <= boundary
+
+
+def history_model(start_date):
+    """The model to read a user's activities from for a range starting at ``start_date``"""
+    return ActivityHistory if reaches_archive(start_date) else Activity
+
+
+def archive_cutoff(days=None, now=None):
+    """
+    Start of the day ``days`` (default ACTIVITY_ARCHIVE_AFTER_DAYS) ago.
+
+    Whole days only, so no rollup day is split between the tables.
+    """
+    days = settings.ACTIVITY_ARCHIVE_AFTER_DAYS if days is None else days
+    day = timezone.localdate(now) - datetime.timedelta(days=days)
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def archive_activities(cutoff, chunk_size=5000, dry_run=False):
+    """Move activities logged before ``cutoff`` to the archive in chunks; returns how many moved"""
+    old = Activity.objects.filter(date_logged__lt=cutoff)
+    if dry_run:
+        return old.count()
+
+    delete_sql = 'DELETE FROM {} WHERE {} IN ({{}})'.format(
+        connection.ops.quote_name(Activity._meta.db_table), connection.ops.quote_name(Activity._meta.pk.column)
+    )
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(old.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            ArchivedActivity.objects.bulk_create(
+                ArchivedActivity(**row) for row in Activity.objects.filter(pk__in=ids).values(*ARCHIVE_FIELDS)
+            )
+            # SQL sends no post_delete, so the points ledger, rollups and challenge progress keep these rows
+            with connection.cursor() as cursor:
+                cursor.execute(delete_sql.format(', '.join(['%s'] * len(ids))), ids)
+        moved += len(ids)
+
+    get_cache().delete(BOUNDARY_KEY)
+    return moved
@@ -0,0 +1,181 @@
+"""
+Async versions of the high-traffic read endpoints, for serving under ASGI.
+
+They return the same bodies as their DRF counterparts but await the ORM
+instead of holding a worker thread per request, so a single uvicorn worker
+can keep many concurrent pollers open.
+"""
+import asyncio
+import base64
+import binascii
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+
+from . import tokens
+from .leaderboard import leaderboard
+from .live import broker
+from .models import UserProfile
+from .pagination import ActivityCursorPagination
+from .serializers import ActivitySerializer, LeaderboardTeamSerializer, LeaderboardUserSerializer
+from .views import (
+    activity_queryset, stats_params_error, stats_payload, stats_querysets, team_leaderboard_queryset
+)
+
+
+def async_read_view(view):
+    """
+    GET-only, authenticated async view.
+
+    Django's own require_GET/login_required wrappers are sync in 4.x and
+    would push the view back onto a thread, so this does both checks
+    itself. A bearer token is checked on the loop with no DB read; a
+    session user is resolved off the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        token = tokens.bearer_token(request)
+        if token is not None:
+            claims = tokens.verify(token, tokens.ACCESS)
+            request.user = tokens.token_user(claims) if claims else AnonymousUser()
+        else:
+            request.user = await sync_to_async(get_user)(request)
+        if not request.user.is_authenticated:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'}, status=403
+            )
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def encode_cursor(activity):
+    return base64.urlsafe_b64encode(f'{activity.date_logged.isoformat()}|{activity.pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(date_logged, id) position from a cursor, or None if it is malformed"""
+    try:
+        date_logged, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        date_logged, pk = parse_datetime(date_logged), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    # parse_datetime returns None for anything that is not an ISO datetime
+    if date_logged is None:
+        return None
+    return date_logged, pk
+
+
+@async_read_view
+async def leaderboard_users(request):
+    """Get user leaderboard"""
+    rows = await sync_to_async(leaderboard.page)(1, 50)
+    profiles = {
+        profile.user_id: profile
+        async for profile in UserProfile.objects.select_related('user').filter(
+            user_id__in=[user_id for rank, user_id, points in rows]
+        )
+    }
+    ranked = []
+    for rank, user_id, points in rows:
+        profile = profiles.get(user_id)
+        if profile is not None:
+            profile.rank = rank
+            ranked.append(profile)
+    return JsonResponse(LeaderboardUserSerializer(ranked, many=True).data, safe=False)
+
+
+@async_read_view
+async def leaderboard_teams(request):
+    """Get team leaderboard"""
+    teams = [team async for team in team_leaderboard_queryset()]
+    for idx, team in enumerate(teams):
+        team.rank = idx + 1
+    return JsonResponse(LeaderboardTeamSerializer(teams, many=True).data, safe=False)
+
+
+@async_read_view
+async def activity_list(request):
+    """
+    Get the user's activity history, newest first.
+
+    Keyset-paginated on (date_logged, id) like the sync endpoint; follow
+    the `next` link for older pages.
+    """
+    paginator = ActivityCursorPagination()
+    try:
+        page_size = min(int(request.GET.get('page_size', paginator.page_size)), paginator.max_page_size)
+    except ValueError:
+        page_size = paginator.page_size
+
+    # Picking live vs archived tables may look up the archive boundary
+    queryset = await sync_to_async(activity_queryset)(
+        request.user, request.GET.get('start_date'), request.GET.get('end_date'), history=True
+    )
+    queryset = queryset.order_by(*paginator.ordering)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return JsonResponse({'detail': 'Invalid cursor'}, status=404)
+        date_logged, pk = position
+        queryset = queryset.filter(date_logged__lte=date_logged).exclude(date_logged=date_logged, id__gte=pk)
+
+    # One extra row tells us whether there is a next page without a COUNT(*)
+    activities = [activity async for activity in queryset[:page_size + 1]]
+    next_url = None
+    if len(activities) > page_size:
+        activities = activities[:page_size]
+        query = request.GET.copy()
+        query['cursor'] = encode_cursor(activities[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    return JsonResponse({
+        'next': next_url,
+        'results': ActivitySerializer(activities, many=True).data,
+    })
+
+
+@async_read_view
+async def activity_stats(request):
+    """Get user's activity statistics, optionally with a day/week/month time series"""
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    group_by = request.GET.get('group_by')
+    error = stats_params_error(start_date, end_date, group_by)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    # Picking live vs archived tables may look up the archive boundary
+    breakdown, time_series = await sync_to_async(stats_querysets)(request.user, start_date, end_date, group_by)
+
+    async def rows(queryset):
+        return [row async for row in queryset]
+
+    if group_by:
+        breakdown_rows, time_series_rows = await asyncio.gather(rows(breakdown), rows(time_series))
+    else:
+        breakdown_rows, time_series_rows = await rows(breakdown), None
+    return JsonResponse(stats_payload(breakdown_rows, time_series_rows))
+
+
+@async_read_view
+async def leaderboard_stream(request):
+    """
+    Server-Sent Events stream of the user and team leaderboards.
+
+    Sends a `snapshot` event with both boards, then `users` and `teams`
+    events holding only the rows that changed (`changed`) and the ids that
+    dropped off (`removed`). Needs ASGI: under WSGI each client would hold
+    a worker thread.
+    """
+    response = StreamingHttpResponse(broker.stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,371 @@
+"""
+Query-count and latency benchmarks for the fitness API.
+
+``seed`` fills the database with a synthetic dataset at a configurable scale
+and ``run`` drives every GET route registered in ``fitness.urls`` through
+the DRF test client, recording p50/p95 latency, query count and peak Python
+memory per endpoint, with the response cache switched off so every request
+runs its view. ``compare`` checks a run against a stored baseline.
+``serializer_throughput`` compares rows/second of the nested and compact
+(``?view=compact``) serializers, and ``write_load`` measures concurrent
+activity-logging throughput (the ``loadtest_writes`` command).
+The ``benchmark`` management command ties these together.
+"""
+import random
+import threading
+import time
+import tracemalloc
+from statistics import quantiles
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .leaderboard import leaderboard
+from .models import (
+    INTENSITY_MULTIPLIERS, UserProfile, Team, ActivityType, Activity, Challenge, WorkoutSuggestion
+)
+from .points import reconcile_user_points, reconcile_team_points
+from . import progress, rollups
+from .serializers import (
+    ActivitySerializer, TeamSerializer, LeaderboardUserSerializer, LeaderboardTeamSerializer,
+    CompactActivitySerializer, CompactTeamSerializer, CompactLeaderboardUserSerializer,
+    CompactLeaderboardTeamSerializer
+)
+from .urls import router
+from .queries import related_count
+from .views import team_queryset
+
+BENCH_USERNAME = 'bench-user'
+BATCH_SIZE = 5000
+
+ACTIVITY_TYPES = [
+    ('Running', 'cardio', 10), ('Cycling', 'cardio', 8), ('Swimming', 'cardio', 12),
+    ('Weightlifting', 'strength', 6), ('Yoga', 'flexibility', 4), ('Basketball', 'sports', 9),
+]
+
+
+def _batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(users=10000, activities=1000000, teams=5000, challenges=200, suggestions=20000, rng_seed=0):
+    """Insert a synthetic dataset; the first user is the one the benchmark logs in as"""
+    rng = random.Random(rng_seed)
+    now = timezone.now()
+
+    with transaction.atomic():
+        activity_types = [
+            ActivityType.objects.get_or_create(
+                name=name, defaults={'category': category, 'points_per_minute': rate}
+            )[0]
+            for name, category, rate in ACTIVITY_TYPES
+        ]
+
+        User.objects.bulk_create(
+            (User(username=BENCH_USERNAME if i == 0 else f'bench-{i}', password='!') for i in range(users)),
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = list(User.objects.filter(username__startswith='bench-').order_by('pk').values_list('pk', flat=True))
+        levels = ['beginner', 'intermediate', 'advanced']
+        UserProfile.objects.bulk_create(
+            (UserProfile(user_id=user_id, fitness_level=rng.choice(levels)) for user_id in user_ids),
+            batch_size=BATCH_SIZE,
+        )
+
+        def activity_rows():
+            intensities = list(INTENSITY_MULTIPLIERS)
+            for i in range(activities):
+                # Give the benchmark user a steady share of the history
+                user_id = user_ids[0] if i % 100 == 0 else rng.choice(user_ids)
+                activity_type = rng.choice(activity_types)
+                duration = rng.randint(10, 120)
+                intensity = rng.choice(intensities)
+                yield Activity(
+                    user_id=user_id, activity_type=activity_type, duration_minutes=duration,
+                    intensity=intensity, date_logged=now - timezone.timedelta(minutes=rng.randint(0, 525600)),
+                    points_awarded=int(duration * activity_type.points_per_minute * INTENSITY_MULTIPLIERS[intensity]),
+                )
+
+        for batch in _batched(activity_rows()):
+            Activity.objects.bulk_create(batch)
+
+        Team.objects.bulk_create(
+            (Team(name=f'bench-team-{i}', captain_id=rng.choice(user_ids)) for i in range(teams)),
+            batch_size=BATCH_SIZE,
+        )
+        team_ids = list(Team.objects.filter(name__startswith='bench-team-').values_list('pk', flat=True))
+        Membership = Team.members.through
+
+        def membership_rows():
+            for team_id in team_ids:
+                members = set(rng.sample(user_ids, min(len(user_ids), rng.randint(3, 12))))
+                if team_id == team_ids[0]:
+                    members.add(user_ids[0])
+                for user_id in members:
+                    yield Membership(team_id=team_id, user_id=user_id)
+            for team_id in rng.sample(team_ids, min(len(team_ids), 10)):
+                yield Membership(team_id=team_id, user_id=user_ids[0])
+
+        for batch in _batched(membership_rows()):
+            Membership.objects.bulk_create(batch, ignore_conflicts=True)
+
+        Challenge.objects.bulk_create(
+            Challenge(
+                title=f'bench-challenge-{i}', description='', target_value=1000,
+                challenge_type='team' if i % 2 else 'individual',
+                start_date=now, end_date=now + timezone.timedelta(days=30),
+            )
+            for i in range(challenges)
+        )
+        challenge_ids = list(Challenge.objects.filter(title__startswith='bench-challenge-').values_list('pk', flat=True))
+        Challenge.participants.through.objects.bulk_create(
+            Challenge.participants.through(challenge_id=challenge_id, user_id=user_id)
+            for challenge_id in challenge_ids
+            for user_id in {user_ids[0], *rng.sample(user_ids, min(len(user_ids), 20))}
+        )
+        Challenge.team_participants.through.objects.bulk_create(
+            Challenge.team_participants.through(challenge_id=challenge_id, team_id=team_id)
+            for challenge_id in challenge_ids
+            for team_id in rng.sample(team_ids, min(len(team_ids), 5))
+        )
+
+        WorkoutSuggestion.objects.bulk_create(
+            (
+                WorkoutSuggestion(
+                    user_id=user_ids[0] if i % 50 == 0 else rng.choice(user_ids),
+                    title=f'bench-suggestion-{i}', description='',
+                    recommended_duration=30, difficulty_level=rng.choice(levels),
+                )
+                for i in range(suggestions)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        suggestion_ids = WorkoutSuggestion.objects.filter(title__startswith='bench-suggestion-').values_list('pk', flat=True)
+        for batch in _batched(
+            WorkoutSuggestion.activity_types.through(workoutsuggestion_id=suggestion_id, activitytype_id=activity_type.pk)
+            for suggestion_id in suggestion_ids.iterator()
+            for activity_type in rng.sample(activity_types, 2)
+        ):
+            WorkoutSuggestion.activity_types.through.objects.bulk_create(batch)
+
+        # bulk_create bypasses the points ledger, rollups and challenge progress
+        reconcile_user_points()
+        reconcile_team_points()
+        rollups.backfill()
+        for challenge in Challenge.objects.filter(pk__in=challenge_ids):
+            progress.rebuild_progress(challenge)
+
+    leaderboard.invalidate()
+
+
+def get_routes():
+    """(url_name, basename, is_detail) for every GET route registered in fitness.urls"""
+    routes = []
+    for prefix, viewset, basename in router.registry:
+        if hasattr(viewset, 'list'):
+            routes.append((f'{basename}-list', basename, False))
+        if hasattr(viewset, 'retrieve'):
+            routes.append((f'{basename}-detail', basename, True))
+        for extra_action in viewset.get_extra_actions():
+            if 'get' in extra_action.mapping:
+                routes.append((f'{basename}-{extra_action.url_name}', basename, extra_action.detail))
+    return routes
+
+
+def _first_id(client, basename):
+    data = client.get(reverse(f'{basename}-list')).json()
+    rows = data['results'] if isinstance(data, dict) else data
+    return rows[0]['id'] if rows else None
+
+
+def _get(client, url):
+    """GET ``url``, reading streamed bodies to the end so they are measured too"""
+    # A zero timeout stores nothing, so cached endpoints render every time; versions stay cached as in a warm worker
+    with override_settings(FITNESS_RESPONSE_CACHE_TIMEOUT=0):
+        response = client.get(url)
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def run(iterations=20, username=BENCH_USERNAME):
+    """Benchmark every GET route as ``username``; returns {route: metrics}"""
+    client = APIClient()
+    client.force_authenticate(User.objects.get(username=username))
+    len(leaderboard)  # build it outside the measurements, like a warm worker
+
+    results = {}
+    for name, basename, is_detail in get_routes():
+        if is_detail:
+            pk = _first_id(client, basename)
+            if pk is None:
+                continue
+            url = reverse(name, kwargs={'pk': pk})
+        else:
+            url = reverse(name)
+
+        # Warm up, then count queries on a steady-state request
+        _get(client, url)
+        with CaptureQueriesContext(connection) as queries:
+            response = _get(client, url)
+        # Read now: the next request resets the connection's query log
+        query_count = len(queries)
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            _get(client, url)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        tracemalloc.start()
+        _get(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        cuts = quantiles(timings, n=20, method='inclusive') if len(timings) > 1 else timings * 19
+        results[name] = {
+            'status': response.status_code,
+            'p50_ms': round(cuts[9], 3),
+            'p95_ms': round(cuts[18], 3),
+            'queries': query_count,
+            'peak_kb': round(peak / 1024, 1),
+        }
+    return results
+
+
+def serializer_throughput(rows=2000, repeat=5):
+    """
+    Rows/second for fetching and serializing up to ``rows`` rows with the
+    nested serializers and with their compact counterparts; best of ``repeat``.
+    """
+    activities = Activity.objects.select_related('user', 'activity_type').order_by('-date_logged', '-id')
+    teams = team_queryset().order_by('pk')
+    ranked_teams = Team.objects.annotate(
+        member_count=related_count(Team.members.through, 'team_id')
+    ).order_by('-total_points', 'pk')
+    profiles = UserProfile.objects.select_related('user').order_by('-total_points')
+    cases = {
+        'activities': (
+            lambda: ActivitySerializer(activities[:rows], many=True).data,
+            lambda: CompactActivitySerializer(CompactActivitySerializer.shape(activities)[:rows], many=True).data,
+        ),
+        'teams': (
+            lambda: TeamSerializer(teams[:rows], many=True).data,
+            lambda: CompactTeamSerializer(CompactTeamSerializer.shape(teams)[:rows], many=True).data,
+        ),
+        'leaderboard-teams': (
+            lambda: LeaderboardTeamSerializer(ranked_teams[:rows], many=True).data,
+            lambda: CompactLeaderboardTeamSerializer(
+                CompactLeaderboardTeamSerializer.shape(ranked_teams)[:rows], many=True
+            ).data,
+        ),
+        'leaderboard-users': (
+            lambda: LeaderboardUserSerializer(profiles[:rows], many=True).data,
+            lambda: CompactLeaderboardUserSerializer(
+                profiles.values('user_id', 'total_points', username=F('user__username'))[:rows], many=True
+            ).data,
+        ),
+    }
+
+    results = {}
+    for name, (nested, compact) in cases.items():
+        timings = {}
+        for label, serialize in (('nested', nested), ('compact', compact)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                count = len(serialize())
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = count / best if count and best else 0.0
+        results[name] = {
+            'rows': count,
+            'nested_rows_per_s': round(timings['nested']),
+            'compact_rows_per_s': round(timings['compact']),
+            'speedup': round(timings['compact'] / timings['nested'], 2) if timings['nested'] else None,
+        }
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """List human-readable regressions of ``results`` against ``baseline``"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if metrics['queries'] > base['queries']:
+            regressions.append(f"{name}: {metrics['queries']} queries (baseline {base['queries']})")
+        for key in ('p95_ms', 'peak_kb'):
+            if metrics[key] > base[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {metrics[key]} (baseline {base[key]})")
+    return regressions
+
+
+def write_load(threads=8, writes_per_thread=50):
+    """
+    POST activities from ``threads`` users at once, each on its own connection.
+
+    Returns overall writes/second, p50/p95 latency of successful writes and
+    the number of writes that failed (e.g. "database is locked").
+    """
+    activity_type, _ = ActivityType.objects.get_or_create(
+        name='Running', defaults={'category': 'cardio', 'points_per_minute': 10}
+    )
+    users = [User.objects.get_or_create(username=f'load-{i}')[0] for i in range(threads)]
+    latencies = []
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+
+    def post_activities(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        barrier.wait()
+        try:
+            for _ in range(writes_per_thread):
+                start = time.perf_counter()
+                try:
+                    response = client.post(
+                        '/api/activities/', {'activity_type_id': activity_type.pk, 'duration_minutes': 30},
+                        format='json',
+                    )
+                except OperationalError as error:
+                    errors.append(error)
+                    continue
+                if response.status_code == 201:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=post_activities, args=(user,)) for user in users]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    cuts = quantiles(latencies, n=20, method='inclusive') if len(latencies) > 1 else (latencies or [0]) * 19
+    return {
+        'writes_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(cuts[9], 3),
+        'p95_ms': round(cuts[18], 3),
+        'errors': len(errors),
+    }
@@ -0,0 +1,110 @@
+"""
+Response caching for read-mostly endpoints.
+
+Each cached endpoint depends on one or more version scopes (e.g.
+``'leaderboard'`` or ``'activities:{user}'``). Writes bump the versions of
+the scopes they affect, after commit. A response is cached under a key
+derived from the request and the current versions, so a bump orphans the old
+entries, and the same key doubles as the ETag. Conditional GETs that match
+are answered with 304 without running the view. No Last-Modified is sent:
+it has one-second resolution, so If-Modified-Since would answer 304 for a
+change made in the same second.
+
+Versions and responses live in Django's cache (``FITNESS_CACHE_ALIAS``). Use
+a file-based cache when several worker processes must share invalidations.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+
+from . import replicas
+
+VERSION_KEY = 'fitness:version:{}'
+RESPONSE_KEY = 'fitness:response:{}'
+
+# Called with the scopes of every committed bump in this process (e.g. by fitness/live.py)
+bump_listeners = []
+
+
+def get_cache():
+    return caches[getattr(settings, 'FITNESS_CACHE_ALIAS', 'default')]
+
+
+def get_versions(scopes):
+    """{scope: version}; a scope seen for the first time starts at the current time"""
+    cache = get_cache()
+    keys = {VERSION_KEY.format(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump(*scopes):
+    """Invalidate every cached response that depends on the given scopes, once committed"""
+    def do_bump():
+        get_cache().set_many({VERSION_KEY.format(scope): time.time_ns() for scope in scopes}, timeout=None)
+        for listener in bump_listeners:
+            listener(scopes)
+    transaction.on_commit(do_bump)
+
+
+def cache_response(*scopes, per_user=False):
+    """
+    Cache a viewset handler's rendered response and answer conditional GETs.
+
+    ``scopes`` may contain ``{user}``, which is filled with the requesting
+    user's id. Set ``per_user`` when the response depends on the user.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            user_id = request.user.pk
+            versions = get_versions([scope.format(user=user_id) for scope in scopes])
+            renderer, media_type = self.perform_content_negotiation(request)
+            key_source = repr((
+                request.get_full_path(), media_type, user_id if per_user else None, sorted(versions.items())
+            ))
+            key = hashlib.sha1(key_source.encode()).hexdigest()
+            etag = quote_etag(key)
+
+            not_modified = get_conditional_response(request._request, etag=etag)
+            if not_modified is not None:
+                return _with_validators(not_modified, etag)
+
+            cache = get_cache()
+            cached = cache.get(RESPONSE_KEY.format(key))
+            if cached is None:
+                # Whatever is cached under these versions must include the writes that bumped them
+                replicas.require_snapshot(max(versions.values()))
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                content = renderer.render(response.data, media_type, self.get_renderer_context())
+                cached = (content, f'{media_type}; charset={renderer.charset}' if renderer.charset else media_type)
+                cache.set(
+                    RESPONSE_KEY.format(key), cached,
+                    timeout=getattr(settings, 'FITNESS_RESPONSE_CACHE_TIMEOUT', 300)
+                )
+
+            content, content_type = cached
+            return _with_validators(HttpResponse(content, content_type=content_type), etag)
+        return wrapper
+    return decorator
+
+
+def _with_validators(response, etag):
+    response['ETag'] = etag
+    # Clients may keep the response but must revalidate it on every use
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,53 @@
+"""
+In-process ActivityType registry.
+
+The activity type catalog is a few rows that nearly every activity write
+and catalog request needs, so each worker keeps all of it in memory. The
+registry is tagged with the version of the ``activity_types`` cache scope
+it was loaded at (see fitness/caching.py). Saving or deleting a type bumps
+that version on commit, so every process reloads on its next access; the
+saving process also drops its copy at once, so it never prices with a rate
+its own transaction has just changed.
+
+Instances handed out are shared between requests and threads; treat them as
+read-only and edit types through a fresh query.
+"""
+import threading
+
+from .models import ActivityType
+from . import caching
+from .replicas import primary_reads
+
+SCOPE = 'activity_types'
+
+
+class ActivityTypeCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._types = {}    # id -> ActivityType, in id order
+
+    def _current(self):
+        version = caching.get_versions([SCOPE])[SCOPE]
+        with self._lock:
+            if version != self._version:
+                # A replica may predate the edit that bumped the version
+                with primary_reads():
+                    self._types = ActivityType.objects.order_by('pk').in_bulk()
+                self._version = version
+            return self._types
+
+    def invalidate(self):
+        """Force a reload on next access"""
+        with self._lock:
+            self._version = None
+
+    def all(self):
+        return list(self._current().values())
+
+    def get(self, type_id):
+        """The ActivityType with this id, or None"""
+        return self._current().get(type_id)
+
+
+activity_catalog = ActivityTypeCatalog()
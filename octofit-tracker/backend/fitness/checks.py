@@ -0,0 +1,54 @@
+"""
+System checks for the fitness app's deployment settings.
+
+Response cache versions, the activity type catalog's version and the
+archive boundary live in the FITNESS_CACHE_ALIAS cache, revoked token ids in
+FITNESS_TOKEN_CACHE_ALIAS. A process-local backend keeps each worker's
+invalidations to itself, so other workers serve stale responses and catalog
+entries until their entries time out, and accept revoked tokens until they
+expire.
+``manage.py check --deploy`` warns about that. With read replicas it is an
+error: the version bumps that keep a user on the primary until a replica has
+their writes are in the same cache, so other workers would route the user
+to a replica without them.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def fitness_cache(setting='FITNESS_CACHE_ALIAS', default='default'):
+    """(alias, backend path) of a cache the fitness app shares state through"""
+    alias = getattr(settings, setting, default)
+    return alias, settings.CACHES.get(alias, {}).get('BACKEND')
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    shared = {
+        fitness_cache(): 'serve stale cached responses and catalog entries',
+        fitness_cache('FITNESS_TOKEN_CACHE_ALIAS', 'tokens'): 'accept revoked tokens',
+    }
+    return [
+        Warning(
+            f"The '{alias}' cache ({backend}) is local to each process.",
+            hint='With more than one worker process, set FITNESS_CACHE_DIR or configure a shared cache backend; '
+                 f'otherwise the other workers {consequence}.',
+            id='fitness.W001',
+        )
+        for (alias, backend), consequence in shared.items() if backend in PROCESS_LOCAL_CACHES
+    ]
+
+
+@register(Tags.caches, Tags.database)
+def check_replica_cache(app_configs, **kwargs):
+    alias, backend = fitness_cache()
+    if not settings.READ_REPLICAS or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f"READ_REPLICAS is set but the '{alias}' cache ({backend}) is local to each process.",
+        hint='Set FITNESS_CACHE_DIR or configure a shared cache backend, so every worker sees '
+             'the write versions that keep users reading their own writes.',
+        id='fitness.E001',
+    )]
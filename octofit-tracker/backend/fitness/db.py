@@ -0,0 +1,117 @@
+"""
+Database tuning for concurrent writers.
+
+``tune_sqlite`` applies ``SQLITE_PRAGMAS`` to every new SQLite connection.
+``write_coalescer`` groups inserts that arrive at the same time from
+different request threads into one transaction: SQLite takes a single write
+lock, and with WAL a single commit, for the whole group instead of one per
+insert. Both are switched on by the production database profile in
+settings.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to a newly opened SQLite connection"""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    pragmas = settings.SQLITE_PRAGMAS
+    if connection.alias in settings.READ_REPLICAS:
+        # Replica files are replaced whole by sync_replicas and must stay out of WAL mode
+        pragmas = {name: value for name, value in pragmas.items() if name not in ('journal_mode', 'synchronous')}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class _Write:
+    def __init__(self, instance):
+        self.instance = instance
+        self.error = None
+        self.lead = False
+        self.ready = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    Group commits for model saves from concurrent threads.
+
+    The first caller becomes the leader: it waits FITNESS_WRITE_COALESCE_MS
+    for other callers to queue their instances, saves up to
+    FITNESS_WRITE_COALESCE_MAX of them in one transaction (each in its own
+    savepoint, so one failure does not sink the rest) and hands leadership
+    to the oldest caller still waiting. Every caller returns once its own
+    instance is committed, or raises its own error.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leading = False
+
+    def save(self, instance):
+        write = _Write(instance)
+        with self._lock:
+            self._pending.append(write)
+            if not self._leading:
+                self._leading = write.lead = True
+        if not write.lead:
+            write.ready.wait()
+        if write.lead:
+            self._lead()
+        if write.error is not None:
+            raise write.error
+        return instance
+
+    def _lead(self):
+        time.sleep(settings.FITNESS_WRITE_COALESCE_MS / 1000)
+        with self._lock:
+            batch = self._pending[:settings.FITNESS_WRITE_COALESCE_MAX]
+            del self._pending[:len(batch)]
+
+        try:
+            with transaction.atomic():
+                for write in batch:
+                    try:
+                        with transaction.atomic():
+                            write.instance.save()
+                    except Exception as error:
+                        write.error = error
+        except Exception as error:
+            # The commit itself failed, so none of the batch was stored
+            for write in batch:
+                write.error = write.error or error
+
+        with self._lock:
+            if self._pending:
+                # The oldest waiter leads the next batch
+                self._pending[0].lead = True
+                self._pending[0].ready.set()
+            else:
+                self._leading = False
+        for write in batch:
+            write.lead = False
+            write.ready.set()
+
+
+write_coalescer = WriteCoalescer()
+
+
+def save_coalesced(instance):
+    """
+    Save ``instance``, sharing a transaction with concurrent saves when coalescing is on.
+
+    Callers already inside a transaction save directly: the leader works on
+    its own connection and could not see their uncommitted rows.
+    """
+    if settings.FITNESS_WRITE_COALESCING and not transaction.get_connection().in_atomic_block:
+        return write_coalescer.save(instance)
+    instance.save()
+    return instance
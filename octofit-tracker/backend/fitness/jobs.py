@@ -0,0 +1,215 @@
+"""
+Database-backed background job queue.
+
+``enqueue`` adds a ``Job`` row and ``run_worker`` processes claim jobs one at
+a time with a compare-and-swap UPDATE, so any number of workers can share
+the queue. Handlers work in chunks and ``checkpoint`` after each one in the
+same transaction as the chunk's writes: a worker that dies leaves a resume
+point, and once the job's heartbeat goes stale another worker picks it up
+from there.
+
+``recalculate_points`` re-prices every activity of an ActivityType after its
+``points_per_minute`` changes, then refreshes the rollups, totals and
+challenge progress that depend on those points. Archived activities keep
+the price they were logged at. ``generate_suggestions`` regenerates every
+user's workout suggestions.
+"""
+import logging
+import time
+import traceback
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import (
+    INTENSITY_MULTIPLIERS, Activity, ActivityHistory, ActivityType, Challenge, DailyActivityRollup, Job, Team,
+    UserProfile,
+)
+from . import caching, leaderboard, progress, suggestions
+from .points import reconcile_team_points, reconcile_user_points
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a function as the handler for jobs of ``kind``"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **params):
+    """
+    Queue a job once the current transaction commits.
+
+    A job that is still pending with the same params is not queued twice;
+    handlers read current data when they run, so one run covers both.
+    """
+    def create():
+        if not Job.objects.filter(kind=kind, params=params, status='pending').exists():
+            Job.objects.create(kind=kind, params=params)
+    transaction.on_commit(create)
+
+
+def claim(worker):
+    """Take the oldest runnable job for ``worker``, or None when the queue is empty"""
+    stale = timezone.now() - timezone.timedelta(seconds=settings.JOB_STALE_SECONDS)
+    runnable = Q(status='pending') | Q(status='running', heartbeat_at__lt=stale)
+    for job in Job.objects.filter(runnable).order_by('created_at', 'pk')[:10]:
+        now = timezone.now()
+        # Only one worker's UPDATE can match the status/heartbeat it read
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at).update(
+            status='running', worker=worker, heartbeat_at=now, attempts=F('attempts') + 1,
+            started_at=Coalesce(F('started_at'), Value(now)),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def checkpoint(job, **fields):
+    """Save ``job`` progress and renew its heartbeat; call inside the chunk's transaction"""
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=[*fields, 'heartbeat_at'])
+
+
+def run_job(job):
+    """Run a claimed job to completion, recording success or failure"""
+    try:
+        HANDLERS[job.kind](job)
+    except Exception:
+        logger.exception("Job %s failed", job.pk)
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+    else:
+        job.status = 'done'
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+
+def work(worker, once=False, poll_seconds=2):
+    """Claim and run jobs until stopped; with ``once``, stop when the queue is empty"""
+    while True:
+        job = claim(worker)
+        if job is not None:
+            logger.info("Worker %s running %s", worker, job)
+            run_job(job)
+        elif once:
+            return
+        else:
+            time.sleep(poll_seconds)
+
+
+def recalculated_points(points_per_minute):
+    """SQL for Activity.calculate_points with the given rate"""
+    multiplier = Case(
+        *[When(intensity=intensity, then=Value(value)) for intensity, value in INTENSITY_MULTIPLIERS.items()],
+        output_field=models.FloatField(),
+    )
+    # CAST truncates towards zero like int(); the product is evaluated in the same order
+    return Cast(F('duration_minutes') * Value(points_per_minute) * multiplier, models.IntegerField())
+
+
+@handler('recalculate_points')
+def recalculate_points(job):
+    """
+    Re-price an activity type's activities in id-ordered chunks, then refresh what depends on them.
+
+    Stages run in order and are resumable: ``activities`` and ``rollups``
+    walk their tables by primary key from ``state['last_id']``; ``totals``
+    reconciles the affected users and teams; ``progress`` rebuilds active
+    points challenges.
+    """
+    chunk_size = settings.JOB_CHUNK_SIZE
+    activity_type = ActivityType.objects.filter(pk=job.params['activity_type_id']).first()
+    if activity_type is None:
+        return
+    activities = Activity.objects.filter(activity_type=activity_type)
+    state = {'stage': 'activities', 'last_id': 0, **job.state}
+
+    if state['stage'] == 'activities':
+        if job.total is None:
+            checkpoint(job, total=activities.count())
+        points = recalculated_points(activity_type.points_per_minute)
+        while True:
+            upper = activities.filter(pk__gt=state['last_id']).order_by('pk').values_list(
+                'pk', flat=True
+            )[chunk_size - 1:chunk_size].first()
+            chunk = activities.filter(pk__gt=state['last_id'])
+            if upper is not None:
+                chunk = chunk.filter(pk__lte=upper)
+            with transaction.atomic():
+                # Only rows whose price actually changes are written
+                chunk.exclude(points_awarded=points).update(points_awarded=points)
+                if upper is None:
+                    state = {'stage': 'rollups', 'last_id': 0}
+                    checkpoint(job, state=state, processed=job.total)
+                else:
+                    state['last_id'] = upper
+                    checkpoint(job, state=state, processed=min(job.processed + chunk_size, job.total))
+            if upper is None:
+                break
+
+    if state['stage'] == 'rollups':
+        # Archived days keep their points; archival moves whole days, so each rollup is one or the other
+        day_points = ActivityHistory.objects.filter(
+            user_id=OuterRef('user_id'), activity_type=activity_type, date_logged__date=OuterRef('date')
+        ).order_by().values('user_id').annotate(total=Sum('points_awarded')).values('total')
+        rollups = DailyActivityRollup.objects.filter(activity_type=activity_type)
+        last_rollup = rollups.aggregate(last=Max('pk'))['last'] or 0
+        while state['last_id'] < last_rollup:
+            upper = state['last_id'] + chunk_size
+            with transaction.atomic():
+                rollups.filter(pk__gt=state['last_id'], pk__lte=upper).update(
+                    points=Coalesce(Subquery(day_points), Value(0))
+                )
+                state['last_id'] = upper
+                checkpoint(job, state=state)
+        state = {'stage': 'totals'}
+        checkpoint(job, state=state)
+
+    if state['stage'] == 'totals':
+        with transaction.atomic():
+            user_ids = activities.order_by().values('user_id').distinct()
+            changes = reconcile_user_points(user_ids=user_ids)
+            team_ids = Team.members.through.objects.filter(user_id__in=user_ids).values('team_id')
+            reconcile_team_points(team_ids=team_ids)
+            state = {'stage': 'progress'}
+            checkpoint(job, state=state)
+            transaction.on_commit(leaderboard.leaderboard.invalidate)
+            caching.bump(
+                'leaderboard', 'teams', *(f'activities:{user_id}' for user_id, stored, actual in changes)
+            )
+
+    if state['stage'] == 'progress':
+        for challenge in Challenge.objects.filter(is_active=True, target_metric='points'):
+            with transaction.atomic():
+                progress.rebuild_progress(challenge)
+        checkpoint(job, state={'stage': 'done'})
+
+
+@handler('generate_suggestions')
+def generate_suggestions(job):
+    """Replace every user's open workout suggestions, one chunk of users per checkpoint"""
+    chunk_size = settings.JOB_CHUNK_SIZE
+    catalog = suggestions.Catalog()
+    state = {'last_user_id': 0, **job.state}
+    if job.total is None:
+        checkpoint(job, total=UserProfile.objects.filter(user_id__gt=state['last_user_id']).count())
+    while True:
+        with transaction.atomic():
+            last_user_id, users, written = suggestions.generate_chunk(state['last_user_id'], chunk_size, catalog)
+            if last_user_id is None:
+                break
+            state['last_user_id'] = last_user_id
+            checkpoint(job, state=state, processed=min(job.processed + users, job.total))
@@ -0,0 +1,170 @@
+"""
+In-process user leaderboard.
+
+Keeps every profile's (points, user_id) in a sorted list so rank lookups are
+a binary search instead of a COUNT over the profile table. The structure is
+fed by the points ledger after each commit and rebuilt from the database on
+first use. Like the activity type catalog (fitness/catalog.py) it is tagged
+with the version of the ``leaderboard`` cache scope it was loaded at, so a
+write committed by any worker, which bumps that scope, makes every process
+rebuild on its next read. It is also rebuilt once it is older than
+``LEADERBOARD_REBUILD_SECONDS``, for changes that bypass the ledger.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import UserProfile
+from . import caching
+from .replicas import primary_reads
+
+SCOPE = 'leaderboard'
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []      # sorted (-points, user_id)
+        self._points = {}    # user_id -> points
+        self._built_at = None
+        self._version = None
+        # Users whose points changed while a rebuild was scanning, or None outside a rebuild
+        self._touched = None
+
+    def _ensure_built(self):
+        version = caching.get_versions([SCOPE])[SCOPE]
+        max_age = getattr(settings, 'LEADERBOARD_REBUILD_SECONDS', 300)
+        if self._built_at is None or version != self._version or time.monotonic() - self._built_at > max_age:
+            self.rebuild(version)
+
+    def _load(self, user_ids=None):
+        """{user_id: total_points} for every profile, or those of ``user_ids``"""
+        rows = UserProfile.objects.values_list('user_id', 'total_points')
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        # Deltas after this load come from the points ledger, so it must not lag behind it
+        with primary_reads():
+            return dict(rows.iterator(chunk_size=5000))
+
+    def _touch(self, user_id):
+        if self._touched is not None:
+            self._touched.add(user_id)
+
+    def rebuild(self, version=None):
+        """
+        Reload every profile's total from the database.
+
+        ``version`` is the scope version read before the reload; a bump after
+        it triggers another rebuild. Updates that land while the table is
+        scanned may be missing from the scan, so the users they touched are
+        read again after the swap, until a re-read completes with no new
+        updates.
+        """
+        if version is None:
+            version = caching.get_versions([SCOPE])[SCOPE]
+        with self._lock:
+            self._touched = set()
+        points = self._load()
+        keys = sorted((-total, user_id) for user_id, total in points.items())
+        with self._lock:
+            self._points = points
+            self._keys = keys
+            self._built_at = time.monotonic()
+            self._version = version
+            touched = self._touched
+            self._touched = set() if touched else None
+        while touched:
+            fresh = self._load(touched)
+            with self._lock:
+                for user_id in touched:
+                    if user_id in fresh:
+                        self._set(user_id, fresh[user_id])
+                    else:
+                        self._remove(user_id)
+                touched = self._touched
+                self._touched = set() if touched else None
+
+    def invalidate(self):
+        """Force a rebuild on next access"""
+        with self._lock:
+            self._built_at = None
+
+    def _set(self, user_id, total):
+        old = self._points.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        self._points[user_id] = total
+        insort(self._keys, (-total, user_id))
+
+    def _remove(self, user_id):
+        old = self._points.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+
+    def set_points(self, user_id, total):
+        with self._lock:
+            self._touch(user_id)
+            if self._built_at is not None:
+                self._set(user_id, total)
+
+    def add_points(self, user_id, delta):
+        with self._lock:
+            self._touch(user_id)
+            if user_id in self._points:
+                self._set(user_id, self._points[user_id] + delta)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._touch(user_id)
+            self._remove(user_id)
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_built()
+            return len(self._keys)
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they have no profile"""
+        with self._lock:
+            self._ensure_built()
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return bisect_left(self._keys, (-points, user_id)) + 1
+
+    def points(self, user_id):
+        with self._lock:
+            self._ensure_built()
+            return self._points.get(user_id)
+
+    def page(self, start, count):
+        """[(rank, user_id, points)] for ranks start..start+count-1"""
+        with self._lock:
+            self._ensure_built()
+            start = max(start, 1)
+            rows = self._keys[start - 1:start - 1 + count]
+        return [(start + idx, user_id, -neg_points) for idx, (neg_points, user_id) in enumerate(rows)]
+
+    def around(self, user_id, radius):
+        """Ranks within ``radius`` places of a user, or [] if they have no profile"""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(rank - radius, 1)
+        return self.page(start, rank + radius - start + 1)
+
+
+leaderboard = Leaderboard()
+
+
+def record_points_delta(user_id, delta):
+    """Apply a committed points delta to the in-process leaderboard"""
+    transaction.on_commit(lambda: leaderboard.add_points(user_id, delta))
+
+
+def record_points_total(user_id, total):
+    """Apply a committed points total to the in-process leaderboard"""
+    transaction.on_commit(lambda: leaderboard.set_points(user_id, total))
@@ -0,0 +1,181 @@
+"""
+Live leaderboard push over Server-Sent Events.
+
+Committed writes that bump the ``leaderboard`` or ``teams`` cache scopes
+mark the matching board dirty (see ``caching.bump_listeners``). While any
+client is connected, a ticker task on the worker's event loop wakes every
+``LIVE_LEADERBOARD_TICK_SECONDS``, reloads only the dirty boards, diffs
+them against the previous tick and encodes one event per board. That event
+is then queued, as-is, for every subscriber, so the work per tick does not
+grow with the number of clients, and an idle client costs one queue and
+one suspended coroutine.
+
+Boards are also reloaded every ``LIVE_LEADERBOARD_RESYNC_SECONDS``, as
+writes served by other worker processes mark nothing dirty here. The team
+board is read from the database; the user board comes from the in-process
+leaderboard, which only sees another worker's writes once their bump of the
+``leaderboard`` scope reaches this process through a shared cache (see
+fitness/checks.py), and otherwise after ``LEADERBOARD_REBUILD_SECONDS``.
+
+Streaming an async iterator through StreamingHttpResponse needs Django 4.2.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import caching
+from .leaderboard import leaderboard
+from .views import team_leaderboard_queryset
+
+BOARDS = ('users', 'teams')
+# Cache scopes whose bumps change each board
+BOARD_SCOPES = {'leaderboard': 'users', 'teams': 'teams'}
+USER_BOARD_SIZE = 50
+# Events a subscriber may fall behind by before it is sent a fresh snapshot instead
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+RESYNC = object()
+
+
+def load_users():
+    """{user_id: row} for the top of the in-process leaderboard"""
+    rows = leaderboard.page(1, USER_BOARD_SIZE)
+    usernames = dict(User.objects.filter(pk__in=[user_id for rank, user_id, points in rows]).values_list(
+        'pk', 'username'
+    ))
+    return {
+        user_id: {'user_id': user_id, 'username': usernames.get(user_id), 'rank': rank, 'total_points': points}
+        for rank, user_id, points in rows
+    }
+
+
+def load_teams():
+    """{team_id: row} for the team leaderboard"""
+    teams = team_leaderboard_queryset().values('id', 'name', 'total_points', 'member_count')
+    return {team['id']: dict(team, rank=idx) for idx, team in enumerate(teams, 1)}
+
+
+LOADERS = {'users': load_users, 'teams': load_teams}
+
+
+def diff(old, new):
+    """Rows that are new or changed, and ids that left the board"""
+    changed = [row for key, row in new.items() if old.get(key) != row]
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+def encode(event, data, event_id=None):
+    """One SSE message, as bytes so the response writes it to every client without re-encoding"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class LeaderboardBroker:
+    """In-process pub/sub that turns leaderboard writes into one diff event per board per tick"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set(BOARDS)
+        self._boards = {}
+        self._loaded_at = None
+        self._seq = 0
+        self._subscribers = set()
+        self._task = None
+
+    def publish(self, scopes):
+        """Mark the boards affected by bumped cache scopes; safe to call from any thread"""
+        boards = {BOARD_SCOPES[scope] for scope in scopes if scope in BOARD_SCOPES}
+        if boards:
+            with self._lock:
+                self._dirty |= boards
+
+    def subscribe(self):
+        """A queue of encoded events for a new client; starts the ticker on this event loop"""
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    async def snapshot(self):
+        """The full current boards, encoded, after bringing any dirty or stale board up to date"""
+        await self.tick()
+        return encode('snapshot', {board: list(rows.values()) for board, rows in self._boards.items()}, self._seq)
+
+    async def tick(self):
+        """Reload dirty boards and queue a diff event per board that changed"""
+        resync = settings.LIVE_LEADERBOARD_RESYNC_SECONDS
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > resync:
+                self._dirty |= set(BOARDS)
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        self._loaded_at = time.monotonic()
+
+        for board in BOARDS:
+            if board not in dirty:
+                continue
+            rows = await sync_to_async(LOADERS[board])()
+            changed, removed = diff(self._boards.get(board, {}), rows)
+            self._boards[board] = rows
+            if not changed and not removed:
+                continue
+            self._seq += 1
+            event = encode(board, {'changed': changed, 'removed': removed}, self._seq)
+            for queue in list(self._subscribers):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # A client this far behind is better served by starting over
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(RESYNC)
+
+    async def _run(self):
+        while self._subscribers:
+            await asyncio.sleep(settings.LIVE_LEADERBOARD_TICK_SECONDS)
+            await self.tick()
+
+    async def stream(self):
+        """
+        Encoded events for one client: a snapshot, then diffs and keepalives.
+
+        The stream ends after LIVE_LEADERBOARD_STREAM_SECONDS and EventSource
+        reconnects, so a client that went away without the server noticing
+        is only held that long.
+        """
+        snapshot = await self.snapshot()
+        # No await in between: every later diff is relative to this snapshot
+        queue = self.subscribe()
+        try:
+            yield b'retry: 2000\n\n'
+            yield snapshot
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.LIVE_LEADERBOARD_STREAM_SECONDS
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await asyncio.wait_for(queue.get(), min(KEEPALIVE_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+                    continue
+                yield await self.snapshot() if event is RESYNC else event
+        finally:
+            self.unsubscribe(queue)
+
+
+broker = LeaderboardBroker()
+caching.bump_listeners.append(broker.publish)
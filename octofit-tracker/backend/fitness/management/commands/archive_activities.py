@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from fitness.archive import archive_activities, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = "Move activities older than the archive horizon out of the live activity table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive activities older than this many days (default ACTIVITY_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be archived without moving it')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(days=options['days'])
+        moved = archive_activities(cutoff, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} activities logged before {cutoff:%Y-%m-%d}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from fitness.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily activity rollups by streaming the activity table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        written = backfill(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup row(s)"))
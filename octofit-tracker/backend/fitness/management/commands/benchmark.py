@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from fitness import benchmarks
+from fitness.models import Activity
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic dataset into a scratch SQLite database and record latency, "
+        "query count and peak memory for every fitness API GET route"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--activities', type=int, default=1000000)
+        parser.add_argument('--teams', type=int, default=5000)
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument(
+            '--db', default='bench.sqlite3',
+            help='Scratch database file; reused without reseeding when --keepdb is given'
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Reuse an already seeded scratch database')
+        parser.add_argument('--baseline', default='benchmark_baseline.json')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Allowed relative slowdown (0.25 = 25%%)')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument(
+            '--serializer-rows', type=int, default=2000,
+            help='Rows per nested vs compact serializer throughput run (0 to skip)'
+        )
+
+    def handle(self, *args, **options):
+        # Never benchmark against the real database: build a throwaway one from migrations
+        connection.settings_dict['TEST']['NAME'] = options['db']
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        setup_test_environment(debug=False)
+        try:
+            if not Activity.objects.exists():
+                self.stdout.write('Seeding benchmark data...')
+                benchmarks.seed(
+                    users=options['users'], activities=options['activities'], teams=options['teams']
+                )
+            results = benchmarks.run(iterations=options['iterations'])
+            throughput = {}
+            if options['serializer_rows']:
+                throughput = benchmarks.serializer_throughput(rows=options['serializer_rows'])
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        for name, metrics in results.items():
+            self.stdout.write(
+                f"{name:40} p50 {metrics['p50_ms']:9.2f}ms  p95 {metrics['p95_ms']:9.2f}ms  "
+                f"{metrics['queries']:3} queries  {metrics['peak_kb']:10.1f}KB"
+            )
+
+        for name, metrics in throughput.items():
+            self.stdout.write(
+                f"{name:40} nested {metrics['nested_rows_per_s']:9} rows/s  "
+                f"compact {metrics['compact_rows_per_s']:9} rows/s  x{metrics['speedup']}"
+            )
+
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline'] or not baseline_path.exists():
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True))
+            self.stdout.write(self.style.SUCCESS(f"Wrote baseline to {baseline_path}"))
+            return
+
+        regressions = benchmarks.compare(
+            results, json.loads(baseline_path.read_text()), threshold=options['threshold']
+        )
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}"))
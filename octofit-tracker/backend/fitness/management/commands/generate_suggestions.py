@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fitness import jobs, suggestions
+
+
+class Command(BaseCommand):
+    help = "Replace every user's open workout suggestions with freshly scored ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users scored and written per transaction')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue a generate_suggestions job for run_worker instead of running here')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            jobs.enqueue('generate_suggestions')
+            self.stdout.write(self.style.SUCCESS("Queued generate_suggestions; see Jobs in the admin for progress"))
+            return
+
+        catalog = suggestions.Catalog()
+        last_user_id, users, written = 0, 0, 0
+        start = time.perf_counter()
+        while True:
+            last_user_id, chunk_users, chunk_written = suggestions.generate_chunk(
+                last_user_id, options['chunk_size'], catalog
+            )
+            if last_user_id is None:
+                break
+            users += chunk_users
+            written += chunk_written
+            self.stdout.write(f"{users} users, {written} suggestions")
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} suggestions for {users} users in {elapsed:.1f}s ({users / max(elapsed, 1e-9):.0f} users/s)"
+        ))
@@ -0,0 +1,61 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from fitness import benchmarks
+
+# Database settings for each profile, as configured by OCTOFIT_DB_PROFILE
+PROFILES = {
+    'development': {'SQLITE_PRAGMAS': {}, 'FITNESS_WRITE_COALESCING': False, 'CONN_MAX_AGE': 0},
+    'production': {
+        'SQLITE_PRAGMAS': settings.SQLITE_PRODUCTION_PRAGMAS,
+        'FITNESS_WRITE_COALESCING': True,
+        'CONN_MAX_AGE': 600,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent activity-logging throughput under the development and production "
+        "database profiles, each on a fresh scratch SQLite database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writers')
+        parser.add_argument('--writes', type=int, default=50, help='Activities each writer posts')
+        parser.add_argument('--db', default='loadtest', help='Scratch database file prefix')
+        parser.add_argument(
+            '--profile', choices=sorted(PROFILES), action='append', help='Profiles to run (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        # Lock waits in the development profile would flood the slow-query log
+        logging.getLogger('fitness.slow_queries').disabled = True
+        setup_test_environment(debug=False)
+        try:
+            for name in options['profile'] or PROFILES:
+                profile = PROFILES[name]
+                result = self.run_profile(name, profile, options)
+                self.stdout.write(
+                    f"{name:12} {result['writes_per_s']:9.1f} writes/s  p50 {result['p50_ms']:8.2f}ms  "
+                    f"p95 {result['p95_ms']:8.2f}ms  {result['errors']} errors"
+                )
+        finally:
+            teardown_test_environment()
+
+    def run_profile(self, name, profile, options):
+        # Each profile gets its own file: journal_mode=WAL persists in the database
+        connection.settings_dict['TEST']['NAME'] = f"{options['db']}-{name}.sqlite3"
+        connections.settings['default']['CONN_MAX_AGE'] = profile['CONN_MAX_AGE']
+        with override_settings(
+            SQLITE_PRAGMAS=profile['SQLITE_PRAGMAS'], FITNESS_WRITE_COALESCING=profile['FITNESS_WRITE_COALESCING']
+        ):
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                return benchmarks.write_load(threads=options['threads'], writes_per_thread=options['writes'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
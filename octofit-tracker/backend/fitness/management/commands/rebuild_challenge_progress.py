@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from fitness.models import Challenge
+from fitness.progress import rebuild_progress
+
+
+class Command(BaseCommand):
+    help = "Recompute challenge progress counters from activity history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('challenge_ids', nargs='*', type=int, help='Challenges to rebuild (default: all active)')
+
+    def handle(self, *args, **options):
+        challenges = Challenge.objects.all()
+        if options['challenge_ids']:
+            challenges = challenges.filter(pk__in=options['challenge_ids'])
+        else:
+            challenges = challenges.filter(is_active=True)
+
+        rebuilt = 0
+        for challenge in challenges:
+            rebuild_progress(challenge)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt progress for {rebuilt} challenge(s)"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from fitness.points import reconcile_user_points, reconcile_team_points
+
+
+class Command(BaseCommand):
+    help = "Rebuild user and team point totals from activities to fix drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+
+        changes = reconcile_user_points(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        for user_id, stored, actual in changes:
+            self.stdout.write(f"user {user_id}: {stored} -> {actual}")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(changes)} drifted profile(s)"))
+
+        # Team totals are sums of profile totals, so rebuild them second
+        changes = reconcile_team_points(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        for team_id, stored, actual in changes:
+            self.stdout.write(f"team {team_id}: {stored} -> {actual}")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(changes)} drifted team(s)"))
@@ -0,0 +1,42 @@
+import multiprocessing
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from fitness import jobs
+
+
+def work(once, poll_seconds):
+    # Each process opens its own database connections
+    connections.close_all()
+    jobs.work(f'{socket.gethostname()}:{os.getpid()}', once=once, poll_seconds=poll_seconds)
+
+
+class Command(BaseCommand):
+    help = "Run background job workers (e.g. points recalculation after an ActivityType rate change)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to start')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            work(options['once'], options['poll'])
+            return
+
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=work, args=(options['once'], options['poll']))
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
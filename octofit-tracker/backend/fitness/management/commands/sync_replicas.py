@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fitness import replicas
+
+
+class Command(BaseCommand):
+    help = "Refresh the SQLite read replicas (OCTOFIT_DB_REPLICAS) from the primary database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Sync each replica once and exit')
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help='Seconds between syncs (default REPLICA_SYNC_SECONDS)',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.READ_REPLICAS:
+            raise CommandError('No read replicas configured; set OCTOFIT_DB_REPLICAS')
+        interval = options['interval'] if options['interval'] is not None else settings.REPLICA_SYNC_SECONDS
+
+        while True:
+            for alias in settings.READ_REPLICAS:
+                started = time.monotonic()
+                replicas.sync_replica(alias)
+                self.stdout.write(f"Synced {alias} in {time.monotonic() - started:.2f}s")
+            if options['once']:
+                return
+            time.sleep(interval)
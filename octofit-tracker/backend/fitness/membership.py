@@ -0,0 +1,135 @@
+"""
+Race-free team and challenge membership writes.
+
+``members.add()`` reads which rows are missing, inserts them and then sends
+``m2m_changed``, so two concurrent joins can both see the user missing and
+both add their points to the team. These helpers write the through tables
+directly and learn what changed from the write itself: a single insert
+inside a savepoint either lands or hits the unique constraint, and a delete
+reports its row count. They then apply the same side effects as the
+``m2m_changed`` receivers in fitness/signals.py. Bulk inserts first read
+which of the requested rows exist, so the count they report only covers
+their own ids, and recompute the affected totals instead of applying deltas,
+as a concurrent insert of the same row is not detected.
+"""
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Challenge, Team, UserProfile
+from . import caching, points, progress
+
+TeamMembership = Team.members.through
+ChallengeParticipation = Challenge.participants.through
+ChallengeTeamParticipation = Challenge.team_participants.through
+
+
+def _insert(model, **fields):
+    """Insert one through row; False when it already exists"""
+    try:
+        with transaction.atomic():
+            model.objects.create(**fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+def existing_user_ids(user_ids):
+    """The ids in ``user_ids`` that belong to a user, so bulk inserts never reference a missing one"""
+    return list(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+
+def add_member(team_id, user_id):
+    """Add a user to a team; False if they already were a member"""
+    with transaction.atomic():
+        if not _insert(TeamMembership, team_id=team_id, user_id=user_id):
+            return False
+        points.apply_membership_change(1, team_id=team_id, user_id__in=[user_id])
+        progress.rebuild_team_progress([team_id])
+    caching.bump('teams')
+    return True
+
+
+def remove_member(team_id, user_id):
+    """Remove a user from a team; False if they were not a member"""
+    with transaction.atomic():
+        deleted, _ = TeamMembership.objects.filter(team_id=team_id, user_id=user_id).delete()
+        if not deleted:
+            return False
+        # Only the request that deleted the row gets here, so the points come off once
+        user_points = UserProfile.objects.filter(user_id=user_id).values('total_points')
+        Team.objects.filter(pk=team_id).update(
+            total_points=F('total_points') - Coalesce(Subquery(user_points), Value(0))
+        )
+        progress.rebuild_team_progress([team_id])
+    caching.bump('teams')
+    return True
+
+
+def add_members(team_id, user_ids):
+    """Add many users to a team with one bulk insert; returns how many were new"""
+    with transaction.atomic():
+        new_ids = set(existing_user_ids(user_ids)) - set(
+            TeamMembership.objects.filter(team_id=team_id, user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+        TeamMembership.objects.bulk_create(
+            [TeamMembership(team_id=team_id, user_id=user_id) for user_id in new_ids],
+            ignore_conflicts=True,
+        )
+        if new_ids:
+            # Recomputed rather than incremented, so a concurrent add of the same user cannot count twice
+            points.reconcile_team_points(team_ids=[team_id])
+            progress.rebuild_team_progress([team_id])
+    caching.bump('teams')
+    return len(new_ids)
+
+
+def remove_members(team_id, user_ids):
+    """Remove many users from a team; returns how many were members"""
+    with transaction.atomic():
+        removed, _ = TeamMembership.objects.filter(team_id=team_id, user_id__in=user_ids).delete()
+        if removed:
+            points.reconcile_team_points(team_ids=[team_id])
+            progress.rebuild_team_progress([team_id])
+    caching.bump('teams')
+    return removed
+
+
+def join_challenge(challenge, user_id):
+    """Add a participant to an individual challenge; False if they already were one"""
+    with transaction.atomic():
+        if not _insert(ChallengeParticipation, challenge_id=challenge.pk, user_id=user_id):
+            return False
+        progress.rebuild_progress(challenge, user_ids=[user_id], team_ids=())
+    return True
+
+
+def enroll_team(challenge, team_id):
+    """
+    Enroll a team in a challenge; returns how many participants were added.
+
+    A team challenge gains the team itself; an individual challenge gains
+    every member of the team as a participant, with one bulk insert.
+    """
+    with transaction.atomic():
+        if challenge.challenge_type == 'team':
+            if not _insert(ChallengeTeamParticipation, challenge_id=challenge.pk, team_id=team_id):
+                return 0
+            progress.rebuild_progress(challenge, user_ids=(), team_ids=[team_id])
+            return 1
+
+        member_ids = TeamMembership.objects.filter(team_id=team_id).values_list('user_id', flat=True)
+        new_ids = set(member_ids) - set(
+            ChallengeParticipation.objects.filter(
+                challenge_id=challenge.pk, user_id__in=member_ids
+            ).values_list('user_id', flat=True)
+        )
+        ChallengeParticipation.objects.bulk_create(
+            [ChallengeParticipation(challenge_id=challenge.pk, user_id=user_id) for user_id in new_ids],
+            ignore_conflicts=True,
+        )
+        if new_ids:
+            # Rebuilding a counter is idempotent, so a concurrent enrollment cannot double count
+            progress.rebuild_progress(challenge, user_ids=new_ids, team_ids=())
+    return len(new_ids)
@@ -0,0 +1,183 @@
+"""
+Per-request performance instrumentation.
+
+``PerformanceMiddleware`` times every request and, through
+``connection.execute_wrapper``, counts its database queries and the time
+spent in them. Totals are kept per resolved URL name (``activity-stats``,
+``leaderboard-teams``, ...) in an in-process registry that ``/api/_metrics``
+renders in the Prometheus text format. Queries slower than
+``FITNESS_SLOW_QUERY_MS`` are logged to ``fitness.slow_queries`` with their
+SQL and the stack that issued them.
+
+Each worker process keeps its own totals; scrape every worker (or sum the
+series by instance) when running more than one.
+"""
+import logging
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+slow_query_logger = logging.getLogger('fitness.slow_queries')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """Thread-safe request, query and slow-query totals per (view, method)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(int)
+            self._buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self._counts = defaultdict(int)
+            self._seconds = defaultdict(float)
+            self._queries = defaultdict(int)
+            self._db_seconds = defaultdict(float)
+            self._slow_queries = defaultdict(int)
+
+    def record(self, view, method, status, seconds, queries, db_seconds, slow_queries):
+        key = (view, method)
+        with self._lock:
+            self._requests[key + (str(status),)] += 1
+            buckets = self._buckets[key]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self._counts[key] += 1
+            self._seconds[key] += seconds
+            self._queries[key] += queries
+            self._db_seconds[key] += db_seconds
+            self._slow_queries[key] += slow_queries
+
+    def render(self):
+        """The totals in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                '# HELP octofit_requests_total Requests by view, method and status.',
+                '# TYPE octofit_requests_total counter',
+            ]
+            for (view, method, status), count in sorted(self._requests.items()):
+                lines.append(f'octofit_requests_total{_labels(view=view, method=method, status=status)} {count}')
+
+            lines += [
+                '# HELP octofit_request_duration_seconds Wall time per request.',
+                '# TYPE octofit_request_duration_seconds histogram',
+            ]
+            for (view, method), buckets in sorted(self._buckets.items()):
+                count = self._counts[view, method]
+                for bound, n in zip(DURATION_BUCKETS, buckets):
+                    labels = _labels(view=view, method=method, le=bound)
+                    lines.append(f'octofit_request_duration_seconds_bucket{labels} {n}')
+                labels = _labels(view=view, method=method, le='+Inf')
+                lines.append(f'octofit_request_duration_seconds_bucket{labels} {count}')
+                labels = _labels(view=view, method=method)
+                lines.append(f'octofit_request_duration_seconds_sum{labels} {self._seconds[view, method]:.6f}')
+                lines.append(f'octofit_request_duration_seconds_count{labels} {count}')
+
+            for name, help_text, values, fmt in (
+                ('octofit_db_queries_total', 'Database queries run while serving requests.',
+                 self._queries, '{}'),
+                ('octofit_db_query_seconds_total', 'Time spent in database queries.',
+                 self._db_seconds, '{:.6f}'),
+                ('octofit_slow_queries_total', 'Queries slower than FITNESS_SLOW_QUERY_MS.',
+                 self._slow_queries, '{}'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (view, method), value in sorted(values.items()):
+                    lines.append(f'{name}{_labels(view=view, method=method)} {fmt.format(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in labels.values()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """execute_wrapper that counts and times one request's queries and logs the slow ones"""
+
+    def __init__(self, request):
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+        self.threshold = settings.FITNESS_SLOW_QUERY_MS / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed >= self.threshold:
+                self.slow += 1
+                slow_query_logger.warning(
+                    "Slow query (%.1f ms) in %s %s\n%s\nParams: %r\n%s",
+                    elapsed * 1000, self.request.method, self.request.path, sql, params,
+                    ''.join(traceback.format_stack(limit=25)[:-1]),
+                )
+
+
+class PerformanceMiddleware:
+    """Record wall time, query count and DB time per resolved view; works for sync and async views"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer(request)
+        start = time.perf_counter()
+        with self._wrapped(timer):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer(request)
+        start = time.perf_counter()
+        # Connections are per thread: wrap the ones on the thread the async ORM runs queries on
+        wrapped = await sync_to_async(self._wrapped)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapped.close)()
+        self._record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    def _wrapped(self, timer):
+        """Install ``timer`` on every database connection of this thread until the stack is closed"""
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+        return stack
+
+    def _record(self, request, response, seconds, timer):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.route) if match else 'unresolved'
+        registry.record(
+            view, request.method, response.status_code, seconds, timer.count, timer.seconds, timer.slow
+        )
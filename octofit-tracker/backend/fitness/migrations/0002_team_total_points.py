@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+def backfill_team_points(apps, schema_editor):
+    Team = apps.get_model('fitness', 'Team')
+    Membership = Team.members.through
+    totals = Membership.objects.values('team_id').annotate(
+        points=models.Sum('user__userprofile__total_points')
+    )
+    for row in totals:
+        Team.objects.filter(pk=row['team_id']).update(total_points=row['points'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='total_points',
+            field=models.IntegerField(default=0, help_text="Sum of members' points, maintained by the points ledger"),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['-total_points'], condition=models.Q(is_active=True), name='team_active_points_idx'),
+        ),
+        migrations.RunPython(backfill_team_points, migrations.RunPython.noop),
+    ]
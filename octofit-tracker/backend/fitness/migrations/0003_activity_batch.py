@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fitness', '0002_team_total_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Activity batches',
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activities', to='fitness.activitybatch'),
+        ),
+        migrations.AddConstraint(
+            model_name='activitybatch',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='unique_activity_batch_key'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0003_activity_batch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', '-date_logged', '-id'], name='activity_user_date_idx'),
+        ),
+    ]
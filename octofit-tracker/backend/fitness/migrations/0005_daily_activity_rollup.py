@@ -0,0 +1,52 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    Activity = apps.get_model('fitness', 'Activity')
+    DailyActivityRollup = apps.get_model('fitness', 'DailyActivityRollup')
+    totals = Activity.objects.order_by().annotate(date=models.functions.TruncDate('date_logged')).values(
+        'user_id', 'date', 'activity_type_id'
+    ).annotate(
+        count=models.Count('id'),
+        minutes=models.Sum('duration_minutes'),
+        points=models.Sum('points_awarded'),
+        distance=models.functions.Coalesce(models.Sum('distance'), 0.0),
+        calories=models.functions.Coalesce(models.Sum('calories_burned'), 0),
+    )
+    DailyActivityRollup.objects.bulk_create(
+        (DailyActivityRollup(**row) for row in totals.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fitness', '0004_activity_user_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('minutes', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0)),
+                ('calories', models.IntegerField(default=0)),
+                ('activity_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fitness.activitytype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyactivityrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'date', 'activity_type'), name='unique_daily_rollup'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
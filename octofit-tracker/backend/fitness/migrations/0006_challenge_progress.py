@@ -0,0 +1,55 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fitness', '0005_daily_activity_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='fitness.challenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Challenge progress',
+            },
+        ),
+        migrations.CreateModel(
+            name='ChallengeTeamProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='team_progress', to='fitness.challenge')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_progress', to='fitness.team')),
+            ],
+            options={
+                'verbose_name_plural': 'Challenge team progress',
+                'indexes': [models.Index(fields=['challenge', '-value'], name='challenge_team_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='challengeteamprogress',
+            constraint=models.UniqueConstraint(fields=('challenge', 'team'), name='unique_challenge_team_progress'),
+        ),
+        migrations.AddIndex(
+            model_name='challengeprogress',
+            index=models.Index(fields=['challenge', '-value'], name='challenge_progress_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='challengeprogress',
+            constraint=models.UniqueConstraint(fields=('challenge', 'user'), name='unique_challenge_progress'),
+        ),
+    ]
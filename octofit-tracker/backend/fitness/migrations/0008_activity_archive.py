@@ -0,0 +1,68 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+COLUMNS = (
+    'id, user_id, activity_type_id, duration_minutes, intensity, distance, '
+    'calories_burned, notes, date_logged, points_awarded'
+)
+
+CREATE_HISTORY_VIEW = f"""
+CREATE VIEW fitness_activity_history AS
+SELECT {COLUMNS}, 0 AS archived FROM fitness_activity
+UNION ALL
+SELECT {COLUMNS}, 1 AS archived FROM fitness_archivedactivity
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fitness', '0007_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration_minutes', models.IntegerField()),
+                ('intensity', models.CharField(max_length=10)),
+                ('distance', models.FloatField(null=True)),
+                ('calories_burned', models.IntegerField(null=True)),
+                ('notes', models.TextField()),
+                ('date_logged', models.DateTimeField()),
+                ('points_awarded', models.IntegerField()),
+                ('archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'fitness_activity_history',
+                'ordering': ['-date_logged'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration_minutes', models.IntegerField()),
+                ('intensity', models.CharField(default='medium', max_length=10)),
+                ('distance', models.FloatField(blank=True, null=True)),
+                ('calories_burned', models.IntegerField(blank=True, null=True)),
+                ('notes', models.TextField(blank=True)),
+                ('date_logged', models.DateTimeField()),
+                ('points_awarded', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('activity_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_activities', to='fitness.activitytype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_activities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Archived activities',
+                'indexes': [models.Index(fields=['user', '-date_logged', '-id'], name='archived_user_date_idx')],
+            },
+        ),
+        migrations.RunSQL(CREATE_HISTORY_VIEW, 'DROP VIEW fitness_activity_history'),
+    ]
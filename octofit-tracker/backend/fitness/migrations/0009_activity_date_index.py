@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0008_activity_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-date_logged', '-id'], name='activity_date_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.11 on 2026-10-18 14:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+OLD_COLUMNS = (
+    'id, user_id, activity_type_id, duration_minutes, intensity, distance, '
+    'calories_burned, notes, date_logged, points_awarded'
+)
+COLUMNS = f'{OLD_COLUMNS}, batch_id'
+
+HISTORY_VIEW = """
+CREATE VIEW fitness_activity_history AS
+SELECT {columns}, 0 AS archived FROM fitness_activity
+UNION ALL
+SELECT {columns}, 1 AS archived FROM fitness_archivedactivity
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fitness', '0009_activity_date_index'),
+    ]
+
+    operations = [
+        # SQLite rebuilds fitness_archivedactivity to add the column, which a view over it would block
+        migrations.RunSQL('DROP VIEW fitness_activity_history', HISTORY_VIEW.format(columns=OLD_COLUMNS)),
+        migrations.AddField(
+            model_name='archivedactivity',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_activities', to='fitness.activitybatch'),
+        ),
+        migrations.AddField(
+            model_name='activityhistory',
+            name='batch',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='fitness.activitybatch'),
+        ),
+        migrations.RunSQL(HISTORY_VIEW.format(columns=COLUMNS), 'DROP VIEW fitness_activity_history'),
+    ]
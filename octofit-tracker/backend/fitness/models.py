@@ -1,9 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 # Create your models here.
 
+INTENSITY_MULTIPLIERS = {'low': 0.8, 'medium': 1.0, 'high': 1.3}
+
 class UserProfile(models.Model):
     """Extended user profile for fitness tracking"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -34,14 +36,20 @@ class Team(models.Model):
     members = models.ManyToManyField(User, related_name='teams', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    total_points = models.IntegerField(default=0, help_text="Sum of members' points, maintained by the points ledger")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_points'], condition=models.Q(is_active=True), name='team_active_points_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     @property
     def total_team_points(self):
-        """Calculate total points for all team members"""
-        return sum(member.userprofile.total_points for member in self.members.all() if hasattr(member, 'userprofile'))
+        """Total points for all team members"""
+        return self.total_points
 
 class ActivityType(models.Model):
     """Different types of fitness activities"""
@@ -60,9 +68,32 @@ class ActivityType(models.Model):
         default='other'
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rate so a change can queue a points recalculation
+        if 'points_per_minute' in field_names:
+            instance._stored_points_per_minute = instance.points_per_minute
+        return instance
+
     def __str__(self):
         return self.name
 
+class ActivityBatch(models.Model):
+    """A bulk upload of activities, keyed by the client's idempotency key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_batches')
+    idempotency_key = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_activity_batch_key'),
+        ]
+        verbose_name_plural = 'Activity batches'
+
+    def __str__(self):
+        return f"{self.user.username} - {self.idempotency_key}"
+
 class Activity(models.Model):
     """Individual activity records"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -82,32 +113,136 @@ class Activity(models.Model):
     notes = models.TextField(blank=True)
     date_logged = models.DateTimeField(default=timezone.now)
     points_awarded = models.IntegerField(default=0)
+    batch = models.ForeignKey(ActivityBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='activities')
 
     class Meta:
         ordering = ['-date_logged']
         verbose_name_plural = 'Activities'
+        indexes = [
+            models.Index(fields=['user', '-date_logged', '-id'], name='activity_user_date_idx'),
+            # Newest-first listings across all users (the admin changelist) and archival by age
+            models.Index(fields=['-date_logged', '-id'], name='activity_date_idx'),
+        ]
+
+    # Fields the write-path handlers (points ledger, rollups) diff against on save/delete
+    TRACKED_FIELDS = (
+        'user_id', 'activity_type_id', 'date_logged', 'duration_minutes',
+        'distance', 'calories_burned', 'points_awarded',
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so the write-path handlers can apply deltas on save/delete
+        if all(field in field_names for field in cls.TRACKED_FIELDS):
+            instance._stored = instance.tracked_values()
+        return instance
+
+    def tracked_values(self):
+        return {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
+    def calculate_points(self):
+        """Calculate points based on duration, activity type and intensity"""
+        if Activity.activity_type.is_cached(self):
+            activity_type = self.activity_type
+        else:
+            # Imported here because the catalog module imports this one
+            from .catalog import activity_catalog
+            activity_type = activity_catalog.get(self.activity_type_id) or self.activity_type
+        base_points = self.duration_minutes * activity_type.points_per_minute
+        return int(base_points * INTENSITY_MULTIPLIERS[self.intensity])
 
     def save(self, *args, **kwargs):
-        # Calculate points based on duration and activity type
-        base_points = self.duration_minutes * self.activity_type.points_per_minute
-        
-        # Apply intensity multiplier
-        intensity_multipliers = {'low': 0.8, 'medium': 1.0, 'high': 1.3}
-        self.points_awarded = int(base_points * intensity_multipliers[self.intensity])
-        
-        super().save(*args, **kwargs)
-        
-        # Update user's total points
-        user_profile, created = UserProfile.objects.get_or_create(user=self.user)
-        total_points = Activity.objects.filter(user=self.user).aggregate(
-            total=models.Sum('points_awarded')
-        )['total'] or 0
-        user_profile.total_points = total_points
-        user_profile.save()
+        self.points_awarded = self.calculate_points()
+
+        # The post_save handlers update totals and rollups in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            if self.pk and not hasattr(self, '_stored'):
+                self._stored = Activity.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type.name} ({self.duration_minutes}min)"
 
+class ArchivedActivity(models.Model):
+    """
+    An activity older than the archive horizon, moved out of the live table.
+
+    Rows keep their original id, points and batch; they still count towards
+    the user's totals, daily rollups and challenge progress. See
+    fitness/archive.py.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_activities')
+    activity_type = models.ForeignKey(ActivityType, on_delete=models.CASCADE, related_name='archived_activities')
+    duration_minutes = models.IntegerField()
+    intensity = models.CharField(max_length=10, default='medium')
+    distance = models.FloatField(null=True, blank=True)
+    calories_burned = models.IntegerField(null=True, blank=True)
+    notes = models.TextField(blank=True)
+    date_logged = models.DateTimeField()
+    points_awarded = models.IntegerField(default=0)
+    batch = models.ForeignKey(
+        ActivityBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_activities'
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'Archived activities'
+        indexes = [
+            models.Index(fields=['user', '-date_logged', '-id'], name='archived_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.activity_type.name} on {self.date_logged} (archived)"
+
+class ActivityHistory(models.Model):
+    """
+    Read-only view over live and archived activities (UNION ALL).
+
+    Used for reads whose date range reaches into the archive. The view was
+    last created in migration 0010; recreate it in a new migration if either
+    table's columns change.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    activity_type = models.ForeignKey(
+        ActivityType, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    duration_minutes = models.IntegerField()
+    intensity = models.CharField(max_length=10)
+    distance = models.FloatField(null=True)
+    calories_burned = models.IntegerField(null=True)
+    notes = models.TextField()
+    date_logged = models.DateTimeField()
+    points_awarded = models.IntegerField()
+    batch = models.ForeignKey(
+        ActivityBatch, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+'
+    )
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'fitness_activity_history'
+        ordering = ['-date_logged']
+
+class DailyActivityRollup(models.Model):
+    """Per-user, per-day, per-activity-type totals, maintained from the activity write path"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    activity_type = models.ForeignKey(ActivityType, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    distance = models.FloatField(default=0)
+    calories = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'activity_type'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.activity_type.name} on {self.date}"
+
 class Challenge(models.Model):
     """Fitness challenges for individuals or teams"""
     title = models.CharField(max_length=100)
@@ -137,9 +272,61 @@ class Challenge(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Fields the progress counters are computed from; changing one rebuilds them
+    PROGRESS_FIELDS = ('target_metric', 'target_value', 'start_date', 'end_date')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored target and window so a change can rebuild the counters
+        if all(field in field_names for field in cls.PROGRESS_FIELDS):
+            instance._stored_progress_fields = instance.progress_fields()
+        return instance
+
+    def progress_fields(self):
+        return {field: getattr(self, field) for field in self.PROGRESS_FIELDS}
+
     def __str__(self):
         return self.title
 
+class ChallengeProgress(models.Model):
+    """A participant's running total towards a challenge target"""
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='progress')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_progress')
+    value = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['challenge', 'user'], name='unique_challenge_progress'),
+        ]
+        indexes = [
+            models.Index(fields=['challenge', '-value'], name='challenge_progress_rank_idx'),
+        ]
+        verbose_name_plural = 'Challenge progress'
+
+    def __str__(self):
+        return f"{self.user.username} - {self.challenge.title}: {self.value}"
+
+class ChallengeTeamProgress(models.Model):
+    """A participating team's running total towards a challenge target"""
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='team_progress')
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='challenge_progress')
+    value = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['challenge', 'team'], name='unique_challenge_team_progress'),
+        ]
+        indexes = [
+            models.Index(fields=['challenge', '-value'], name='challenge_team_rank_idx'),
+        ]
+        verbose_name_plural = 'Challenge team progress'
+
+    def __str__(self):
+        return f"{self.team.name} - {self.challenge.title}: {self.value}"
+
 class WorkoutSuggestion(models.Model):
     """Personalized workout suggestions"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -161,3 +348,41 @@ class WorkoutSuggestion(models.Model):
 
     def __str__(self):
         return f"{self.title} for {self.user.username}"
+
+class Job(models.Model):
+    """A unit of background work, claimed and run by the run_worker management command"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    state = models.JSONField(default=dict, blank=True, help_text="Resume point, saved after every chunk")
+    processed = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_queue_idx'),
+        ]
+
+    @property
+    def progress(self):
+        """Percentage of ``total`` processed, when the total is known"""
+        if not self.total:
+            return None
+        return min(100, round(100 * self.processed / self.total, 1))
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ActivityCursorPagination(CursorPagination):
+    """
+    Keyset pagination for activity history.
+
+    Pages seek on the (user, date_logged, id) index instead of using OFFSET,
+    and no COUNT(*) is run, so deep pages cost the same as the first one.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-date_logged', '-id')
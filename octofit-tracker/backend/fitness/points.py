@@ -0,0 +1,147 @@
+"""
+Incremental points ledger.
+
+User totals are kept up to date by applying signed deltas with atomic F()
+updates instead of re-aggregating a user's whole activity history on every
+write. Team totals are denormalized the same way: every user delta is
+propagated to the user's teams, and membership changes add or remove the
+member's points. ``reconcile_user_points`` and ``reconcile_team_points``
+rebuild the totals in bulk to catch drift from writes that bypass the
+ledger (``bulk_create``, ``QuerySet.update``).
+"""
+from collections import defaultdict
+
+from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import UserProfile, Team, ActivityHistory
+from . import leaderboard
+
+
+def apply_points_delta(user_id, delta):
+    """Add a signed points delta to a user's total"""
+    if not delta:
+        return
+    updated = UserProfile.objects.filter(user_id=user_id).update(
+        total_points=F('total_points') + delta,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # First activity for this user: seed the profile from its history, archive included
+        total = ActivityHistory.objects.filter(user_id=user_id).aggregate(
+            total=Sum('points_awarded')
+        )['total'] or 0
+        profile, created = UserProfile.objects.get_or_create(
+            user_id=user_id, defaults={'total_points': total}
+        )
+        if not created:
+            # Lost a race with a concurrent profile creation
+            apply_points_delta(user_id, delta)
+            return
+        # Members without a profile contributed nothing to their teams yet
+        delta = total
+    else:
+        leaderboard.record_points_delta(user_id, delta)
+
+    Team.objects.filter(members=user_id).update(total_points=F('total_points') + delta)
+
+
+def apply_membership_change(sign, **membership_filter):
+    """
+    Add (sign=1) or remove (sign=-1) members' points from their teams.
+
+    ``membership_filter`` selects the affected rows of the team membership table.
+    """
+    totals = Team.members.through.objects.filter(**membership_filter).values('team_id').annotate(
+        points=Sum('user__userprofile__total_points')
+    )
+    for row in totals:
+        if row['points']:
+            Team.objects.filter(pk=row['team_id']).update(
+                total_points=F('total_points') + sign * row['points']
+            )
+
+
+def record_activity_saved(activity, created):
+    """Apply the points change of a created or updated activity"""
+    stored = getattr(activity, '_stored', None)
+    if created or stored is None:
+        apply_points_delta(activity.user_id, activity.points_awarded)
+    elif stored['user_id'] != activity.user_id:
+        apply_points_delta(stored['user_id'], -stored['points_awarded'])
+        apply_points_delta(activity.user_id, activity.points_awarded)
+    else:
+        apply_points_delta(activity.user_id, activity.points_awarded - stored['points_awarded'])
+
+
+def record_activities_created(activities):
+    """Apply the points of bulk-created activities with one update per user"""
+    deltas = defaultdict(int)
+    for activity in activities:
+        deltas[activity.user_id] += activity.points_awarded
+    for user_id, delta in deltas.items():
+        apply_points_delta(user_id, delta)
+
+
+def record_activity_deleted(activity):
+    """Remove the points of a deleted activity from its user's total"""
+    stored = getattr(activity, '_stored', None) or activity.tracked_values()
+    apply_points_delta(stored['user_id'], -stored['points_awarded'])
+
+
+def reconcile_user_points(dry_run=False, batch_size=1000, user_ids=None):
+    """
+    Rebuild every profile's total (or those of ``user_ids``) from live and archived activities.
+
+    Returns the list of (user_id, stored_total, actual_total) that drifted.
+    """
+    actual_totals = ActivityHistory.objects.filter(user_id=OuterRef('user_id')).order_by().values(
+        'user_id'
+    ).annotate(total=Sum('points_awarded')).values('total')
+
+    drifted = UserProfile.objects.annotate(
+        actual_total=Coalesce(Subquery(actual_totals), Value(0), output_field=models.IntegerField())
+    ).exclude(total_points=F('actual_total')).only('id', 'user_id', 'total_points')
+    if user_ids is not None:
+        drifted = drifted.filter(user_id__in=user_ids)
+
+    changes = []
+    profiles = []
+    for profile in drifted.iterator(chunk_size=batch_size):
+        changes.append((profile.user_id, profile.total_points, profile.actual_total))
+        profile.total_points = profile.actual_total
+        profiles.append(profile)
+
+    if not dry_run and profiles:
+        UserProfile.objects.bulk_update(profiles, ['total_points'], batch_size=batch_size)
+    return changes
+
+
+def reconcile_team_points(dry_run=False, batch_size=1000, team_ids=None):
+    """
+    Rebuild every team's total (or those of ``team_ids``) from its members' profiles.
+
+    Returns the list of (team_id, stored_total, actual_total) that drifted.
+    """
+    actual_totals = Team.members.through.objects.filter(team_id=OuterRef('pk')).order_by().values(
+        'team_id'
+    ).annotate(total=Sum('user__userprofile__total_points')).values('total')
+
+    drifted = Team.objects.annotate(
+        actual_total=Coalesce(Subquery(actual_totals), Value(0), output_field=models.IntegerField())
+    ).exclude(total_points=F('actual_total')).only('id', 'total_points')
+    if team_ids is not None:
+        drifted = drifted.filter(pk__in=team_ids)
+
+    changes = []
+    teams = []
+    for team in drifted.iterator(chunk_size=batch_size):
+        changes.append((team.pk, team.total_points, team.actual_total))
+        team.total_points = team.actual_total
+        teams.append(team)
+
+    if not dry_run and teams:
+        Team.objects.bulk_update(teams, ['total_points'], batch_size=batch_size)
+    return changes
@@ -0,0 +1,180 @@
+"""
+Challenge progress engine.
+
+``ChallengeProgress`` and ``ChallengeTeamProgress`` hold each participant's
+and participating team's running total towards an active challenge's
+target. Activity writes inside a challenge window adjust the totals with a
+single UPDATE per counter, which also stamps (or clears) ``completed_at`` as
+the target is crossed. Membership changes and ``rebuild_progress`` recompute
+counters from history, archived activities included, with one grouped query
+per challenge.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ActivityHistory, Challenge, ChallengeProgress, ChallengeTeamProgress
+from .rollups import logged_at
+
+METRIC_AGGREGATES = {
+    'minutes': lambda: Sum('duration_minutes'),
+    'points': lambda: Sum('points_awarded'),
+    'activities': lambda: Count('id'),
+}
+
+
+def metric_amount(metric, values):
+    """How much one activity counts towards a challenge metric"""
+    if metric == 'minutes':
+        return values['duration_minutes']
+    if metric == 'points':
+        return values['points_awarded']
+    return 1
+
+
+def apply_progress_delta(model, challenge_id, target, delta, **owner):
+    """Add ``delta`` to one counter and stamp or clear its completion in the same UPDATE"""
+    now = timezone.now()
+    rows = model.objects.filter(challenge_id=challenge_id, **owner)
+    # SET expressions see the old value, so compare it against target - delta
+    updated = rows.update(
+        value=F('value') + delta,
+        completed_at=Case(
+            When(value__gte=target - delta, then=Coalesce(F('completed_at'), Value(now))),
+            default=Value(None),
+        ),
+    )
+    if not updated and delta > 0:
+        try:
+            with transaction.atomic():
+                model.objects.create(
+                    challenge_id=challenge_id, value=delta,
+                    completed_at=now if delta >= target else None, **owner
+                )
+        except IntegrityError:
+            # A concurrent write created the counter first
+            apply_progress_delta(model, challenge_id, target, delta, **owner)
+
+
+def apply_activity_changes(changes):
+    """
+    Apply signed activity contributions to every challenge they fall inside.
+
+    ``changes`` is a list of (tracked activity values, sign).
+    """
+    by_user = defaultdict(list)
+    for values, sign in changes:
+        by_user[values['user_id']].append((values, sign, logged_at(values)))
+
+    user_deltas = defaultdict(int)
+    team_deltas = defaultdict(int)
+    targets = {}
+    for user_id, items in by_user.items():
+        times = [when for values, sign, when in items]
+        window = Challenge.objects.filter(is_active=True, start_date__lte=max(times), end_date__gte=min(times))
+        individual = window.filter(participants=user_id).values_list(
+            'pk', 'start_date', 'end_date', 'target_metric', 'target_value'
+        )
+        teams = Challenge.team_participants.through.objects.filter(
+            challenge__in=window, team__members=user_id
+        ).values_list(
+            'challenge_id', 'challenge__start_date', 'challenge__end_date',
+            'challenge__target_metric', 'challenge__target_value', 'team_id'
+        )
+
+        for challenge_id, start, end, metric, target in individual:
+            targets[challenge_id] = target
+            for values, sign, when in items:
+                if start <= when <= end:
+                    user_deltas[(challenge_id, user_id)] += sign * metric_amount(metric, values)
+        for challenge_id, start, end, metric, target, team_id in teams:
+            targets[challenge_id] = target
+            for values, sign, when in items:
+                if start <= when <= end:
+                    team_deltas[(challenge_id, team_id)] += sign * metric_amount(metric, values)
+
+    for (challenge_id, user_id), delta in user_deltas.items():
+        if delta:
+            apply_progress_delta(ChallengeProgress, challenge_id, targets[challenge_id], delta, user_id=user_id)
+    for (challenge_id, team_id), delta in team_deltas.items():
+        if delta:
+            apply_progress_delta(ChallengeTeamProgress, challenge_id, targets[challenge_id], delta, team_id=team_id)
+
+
+def record_activity_saved(activity, created):
+    stored = getattr(activity, '_stored', None)
+    current = activity.tracked_values()
+    if not created and stored is not None:
+        if stored == current:
+            return
+        apply_activity_changes([(stored, -1), (current, 1)])
+    else:
+        apply_activity_changes([(current, 1)])
+
+
+def record_activities_created(activities):
+    apply_activity_changes([(activity.tracked_values(), 1) for activity in activities])
+
+
+def record_activity_deleted(activity):
+    stored = getattr(activity, '_stored', None) or activity.tracked_values()
+    apply_activity_changes([(stored, -1)])
+
+
+def _replace_counters(model, challenge, owner_field, totals, owner_filter):
+    """Swap a challenge's counters for freshly computed {owner_id: value} totals"""
+    rows = model.objects.filter(challenge=challenge, **owner_filter)
+    completed = dict(rows.exclude(completed_at=None).values_list(owner_field, 'completed_at'))
+    now = timezone.now()
+    rows.delete()
+    model.objects.bulk_create(
+        model(
+            challenge=challenge, value=value,
+            completed_at=completed.get(owner_id, now) if value >= challenge.target_value else None,
+            **{owner_field: owner_id}
+        )
+        for owner_id, value in totals.items() if value
+    )
+
+
+def rebuild_progress(challenge, user_ids=None, team_ids=None):
+    """
+    Recompute a challenge's counters from history.
+
+    Limit the rebuild to some participants or teams with ``user_ids``/``team_ids``;
+    pass an empty collection to skip that side entirely.
+    """
+    window = Q(date_logged__gte=challenge.start_date, date_logged__lte=challenge.end_date)
+
+    if user_ids is None or user_ids:
+        participants = challenge.participants.values('pk')
+        if user_ids is not None:
+            participants = participants.filter(pk__in=user_ids)
+        totals = dict(
+            ActivityHistory.objects.filter(window, user__in=participants).order_by().values('user_id').annotate(
+                value=METRIC_AGGREGATES[challenge.target_metric]()
+            ).values_list('user_id', 'value')
+        )
+        owner_filter = {} if user_ids is None else {'user_id__in': user_ids}
+        _replace_counters(ChallengeProgress, challenge, 'user_id', totals, owner_filter)
+
+    if team_ids is None or team_ids:
+        teams = challenge.team_participants.values('pk')
+        if team_ids is not None:
+            teams = teams.filter(pk__in=team_ids)
+        totals = dict(
+            ActivityHistory.objects.filter(window, user__teams__in=teams).order_by().values('user__teams').annotate(
+                value=METRIC_AGGREGATES[challenge.target_metric]()
+            ).values_list('user__teams', 'value')
+        )
+        owner_filter = {} if team_ids is None else {'team_id__in': team_ids}
+        _replace_counters(ChallengeTeamProgress, challenge, 'team_id', totals, owner_filter)
+
+
+def rebuild_team_progress(team_ids):
+    """Recompute the counters of every active challenge the given teams take part in"""
+    for challenge in Challenge.objects.filter(is_active=True, team_participants__in=team_ids).distinct():
+        rebuild_progress(challenge, user_ids=(), team_ids=team_ids)
@@ -0,0 +1,13 @@
+"""
+Query expressions shared by the API views, the admin and the benchmarks.
+"""
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def related_count(through, field):
+    """Correlated COUNT over an m2m through table, for annotating list querysets"""
+    counts = through.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('pk')
+    ).values('count')
+    return Coalesce(Subquery(counts), 0)
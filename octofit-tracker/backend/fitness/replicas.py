@@ -0,0 +1,125 @@
+"""
+Read replicas and read/write routing.
+
+``READ_REPLICAS`` names database aliases holding copies of ``default``.
+Locally each is a SQLite file that ``manage.py sync_replicas`` refreshes
+from the primary with the backup API: the copy is written beside the
+replica, stamped with the time its snapshot started and moved into place,
+so a replica's file modification time says how fresh it is.
+
+Writes always go to the primary. Reads go to a replica only inside a
+request scope that chose one (``ReplicaReadMixin`` on the fitness viewsets
+does this for safe requests), never inside a transaction and never to a
+replica older than REPLICA_MAX_LAG_SECONDS. Within that:
+
+- a user stays on the primary until a replica has synced past their last
+  write through the API, so they always read their own writes;
+- a cached response is computed on the primary when one of its scopes was
+  bumped after the replica's snapshot, so stale data is never cached under
+  a new version (see ``caching.cache_response``);
+- in-process structures (leaderboard, activity type catalog, archive
+  boundary) load inside ``primary_reads()``.
+"""
+import contextvars
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_replica = contextvars.ContextVar('fitness_read_replica', default=None)
+
+
+def writes_scope(user_id):
+    """Version scope bumped by every API write of a user"""
+    return f'writes:{user_id}'
+
+
+def snapshot_ns(alias):
+    """When a replica's snapshot started, in ns since the epoch; 0 if it has none"""
+    try:
+        return os.stat(connections[alias].settings_dict['NAME']).st_mtime_ns
+    except (OSError, TypeError):
+        return 0
+
+
+def pick_replica(since_ns=0):
+    """A replica that includes writes up to ``since_ns`` and is within the lag limit, or None"""
+    oldest = max(since_ns, time.time_ns() - settings.REPLICA_MAX_LAG_SECONDS * 1_000_000_000)
+    fresh = [alias for alias in settings.READ_REPLICAS if snapshot_ns(alias) >= oldest]
+    return random.choice(fresh) if fresh else None
+
+
+@contextmanager
+def request_scope():
+    """Reads on the primary unless something inside chooses a replica; restored on exit"""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def read_from_replica(since_ns=0):
+    """Send the rest of this request scope's reads to a replica that includes writes up to ``since_ns``"""
+    _replica.set(pick_replica(since_ns))
+
+
+def require_snapshot(since_ns):
+    """Move this scope's reads back to the primary unless its replica includes writes up to ``since_ns``"""
+    alias = _replica.get()
+    if alias is not None and snapshot_ns(alias) < since_ns:
+        _replica.set(None)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, whatever the enclosing request chose"""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        # A transaction must read what it is about to write
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary, schema included
+        return db == DEFAULT_DB_ALIAS
+
+
+def sync_replica(alias):
+    """Copy the primary into a replica's file; returns the snapshot start time in ns"""
+    path = connections[alias].settings_dict['NAME']
+    temp_path = f'{path}.sync'
+    started = time.time_ns()
+    source = sqlite3.connect(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target)
+        # The copy inherits WAL from the primary; a file that is swapped whole must not have a -wal beside it
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    # A snapshot started here includes everything committed before it
+    os.utime(temp_path, ns=(started, started))
+    # Open connections keep reading the old file; replicas are not kept open between requests
+    os.replace(temp_path, path)
+    return started
@@ -0,0 +1,133 @@
+"""
+Daily activity rollups.
+
+``DailyActivityRollup`` holds one row per (user, day, activity type) with the
+count, minutes, points, distance and calories of that day's activities.
+Rows are adjusted incrementally with F() updates from the activity write
+path; ``backfill`` rebuilds the whole table by streaming the activity table.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Activity, ActivityHistory, DailyActivityRollup
+
+ROLLUP_FIELDS = ('count', 'minutes', 'points', 'distance', 'calories')
+
+
+def logged_at(values):
+    """Aware date_logged of a dict of tracked activity values"""
+    # Unsaved assignments may still be strings or naive datetimes, as the database layer accepts them
+    date_logged = Activity._meta.get_field('date_logged').to_python(values['date_logged'])
+    if timezone.is_naive(date_logged):
+        date_logged = timezone.make_aware(date_logged)
+    return date_logged
+
+
+def rollup_key(values):
+    """(user_id, date, activity_type_id) for a dict of tracked activity values"""
+    return (values['user_id'], timezone.localdate(logged_at(values)), values['activity_type_id'])
+
+
+def rollup_amounts(values):
+    return {
+        'count': 1,
+        'minutes': values['duration_minutes'],
+        'points': values['points_awarded'],
+        'distance': values['distance'] or 0,
+        'calories': values['calories_burned'] or 0,
+    }
+
+
+def apply_rollup_delta(key, amounts, sign=1):
+    """Add (sign=1) or subtract (sign=-1) amounts from one rollup row"""
+    user_id, date, activity_type_id = key
+    rows = DailyActivityRollup.objects.filter(user_id=user_id, date=date, activity_type_id=activity_type_id)
+    updated = rows.update(**{field: F(field) + sign * amounts[field] for field in ROLLUP_FIELDS})
+
+    if sign < 0:
+        rows.filter(count__lte=0).delete()
+    elif not updated:
+        try:
+            with transaction.atomic():
+                DailyActivityRollup.objects.create(
+                    user_id=user_id, date=date, activity_type_id=activity_type_id, **amounts
+                )
+        except IntegrityError:
+            # A concurrent write created the row first
+            apply_rollup_delta(key, amounts, sign)
+
+
+def record_activity_saved(activity, created):
+    """Move a created or updated activity's amounts into its day's rollup"""
+    stored = getattr(activity, '_stored', None)
+    current = activity.tracked_values()
+    if not created and stored is not None:
+        if stored == current:
+            return
+        apply_rollup_delta(rollup_key(stored), rollup_amounts(stored), -1)
+    apply_rollup_delta(rollup_key(current), rollup_amounts(current))
+
+
+def record_activities_created(activities):
+    """Add bulk-created activities to their rollups with one write per row"""
+    totals = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    for activity in activities:
+        values = activity.tracked_values()
+        row = totals[rollup_key(values)]
+        for field, amount in rollup_amounts(values).items():
+            row[field] += amount
+    for key, amounts in totals.items():
+        apply_rollup_delta(key, amounts)
+
+
+def record_activity_deleted(activity):
+    """Remove a deleted activity's amounts from its rollup"""
+    stored = getattr(activity, '_stored', None) or activity.tracked_values()
+    apply_rollup_delta(rollup_key(stored), rollup_amounts(stored), -1)
+
+
+def backfill(chunk_size=5000):
+    """
+    Rebuild every rollup from the live and archived activities.
+
+    Activities are streamed in (user, date_logged) order so each user-day is
+    finished before the next begins and memory stays constant.
+    Returns the number of rollup rows written.
+    """
+    activities = ActivityHistory.objects.order_by('user_id', '-date_logged').values(*Activity.TRACKED_FIELDS)
+
+    written = 0
+    pending = []
+    day = None
+    totals = {}
+
+    def flush():
+        nonlocal written, totals
+        pending.extend(
+            DailyActivityRollup(user_id=user_id, date=date, activity_type_id=activity_type_id, **amounts)
+            for (user_id, date, activity_type_id), amounts in totals.items()
+        )
+        totals = {}
+        if len(pending) >= chunk_size:
+            DailyActivityRollup.objects.bulk_create(pending)
+            written += len(pending)
+            pending.clear()
+
+    with transaction.atomic():
+        DailyActivityRollup.objects.all().delete()
+        for values in activities.iterator(chunk_size=chunk_size):
+            key = rollup_key(values)
+            if key[:2] != day:
+                flush()
+                day = key[:2]
+            row = totals.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+            for field, amount in rollup_amounts(values).items():
+                row[field] += amount
+        flush()
+        DailyActivityRollup.objects.bulk_create(pending)
+        written += len(pending)
+
+    return written
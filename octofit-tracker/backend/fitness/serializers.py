@@ -1,6 +1,14 @@
 from rest_framework import serializers
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from .models import UserProfile, Team, ActivityType, Activity, Challenge, WorkoutSuggestion
+from django.db.models import F
+from .models import (
+    UserProfile, Team, ActivityType, Activity, Challenge, ChallengeProgress, ChallengeTeamProgress,
+    WorkoutSuggestion
+)
+from . import caching, points, progress, rollups, tokens
+from .catalog import activity_catalog
+from .db import save_coalesced
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,6 +27,38 @@ class ActivityTypeSerializer(serializers.ModelSerializer):
         model = ActivityType
         fields = ['id', 'name', 'description', 'points_per_minute', 'category']
 
+class BulkActivitySerializer(serializers.ListSerializer):
+    """Validates a list of activities and inserts them with one bulk_create"""
+
+    def validate(self, attrs):
+        type_ids = {item['activity_type_id'] for item in attrs}
+        self.activity_types = {type_id: activity_catalog.get(type_id) for type_id in type_ids}
+        missing = {type_id for type_id, activity_type in self.activity_types.items() if activity_type is None}
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown activity_type_id: {', '.join(map(str, sorted(missing)))}"
+            )
+        return attrs
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        batch = self.context.get('batch')
+        activities = []
+        for item in validated_data:
+            activity = Activity(user=user, batch=batch, **item)
+            activity.activity_type = self.activity_types[item['activity_type_id']]
+            activity.points_awarded = activity.calculate_points()
+            activities.append(activity)
+
+        activities = Activity.objects.bulk_create(activities, batch_size=500)
+        points.record_activities_created(activities)
+        rollups.record_activities_created(activities)
+        progress.record_activities_created(activities)
+        caching.bump(f'activities:{user.pk}', 'leaderboard', 'teams')
+        for activity in activities:
+            activity._stored = activity.tracked_values()
+        return activities
+
 class ActivitySerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     activity_type = ActivityTypeSerializer(read_only=True)
@@ -29,10 +69,18 @@ class ActivitySerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'activity_type', 'activity_type_id', 'duration_minutes', 'intensity', 
                  'distance', 'calories_burned', 'notes', 'date_logged', 'points_awarded']
         read_only_fields = ['points_awarded']
+        list_serializer_class = BulkActivitySerializer
+
+    def validate_activity_type_id(self, value):
+        if activity_catalog.get(value) is None:
+            raise serializers.ValidationError(f"Unknown activity_type_id: {value}")
+        return value
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
+        validated_data['activity_type'] = activity_catalog.get(validated_data.pop('activity_type_id'))
+        # Concurrent inserts may share one transaction (production database profile)
+        return save_coalesced(Activity(**validated_data))
 
 class TeamSerializer(serializers.ModelSerializer):
     captain = UserSerializer(read_only=True)
@@ -46,6 +94,9 @@ class TeamSerializer(serializers.ModelSerializer):
                  'total_team_points', 'created_at', 'is_active']
 
     def get_member_count(self, obj):
+        # Annotated by the viewset queryset
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
         return obj.members.count()
 
     def create(self, validated_data):
@@ -54,6 +105,10 @@ class TeamSerializer(serializers.ModelSerializer):
         team.members.add(self.context['request'].user)  # Add captain as member
         return team
 
+class TeamMembersSerializer(serializers.Serializer):
+    """Users to add to or remove from a team in one request"""
+    user_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+
 class ChallengeSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     team_participants = TeamSerializer(many=True, read_only=True)
@@ -66,8 +121,38 @@ class ChallengeSerializer(serializers.ModelSerializer):
                  'participant_count', 'is_active', 'created_at']
 
     def get_participant_count(self, obj):
+        # Annotated by the viewset queryset
+        if hasattr(obj, 'participant_count'):
+            return obj.participant_count
         return obj.participants.count() + obj.team_participants.count()
 
+class EnrollTeamSerializer(serializers.Serializer):
+    team = serializers.PrimaryKeyRelatedField(queryset=Team.objects.filter(is_active=True))
+
+class ChallengeProgressSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username')
+    rank = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChallengeProgress
+        fields = ['user_id', 'username', 'value', 'completed_at', 'rank']
+
+    def get_rank(self, obj):
+        # This would be set in the view
+        return getattr(obj, 'rank', None)
+
+class ChallengeTeamProgressSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='team.name')
+    rank = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChallengeTeamProgress
+        fields = ['team_id', 'name', 'value', 'completed_at', 'rank']
+
+    def get_rank(self, obj):
+        # This would be set in the view
+        return getattr(obj, 'rank', None)
+
 class WorkoutSuggestionSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     activity_types = ActivityTypeSerializer(many=True, read_only=True)
@@ -93,6 +178,7 @@ class LeaderboardUserSerializer(serializers.ModelSerializer):
         return getattr(obj, 'rank', None)
 
 class LeaderboardTeamSerializer(serializers.ModelSerializer):
+    total_team_points = serializers.IntegerField(source='total_points', read_only=True)
     member_count = serializers.SerializerMethodField()
     rank = serializers.SerializerMethodField()
     
@@ -101,8 +187,72 @@ class LeaderboardTeamSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'total_team_points', 'member_count', 'rank']
 
     def get_member_count(self, obj):
+        # Annotated by the viewset queryset
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
         return obj.members.count()
 
     def get_rank(self, obj):
         # This would be set in the view
-        return getattr(obj, 'rank', None)
\ No newline at end of file
+        return getattr(obj, 'rank', None)
+
+# Compact serializers, selected with ?view=compact on hot list endpoints
+
+class CompactSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer for rows already shaped by values().
+
+    shape() asks the database for exactly the output columns, so each row
+    is passed through as-is: no model instances, no per-field
+    to_representation calls. Dates and decimals are left to the renderer.
+    """
+    columns = ()
+    expressions = {}
+
+    @classmethod
+    def shape(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.columns, **cls.expressions)
+
+    def to_representation(self, instance):
+        return instance
+
+class CompactActivitySerializer(CompactSerializer):
+    # The user is always request.user, so it is left out
+    columns = ('id', 'date_logged', 'activity_type_id', 'duration_minutes', 'intensity',
+               'distance', 'calories_burned', 'points_awarded', 'notes')
+    expressions = {'activity_type_name': F('activity_type__name')}
+
+class CompactTeamSerializer(CompactSerializer):
+    # Expects the member_count annotation from the viewset queryset
+    columns = ('id', 'name', 'description', 'captain_id', 'member_count', 'total_points',
+               'created_at', 'is_active')
+
+class CompactLeaderboardTeamSerializer(CompactSerializer):
+    # The view adds rank to each row
+    columns = ('id', 'name', 'total_points', 'member_count')
+
+class CompactLeaderboardUserSerializer(CompactSerializer):
+    """Leaderboard rows built by the view from (rank, user_id, points) and usernames"""
+
+
+class TokenObtainSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(write_only=True, style={'input_type': 'password'})
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), username=attrs['username'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with the provided credentials.')
+        attrs['user'] = user
+        return attrs
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    """A refresh token; validates to its claims"""
+    refresh = serializers.CharField()
+
+    def validate_refresh(self, value):
+        claims = tokens.verify(value, tokens.REFRESH)
+        if claims is None:
+            raise serializers.ValidationError('Invalid or expired refresh token.')
+        return claims
@@ -0,0 +1,152 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import UserProfile, Team, ActivityType, Activity, Challenge, ChallengeProgress, ChallengeTeamProgress
+from . import caching, jobs, leaderboard, points, progress, rollups
+from .catalog import activity_catalog
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, created, raw=False, **kwargs):
+    """Keep the user's total points, daily rollups and challenge progress in step with activity writes"""
+    if raw:
+        return
+    points.record_activity_saved(instance, created)
+    rollups.record_activity_saved(instance, created)
+    progress.record_activity_saved(instance, created)
+    instance._stored = instance.tracked_values()
+    caching.bump(f'activities:{instance.user_id}', 'leaderboard', 'teams')
+
+
+@receiver(post_delete, sender=Activity)
+def activity_deleted(sender, instance, origin=None, **kwargs):
+    """Remove a deleted activity from the user's total, rollups and challenge progress"""
+    # The profile and rollups go away with the user, and profile_deleted settles the teams
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is User:
+        return
+    points.record_activity_deleted(instance)
+    rollups.record_activity_deleted(instance)
+    progress.record_activity_deleted(instance)
+    caching.bump(f'activities:{instance.user_id}', 'leaderboard', 'teams')
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def team_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep team totals and team challenge progress in step with membership changes"""
+    owner = 'user_id' if reverse else 'team_id'
+    related = 'team_id__in' if reverse else 'user_id__in'
+
+    if action == 'post_add':
+        # pk_set only holds the rows that were actually inserted
+        points.apply_membership_change(1, **{owner: instance.pk, related: pk_set})
+    elif action == 'pre_remove':
+        points.apply_membership_change(-1, **{owner: instance.pk, related: pk_set})
+    elif action == 'pre_clear':
+        points.apply_membership_change(-1, **{owner: instance.pk})
+        if reverse:
+            instance._cleared_team_ids = list(instance.teams.values_list('pk', flat=True))
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            team_ids = [instance.pk]
+        elif action == 'post_clear':
+            team_ids = instance.__dict__.pop('_cleared_team_ids', [])
+        else:
+            team_ids = list(pk_set)
+        progress.rebuild_team_progress(team_ids)
+        caching.bump('teams')
+
+
+def _challenge_members_changed(counter_model, owner_field, instance, action, reverse, pk_set):
+    """Start counters for new challenge participants and drop those of leavers"""
+    # Forward: instance is the challenge and pk_set holds user/team ids; reverse is the other way round
+    if action == 'post_add':
+        no_scope = {'user_ids': (), 'team_ids': ()}
+        if reverse:
+            for challenge in Challenge.objects.filter(pk__in=pk_set):
+                progress.rebuild_progress(challenge, **dict(no_scope, **{f'{owner_field}s': [instance.pk]}))
+        else:
+            progress.rebuild_progress(instance, **dict(no_scope, **{f'{owner_field}s': pk_set}))
+
+    elif action in ('post_remove', 'post_clear'):
+        if reverse:
+            counters = counter_model.objects.filter(**{owner_field: instance.pk})
+            if pk_set is not None:
+                counters = counters.filter(challenge_id__in=pk_set)
+        else:
+            counters = counter_model.objects.filter(challenge_id=instance.pk)
+            if pk_set is not None:
+                counters = counters.filter(**{f'{owner_field}__in': pk_set})
+        counters.delete()
+
+
+@receiver(post_save, sender=Challenge)
+def challenge_saved(sender, instance, created, raw=False, **kwargs):
+    """Recompute a challenge's counters when its target or window changes"""
+    if raw or created:
+        return
+    stored = getattr(instance, '_stored_progress_fields', None)
+    current = instance.progress_fields()
+    if stored is not None and stored != current:
+        progress.rebuild_progress(instance)
+    instance._stored_progress_fields = current
+
+
+@receiver(m2m_changed, sender=Challenge.participants.through)
+def challenge_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _challenge_members_changed(ChallengeProgress, 'user_id', instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Challenge.team_participants.through)
+def challenge_teams_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _challenge_members_changed(ChallengeTeamProgress, 'team_id', instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, raw=False, **kwargs):
+    """Keep the in-process leaderboard in step with profile writes"""
+    if raw:
+        return
+    leaderboard.record_points_total(instance.user_id, instance.total_points)
+    caching.bump('leaderboard')
+
+
+@receiver(pre_delete, sender=UserProfile)
+def profile_deleted(sender, instance, **kwargs):
+    """Remove a deleted profile's points from the user's teams and the leaderboard"""
+    Team.objects.filter(members=instance.user_id).update(
+        total_points=F('total_points') - instance.total_points
+    )
+    transaction.on_commit(lambda: leaderboard.leaderboard.remove(instance.user_id))
+    caching.bump('leaderboard', 'teams')
+
+
+@receiver(post_save, sender=ActivityType)
+@receiver(post_delete, sender=ActivityType)
+def activity_type_changed(sender, **kwargs):
+    """Invalidate cached catalog and stats responses and the activity type registry"""
+    # Other processes reload once the bump commits; this one must not wait for it
+    activity_catalog.invalidate()
+    caching.bump('activity_types')
+
+
+@receiver(post_save, sender=ActivityType)
+def activity_type_rate_changed(sender, instance, created, raw=False, **kwargs):
+    """Re-price existing activities in the background when points_per_minute changes"""
+    if raw or created:
+        return
+    stored = getattr(instance, '_stored_points_per_minute', None)
+    if stored is not None and stored != instance.points_per_minute:
+        jobs.enqueue('recalculate_points', activity_type_id=instance.pk)
+    instance._stored_points_per_minute = instance.points_per_minute
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_changed(sender, **kwargs):
+    """Invalidate cached team leaderboards"""
+    caching.bump('teams')
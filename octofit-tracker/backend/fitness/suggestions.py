@@ -0,0 +1,174 @@
+"""
+Batch workout suggestion generator.
+
+``generate_chunk`` handles the next chunk of users in id order; the
+``generate_suggestions`` job and management command walk the whole user
+base with it. For each chunk it
+loads every user's recent minutes per (activity type, intensity) with one
+grouped query, scores each activity type against the user's fitness level
+and category balance, and writes the chunk's suggestions and their
+``activity_types`` links with two bulk inserts. A user's open suggestions
+are replaced; completed ones are kept as history.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Activity, ActivityType, UserProfile, WorkoutSuggestion
+
+# How strongly each fitness level leans towards a category, on top of balance
+LEVEL_CATEGORY_WEIGHTS = {
+    'beginner': {'cardio': 0.3, 'flexibility': 0.3, 'strength': 0.1, 'sports': 0.0, 'other': 0.0},
+    'intermediate': {'cardio': 0.2, 'flexibility': 0.1, 'strength': 0.2, 'sports': 0.2, 'other': 0.0},
+    'advanced': {'cardio': 0.2, 'flexibility': 0.0, 'strength': 0.3, 'sports': 0.3, 'other': 0.0},
+}
+LEVEL_DURATIONS = {'beginner': 20, 'intermediate': 30, 'advanced': 45}
+# Weight of how much of the user's time already goes to a type (they enjoy it)
+FAMILIARITY_WEIGHT = 0.3
+TYPES_PER_SUGGESTION = 2
+
+
+class Catalog:
+    """The activity types to score and their category labels, loaded once per run"""
+
+    def __init__(self):
+        self.types = list(ActivityType.objects.order_by('name').values('id', 'name', 'category'))
+        self.labels = dict(ActivityType._meta.get_field('category').choices)
+
+
+def load_profiles(user_ids, since):
+    """
+    Recent activity profile per user: minutes by type and category, session count, high-intensity share.
+
+    One grouped query for the whole chunk.
+    """
+    rows = Activity.objects.filter(
+        user_id__gte=user_ids[0], user_id__lte=user_ids[-1], date_logged__gte=since
+    ).order_by().values('user_id', 'activity_type_id', 'activity_type__category', 'intensity').annotate(
+        minutes=Sum('duration_minutes'), sessions=Count('id')
+    )
+    profiles = defaultdict(lambda: {
+        'type_minutes': defaultdict(int), 'category_minutes': defaultdict(int),
+        'minutes': 0, 'sessions': 0, 'high_minutes': 0,
+    })
+    for row in rows:
+        profile = profiles[row['user_id']]
+        profile['type_minutes'][row['activity_type_id']] += row['minutes']
+        profile['category_minutes'][row['activity_type__category']] += row['minutes']
+        profile['minutes'] += row['minutes']
+        profile['sessions'] += row['sessions']
+        if row['intensity'] == 'high':
+            profile['high_minutes'] += row['minutes']
+    return profiles
+
+
+def score_types(profile, fitness_level, catalog):
+    """(score, activity type row) pairs, best first"""
+    total = profile['minutes'] if profile else 0
+    weights = LEVEL_CATEGORY_WEIGHTS[fitness_level]
+    scored = []
+    for row in catalog.types:
+        category = row['category']
+        if total:
+            balance = 1 - profile['category_minutes'][category] / total
+            familiarity = profile['type_minutes'][row['id']] / total
+        else:
+            balance, familiarity = 1, 0
+        scored.append((balance + FAMILIARITY_WEIGHT * familiarity + weights.get(category, 0), row))
+    scored.sort(key=lambda pair: -pair[0])
+    return scored
+
+
+def recommended_duration(profile, fitness_level):
+    """The user's usual session length, shorter when most of it is high intensity; a level default without history"""
+    if not profile or not profile['sessions']:
+        return LEVEL_DURATIONS[fitness_level]
+    minutes = profile['minutes'] / profile['sessions']
+    if profile['high_minutes'] * 2 > profile['minutes']:
+        minutes *= 0.8
+    return min(90, max(15, int(round(minutes / 5)) * 5))
+
+
+def plan_suggestions(user_id, fitness_level, profile, catalog, per_user):
+    """(WorkoutSuggestion, [activity_type_id, ...]) for one user's best-scoring categories"""
+    by_category = {}
+    for score, row in score_types(profile, fitness_level, catalog):
+        by_category.setdefault(row['category'], []).append(row)
+    duration = recommended_duration(profile, fitness_level)
+
+    planned = []
+    # Categories come out in order of their best type's score
+    for category, rows in list(by_category.items())[:per_user]:
+        rows = rows[:TYPES_PER_SUGGESTION]
+        label = catalog.labels.get(category, category.title())
+        names = ' or '.join(row['name'] for row in rows)
+        if profile and profile['category_minutes'][category]:
+            share = profile['category_minutes'][category] * 100 // profile['minutes']
+            reason = f"{label} is {share}% of your recent activity."
+        else:
+            reason = f"You haven't done any {label.lower()} recently."
+        planned.append((
+            WorkoutSuggestion(
+                user_id=user_id,
+                title=f"{duration}-minute {label.lower()} session",
+                description=f"Try {names}. {reason}",
+                recommended_duration=duration,
+                difficulty_level=fitness_level,
+            ),
+            [row['id'] for row in rows],
+        ))
+    return planned
+
+
+def generate_chunk(after_user_id, chunk_size, catalog=None, now=None):
+    """
+    Replace the open suggestions of the next ``chunk_size`` users after ``after_user_id``.
+
+    Returns (last user id, users processed, suggestions written); last user
+    id is None when no users are left.
+    """
+    catalog = catalog or Catalog()
+    users = list(
+        UserProfile.objects.filter(user_id__gt=after_user_id).order_by('user_id').values_list(
+            'user_id', 'fitness_level'
+        )[:chunk_size]
+    )
+    if not users:
+        return None, 0, 0
+    user_ids = [user_id for user_id, level in users]
+    since = (now or timezone.now()) - timezone.timedelta(days=settings.SUGGESTION_WINDOW_DAYS)
+    profiles = load_profiles(user_ids, since)
+
+    planned = []
+    for user_id, fitness_level in users:
+        planned += plan_suggestions(
+            user_id, fitness_level, profiles.get(user_id), catalog, settings.SUGGESTIONS_PER_USER
+        )
+
+    Link = WorkoutSuggestion.activity_types.through
+    with transaction.atomic():
+        # Two DELETE statements instead of loading every open suggestion into the deletion collector
+        open_suggestions = WorkoutSuggestion.objects.filter(user_id__in=user_ids, is_completed=False)
+        Link.objects.filter(workoutsuggestion__in=open_suggestions).delete()
+        # Nothing references the suggestions once their links are gone
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE {} IN ({}) AND {} = %s'.format(
+                    connection.ops.quote_name(WorkoutSuggestion._meta.db_table),
+                    connection.ops.quote_name(WorkoutSuggestion._meta.get_field('user').column),
+                    ', '.join(['%s'] * len(user_ids)),
+                    connection.ops.quote_name(WorkoutSuggestion._meta.get_field('is_completed').column),
+                ),
+                [*user_ids, False],
+            )
+        # SQLite and PostgreSQL set the new primary keys, so the links can be written in bulk too
+        WorkoutSuggestion.objects.bulk_create([suggestion for suggestion, type_ids in planned])
+        Link.objects.bulk_create(
+            Link(workoutsuggestion_id=suggestion.pk, activitytype_id=type_id)
+            for suggestion, type_ids in planned
+            for type_id in type_ids
+        )
+    return user_ids[-1], len(users), len(planned)
@@ -1,3 +1,1494 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import threading
+import time
+from datetime import date
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from .models import (
+    UserProfile, Team, ActivityType, Activity, ActivityBatch, ArchivedActivity, Challenge, ChallengeProgress,
+    ChallengeTeamProgress, DailyActivityRollup, Job, WorkoutSuggestion
+)
+from . import archive, async_views, benchmarks, caching, checks, jobs, live, replicas, rollups, suggestions, tokens
+from .admin import ActivityAdmin, EstimatedCountPaginator
+from .catalog import activity_catalog
+from .db import save_coalesced
+from .leaderboard import leaderboard
+from .metrics import registry
+from .points import reconcile_team_points, reconcile_user_points
+from .progress import apply_progress_delta, rebuild_progress
 
 # Create your tests here.
+
+
+class PointsLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='walker')
+        self.other = User.objects.create_user(username='jogger')
+        self.walking = ActivityType.objects.create(name='Walking', points_per_minute=1)
+        self.running = ActivityType.objects.create(name='Running', points_per_minute=3)
+
+    def total(self, user):
+        return UserProfile.objects.get(user=user).total_points
+
+    def log(self, minutes, activity_type=None, user=None):
+        return Activity.objects.create(
+            user=user or self.user, activity_type=activity_type or self.walking, duration_minutes=minutes
+        )
+
+    def test_create_update_delete(self):
+        activity = self.log(10)
+        self.log(5)
+        self.assertEqual(self.total(self.user), 15)
+
+        activity.duration_minutes = 20
+        activity.save()
+        self.assertEqual(self.total(self.user), 25)
+
+        activity.intensity = 'high'
+        activity.save()
+        self.assertEqual(self.total(self.user), 31)
+
+        activity.delete()
+        self.assertEqual(self.total(self.user), 5)
+
+    def test_change_of_activity_type_and_user(self):
+        activity = self.log(10)
+        # A reloaded instance, as the API and admin update it
+        activity = Activity.objects.get(pk=activity.pk)
+        activity.activity_type = self.running
+        activity.save()
+        self.assertEqual(activity.points_awarded, 30)
+        self.assertEqual(self.total(self.user), 30)
+
+        self.log(1, user=self.other)
+        activity.user = self.other
+        activity.save()
+        self.assertEqual(self.total(self.user), 0)
+        self.assertEqual(self.total(self.other), 31)
+
+    def test_missing_profile_is_seeded_from_history(self):
+        # Written without the ledger, so there is no profile yet
+        Activity.objects.bulk_create([
+            Activity(user=self.user, activity_type=self.walking, duration_minutes=7, points_awarded=7)
+        ])
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+        self.log(3)
+        self.assertEqual(self.total(self.user), 10)
+
+    def test_reconcile_repairs_drift(self):
+        self.log(10)
+        self.log(4, user=self.other)
+        UserProfile.objects.filter(user=self.user).update(total_points=99)
+
+        self.assertEqual(reconcile_user_points(dry_run=True), [(self.user.pk, 99, 10)])
+        self.assertEqual(self.total(self.user), 99)
+        self.assertEqual(reconcile_user_points(), [(self.user.pk, 99, 10)])
+        self.assertEqual(self.total(self.user), 10)
+        self.assertEqual(reconcile_user_points(), [])
+
+
+class TeamPointsTests(TestCase):
+    def setUp(self):
+        self.captain = User.objects.create_user(username='captain')
+        self.member = User.objects.create_user(username='member')
+        self.activity_type = ActivityType.objects.create(name='Rowing', points_per_minute=2)
+        self.team = Team.objects.create(name='Rowers', captain=self.captain)
+        self.other_team = Team.objects.create(name='Scullers', captain=self.captain)
+        self.team.members.add(self.captain)
+        Activity.objects.create(user=self.member, activity_type=self.activity_type, duration_minutes=10)
+
+    def team_total(self, team):
+        return Team.objects.get(pk=team.pk).total_points
+
+    def test_member_activity_moves_team_total(self):
+        activity = Activity.objects.create(user=self.captain, activity_type=self.activity_type, duration_minutes=5)
+        self.assertEqual(self.team_total(self.team), 10)
+        activity.duration_minutes = 8
+        activity.save()
+        self.assertEqual(self.team_total(self.team), 16)
+        activity.delete()
+        self.assertEqual(self.team_total(self.team), 0)
+        self.assertEqual(self.team_total(self.other_team), 0)
+
+    def test_join_and_leave_apply_the_full_total(self):
+        self.team.members.add(self.member)
+        self.assertEqual(self.team_total(self.team), 20)
+        self.team.members.remove(self.member)
+        self.assertEqual(self.team_total(self.team), 0)
+
+        # Reverse side of the relation
+        self.member.teams.add(self.team, self.other_team)
+        self.assertEqual((self.team_total(self.team), self.team_total(self.other_team)), (20, 20))
+        self.member.teams.clear()
+        self.assertEqual((self.team_total(self.team), self.team_total(self.other_team)), (0, 0))
+
+    def test_reconcile_repairs_drift_of_selected_teams(self):
+        self.team.members.add(self.member)
+        self.other_team.members.add(self.member)
+        Team.objects.update(total_points=5)
+
+        self.assertEqual(reconcile_team_points(team_ids=[self.team.pk]), [(self.team.pk, 5, 20)])
+        self.assertEqual((self.team_total(self.team), self.team_total(self.other_team)), (20, 5))
+        self.assertEqual(reconcile_team_points(), [(self.other_team.pk, 5, 20)])
+        self.assertEqual(reconcile_team_points(), [])
+
+
+class ActivityStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stats')
+        walking = ActivityType.objects.create(name='Walking', points_per_minute=1)
+        running = ActivityType.objects.create(name='Running', points_per_minute=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            for logged, activity_type, minutes in (
+                ('2026-03-30T10:00:00Z', walking, 10),  # Monday
+                ('2026-03-31T12:00:00Z', running, 20),
+                ('2026-03-31T15:00:00Z', walking, 5),
+                ('2026-04-02T09:00:00Z', running, 10),
+                ('2026-04-07T18:00:00Z', walking, 30),  # Tuesday of the next week
+            ):
+                Activity.objects.create(
+                    user=self.user, activity_type=activity_type, duration_minutes=minutes, date_logged=logged
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stats(self, **params):
+        response = self.client.get('/api/activities/stats/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def series(self, group_by):
+        return [
+            (row['period'], row['count'], row['total_minutes'], row['total_points'])
+            for row in self.stats(group_by=group_by)['time_series']
+        ]
+
+    def test_breakdown(self):
+        data = self.stats()
+        self.assertEqual((data['total_activities'], data['total_minutes'], data['total_points']), (5, 75, 135))
+        self.assertEqual(data['activity_breakdown'], {
+            'Walking': {'count': 3, 'total_minutes': 45, 'total_points': 45},
+            'Running': {'count': 2, 'total_minutes': 30, 'total_points': 90},
+        })
+        self.assertNotIn('time_series', data)
+
+    def test_time_series_buckets(self):
+        self.assertEqual(self.series('day'), [
+            ('2026-03-30', 1, 10, 10),
+            ('2026-03-31', 2, 25, 65),
+            ('2026-04-02', 1, 10, 30),
+            ('2026-04-07', 1, 30, 30),
+        ])
+        self.assertEqual(self.series('week'), [('2026-03-30', 4, 45, 105), ('2026-04-06', 1, 30, 30)])
+        self.assertEqual(self.series('month'), [('2026-03-01', 3, 35, 75), ('2026-04-01', 2, 40, 60)])
+
+    def test_invalid_group_by(self):
+        response = self.client.get('/api/activities/stats/', {'group_by': 'year'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group_by', response.json()['error'])
+
+    def test_invalid_dates(self):
+        # The async view authenticates from the session
+        self.client.force_login(self.user)
+        for params in ({'start_date': '2024-13-45'}, {'start_date': 'foo'}, {'end_date': '2026-04-01T25:00:00Z'}):
+            for url in ('/api/activities/stats/', '/api/async/activities/stats/'):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400, (url, params))
+                self.assertIn(next(iter(params)), response.json()['error'])
+
+
+class BulkActivityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='wearable')
+        self.activity_type = ActivityType.objects.create(name='Cycling', points_per_minute=2)
+        now = timezone.now()
+        self.challenge = Challenge.objects.create(
+            title='Spin month', description='', target_value=100, target_metric='minutes',
+            start_date=now - timezone.timedelta(days=1), end_date=now + timezone.timedelta(days=1),
+        )
+        self.challenge.participants.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, *minutes):
+        return [{'activity_type_id': self.activity_type.pk, 'duration_minutes': value} for value in minutes]
+
+    def post(self, payload, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post('/api/activities/bulk/', payload, format='json', **headers)
+
+    def test_creates_batch_and_applies_side_effects(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(self.payload(10, 20, 30), key='sync-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+
+        activities = Activity.objects.filter(user=self.user)
+        self.assertEqual(activities.count(), 3)
+        self.assertEqual(set(activities.values_list('batch__idempotency_key', flat=True)), {'sync-1'})
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, 120)
+        rollup = DailyActivityRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.count, rollup.minutes, rollup.points), (3, 60, 120))
+        self.assertEqual(ChallengeProgress.objects.get(challenge=self.challenge, user=self.user).value, 60)
+
+    def test_replay_returns_the_stored_batch(self):
+        first = self.post(self.payload(10, 20), key='sync-2').json()
+        response = self.post(self.payload(99), key='sync-2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), first)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, 60)
+
+    def test_concurrent_duplicate_key_conflicts(self):
+        ActivityBatch.objects.create(user=self.user, idempotency_key='sync-3')
+        # The other request stored its batch after this one looked for it
+        with mock.patch.object(ActivityBatch.objects, 'filter', return_value=ActivityBatch.objects.none()):
+            response = self.post(self.payload(10), key='sync-3')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Activity.objects.filter(user=self.user).exists())
+
+    def test_limits(self):
+        with mock.patch('fitness.views.BULK_ACTIVITY_LIMIT', 2):
+            self.assertEqual(self.post(self.payload(1, 2, 3)).status_code, 400)
+        response = self.post(self.payload(10), key='k' * 101)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Idempotency-Key', response.json()['error'])
+        self.assertEqual(self.post(self.payload(10), key='k' * 100).status_code, 201)
+        self.assertEqual(self.post([{'activity_type_id': 999, 'duration_minutes': 5}]).status_code, 400)
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 1)
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        leaderboard.invalidate()
+        caching.get_cache().clear()
+        # d is on 10 points, b and c tie on 20, a leads on 30
+        self.users = {}
+        for name, points in (('a', 30), ('b', 20), ('c', 20), ('d', 10)):
+            self.users[name] = User.objects.create_user(username=name)
+            UserProfile.objects.create(user=self.users[name], total_points=points)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['c'])
+
+    def test_ranks_and_ties(self):
+        # Ties are broken by user id, so every rank is distinct
+        self.assertEqual(
+            [(rank, points) for rank, user_id, points in leaderboard.page(1, 10)],
+            [(1, 30), (2, 20), (3, 20), (4, 10)],
+        )
+        self.assertEqual(leaderboard.rank(self.users['b'].pk), 2)
+        self.assertEqual(leaderboard.rank(self.users['c'].pk), 3)
+        self.assertIsNone(leaderboard.rank(0))
+
+        leaderboard.add_points(self.users['d'].pk, 15)
+        self.assertEqual(leaderboard.rank(self.users['d'].pk), 2)
+        self.assertEqual(leaderboard.rank(self.users['c'].pk), 4)
+        leaderboard.remove(self.users['a'].pk)
+        self.assertEqual(leaderboard.rank(self.users['d'].pk), 1)
+        self.assertEqual(len(leaderboard), 3)
+
+    def test_me_and_around(self):
+        self.assertEqual(
+            self.client.get('/api/leaderboard/me/').json(), {'rank': 3, 'total_points': 20, 'total_users': 4}
+        )
+        rows = self.client.get('/api/leaderboard/around/', {'radius': 1}).json()
+        self.assertEqual([(row['rank'], row['username']) for row in rows], [(2, 'b'), (3, 'c'), (4, 'd')])
+        rows = self.client.get('/api/leaderboard/around/', {'user_id': self.users['a'].pk, 'radius': 1}).json()
+        self.assertEqual([(row['rank'], row['username']) for row in rows], [(1, 'a'), (2, 'b')])
+        self.assertEqual(self.client.get('/api/leaderboard/around/', {'user_id': 0}).json(), [])
+        self.assertEqual(self.client.get('/api/leaderboard/around/', {'radius': 'x'}).status_code, 400)
+
+    def test_writes_from_other_workers_rebuild_the_board(self):
+        self.assertEqual(leaderboard.rank(self.users['d'].pk), 4)
+        # Another worker commits a write: the table and the shared scope version change, this process sees no delta
+        UserProfile.objects.filter(user=self.users['d']).update(total_points=99)
+        self.assertEqual(leaderboard.rank(self.users['d'].pk), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump('leaderboard')
+        self.assertEqual(leaderboard.rank(self.users['d'].pk), 1)
+        self.assertEqual(self.client.get('/api/leaderboard/me/').json()['rank'], 4)
+
+    def test_rebuild_keeps_updates_made_during_the_scan(self):
+        leaderboard.rebuild()
+        user_id = self.users['d'].pk
+        load = leaderboard._load
+
+        def racing_load(user_ids=None):
+            points = load(user_ids)
+            if user_ids is None:
+                # A write commits and reports its delta after the scan read the old total
+                UserProfile.objects.filter(user_id=user_id).update(total_points=60)
+                leaderboard.add_points(user_id, 50)
+            return points
+
+        with mock.patch.object(leaderboard, '_load', side_effect=racing_load):
+            leaderboard.rebuild()
+        self.assertEqual(leaderboard.points(user_id), 60)
+        self.assertEqual(leaderboard.rank(user_id), 1)
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints must run a constant number of queries regardless of page size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='runner', password='pass')
+        cls.activity_types = [
+            ActivityType.objects.create(name=f'type-{i}', points_per_minute=1 + i) for i in range(3)
+        ]
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def seed(self, count):
+        """Create ``count`` rows behind every list endpoint for the test user"""
+        now = timezone.now()
+        # Run the commit hooks so cached responses are invalidated as in production
+        with self.captureOnCommitCallbacks(execute=True):
+            self._seed(count, now)
+
+    def _seed(self, count, now):
+        for i in range(count):
+            teammate = User.objects.create_user(username=f'mate-{count}-{i}')
+            team = Team.objects.create(name=f'team-{count}-{i}', captain=teammate)
+            team.members.add(self.user, teammate)
+
+            challenge = Challenge.objects.create(
+                title=f'challenge-{count}-{i}', description='', target_value=100,
+                start_date=now, end_date=now + timezone.timedelta(days=7),
+            )
+            challenge.participants.add(self.user, teammate)
+            challenge.team_participants.add(team)
+
+            suggestion = WorkoutSuggestion.objects.create(
+                user=self.user, title=f'suggestion-{count}-{i}', description='',
+                recommended_duration=30, difficulty_level='beginner',
+            )
+            suggestion.activity_types.add(*self.activity_types)
+
+            Activity.objects.create(
+                user=self.user, activity_type=self.activity_types[i % 3], duration_minutes=10
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, expected):
+        self.seed(2)
+        self.assertEqual(self.count_queries(url), expected)
+        self.seed(15)
+        self.assertEqual(self.count_queries(url), expected)
+
+    def test_activities(self):
+        # cursor pagination: page only, no count (the archive boundary is cached per process)
+        archive.archive_boundary()
+        self.assertConstantQueries('/api/activities/', 1)
+
+    def test_teams(self):
+        # count + page + members
+        self.assertConstantQueries('/api/teams/', 3)
+
+    def test_challenges(self):
+        # count + page + participants + team_participants + their members
+        self.assertConstantQueries('/api/challenges/', 5)
+        # The user takes part both directly and through a team; each challenge is still listed once
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/challenges/').json()['count'], 17)
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in queries))
+
+    def test_workout_suggestions(self):
+        # count + page + activity_types
+        self.assertConstantQueries('/api/workout-suggestions/', 3)
+
+    def test_profiles(self):
+        # count + page
+        self.assertConstantQueries('/api/profiles/', 2)
+
+    def test_team_leaderboard(self):
+        self.assertConstantQueries('/api/leaderboard/teams/', 1)
+
+    def test_stats(self):
+        self.assertConstantQueries('/api/activities/stats/', 1)
+
+    def test_counts_are_annotated(self):
+        self.seed(1)
+        team = self.client.get('/api/teams/').json()['results'][0]
+        self.assertEqual(team['member_count'], 2)
+        challenge = self.client.get('/api/challenges/').json()['results'][0]
+        self.assertEqual(challenge['participant_count'], 3)
+        self.assertEqual(challenge['team_participants'][0]['member_count'], 2)
+
+
+class BenchmarkHarnessTests(TestCase):
+    def test_run_covers_every_get_route(self):
+        caching.get_cache().clear()
+        benchmarks.seed(users=20, activities=200, teams=5, challenges=3, suggestions=20)
+        results = benchmarks.run(iterations=2)
+
+        self.assertEqual(set(results), {name for name, basename, is_detail in benchmarks.get_routes()})
+        for name, metrics in results.items():
+            self.assertEqual(metrics['status'], 200, name)
+        # Cached endpoints are measured rendering, not served from the response cache
+        self.assertGreater(results['activity-stats']['queries'], 0)
+
+        self.assertEqual(benchmarks.compare(results, results), [])
+        baseline = {name: dict(metrics, queries=metrics['queries'] - 1) for name, metrics in results.items()}
+        self.assertEqual(len(benchmarks.compare(results, baseline)), len(results))
+
+        throughput = benchmarks.serializer_throughput(rows=50, repeat=1)
+        self.assertEqual(throughput['activities']['rows'], 50)
+
+
+class ActivityCursorPaginationTests(TestCase):
+    def test_walks_history_without_gaps_or_duplicates(self):
+        user = User.objects.create_user(username='walker')
+        activity_type = ActivityType.objects.create(name='Walking')
+        logged = timezone.now()
+        # Identical timestamps exercise the id tie-breaker
+        for i in range(45):
+            Activity.objects.create(
+                user=user, activity_type=activity_type, duration_minutes=10,
+                date_logged=logged - timezone.timedelta(hours=i // 3),
+            )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        seen = []
+        url = '/api/activities/'
+        while url:
+            page = client.get(url).json()
+            self.assertNotIn('count', page)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+
+        expected = list(Activity.objects.order_by('-date_logged', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollup')
+        self.walking = ActivityType.objects.create(name='Walking', points_per_minute=1)
+        self.running = ActivityType.objects.create(name='Running', points_per_minute=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def log(self, activity_type, minutes, logged, **fields):
+        return Activity.objects.create(
+            user=self.user, activity_type=activity_type, duration_minutes=minutes, date_logged=logged, **fields
+        )
+
+    def rows(self):
+        return list(
+            DailyActivityRollup.objects.order_by('date', 'activity_type__name')
+            .values_list('date', 'activity_type__name', 'count', 'minutes', 'points', 'distance', 'calories')
+        )
+
+    def test_write_path(self):
+        walk = self.log(self.walking, 10, '2026-03-30T10:00:00Z', distance=1.5, calories_burned=50)
+        self.log(self.walking, 20, '2026-03-30T18:00:00Z')
+        self.assertEqual(self.rows(), [(date(2026, 3, 30), 'Walking', 2, 30, 30, 1.5, 50)])
+
+        # Moving an activity to another day takes its amounts with it
+        walk.date_logged = '2026-03-31T10:00:00Z'
+        walk.duration_minutes = 15
+        walk.save()
+        self.assertEqual(self.rows(), [
+            (date(2026, 3, 30), 'Walking', 1, 20, 20, 0, 0),
+            (date(2026, 3, 31), 'Walking', 1, 15, 15, 1.5, 50),
+        ])
+
+        # The row for a day with nothing left is removed
+        walk.delete()
+        self.assertEqual(self.rows(), [(date(2026, 3, 30), 'Walking', 1, 20, 20, 0, 0)])
+
+    def test_backfill_command(self):
+        self.log(self.walking, 10, '2026-03-30T10:00:00Z')
+        self.log(self.running, 20, '2026-03-30T12:00:00Z')
+        self.log(self.walking, 5, '2026-03-31T09:00:00Z')
+        expected = self.rows()
+        DailyActivityRollup.objects.all().delete()
+        DailyActivityRollup.objects.create(user=self.user, date=date(2026, 1, 1), activity_type=self.walking, count=9)
+
+        out = io.StringIO()
+        call_command('backfill_rollups', '--chunk-size', '1', stdout=out)
+        self.assertIn('Wrote 3 rollup row(s)', out.getvalue())
+        self.assertEqual(self.rows(), expected)
+
+    def test_rollup_stats_match_raw_stats(self):
+        for logged, activity_type, minutes in (
+            ('2026-03-29T23:59:00Z', self.walking, 5),
+            ('2026-03-30T10:00:00Z', self.walking, 10),
+            ('2026-03-31T12:00:00Z', self.running, 20),
+            ('2026-04-02T09:00:00Z', self.running, 10),
+            ('2026-04-06T23:59:00Z', self.walking, 30),
+            ('2026-04-07T08:00:00Z', self.walking, 40),
+        ):
+            self.log(activity_type, minutes, logged)
+
+        for group_by in ('day', 'week', 'month'):
+            # Date-only bounds read the rollups; the same bounds as datetimes read the raw activities
+            rollup = self.client.get(
+                '/api/activities/stats/', {'start_date': '2026-03-30', 'end_date': '2026-04-07', 'group_by': group_by}
+            ).json()
+            raw = self.client.get('/api/activities/stats/', {
+                'start_date': '2026-03-30T00:00:00Z', 'end_date': '2026-04-07T00:00:00Z', 'group_by': group_by,
+            }).json()
+            self.assertEqual(rollup, raw)
+            self.assertEqual(rollup['total_activities'], 4)
+
+
+class ChallengeProgressTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='climber')
+        self.teammate = User.objects.create_user(username='belayer')
+        self.walking = ActivityType.objects.create(name='Walking', points_per_minute=1)
+        self.running = ActivityType.objects.create(name='Running', points_per_minute=3)
+        window = {'start_date': '2026-03-01T00:00:00Z', 'end_date': '2026-03-31T23:59:59Z'}
+        self.challenge = Challenge.objects.create(
+            title='March points', description='', target_value=30, target_metric='points', **window
+        )
+        self.challenge.participants.add(self.user)
+        self.team = Team.objects.create(name='Ropes', captain=self.user)
+        self.team_challenge = Challenge.objects.create(
+            title='March minutes', description='', challenge_type='team', target_value=50,
+            target_metric='minutes', **window
+        )
+        self.team_challenge.team_participants.add(self.team)
+
+    def log(self, user, activity_type, minutes, logged='2026-03-10T10:00:00Z'):
+        return Activity.objects.create(
+            user=user, activity_type=activity_type, duration_minutes=minutes, date_logged=logged
+        )
+
+    def progress(self):
+        counter = ChallengeProgress.objects.filter(challenge=self.challenge, user=self.user).first()
+        return (counter.value, counter.completed_at is not None) if counter else None
+
+    def team_progress(self):
+        counter = ChallengeTeamProgress.objects.filter(challenge=self.team_challenge, team=self.team).first()
+        return (counter.value, counter.completed_at is not None) if counter else None
+
+    def test_apply_progress_delta(self):
+        def apply(delta):
+            apply_progress_delta(ChallengeProgress, self.challenge.pk, 30, delta, user_id=self.user.pk)
+            return ChallengeProgress.objects.get(challenge=self.challenge, user=self.user)
+
+        # A negative delta never creates a counter
+        apply_progress_delta(ChallengeProgress, self.challenge.pk, 30, -5, user_id=self.user.pk)
+        self.assertFalse(ChallengeProgress.objects.exists())
+
+        counter = apply(10)
+        self.assertEqual((counter.value, counter.completed_at), (10, None))
+        completed_at = apply(25).completed_at
+        self.assertIsNotNone(completed_at)
+        # Crossing the target again keeps the first completion time
+        self.assertEqual(apply(5).completed_at, completed_at)
+        counter = apply(-10)
+        self.assertEqual((counter.value, counter.completed_at), (30, completed_at))
+        counter = apply(-1)
+        self.assertEqual((counter.value, counter.completed_at), (29, None))
+
+    def test_activity_edit_delete_and_retype(self):
+        self.log(self.user, self.walking, 10, '2026-02-27T10:00:00Z')
+        self.assertIsNone(self.progress())
+
+        activity = self.log(self.user, self.walking, 10)
+        self.assertEqual(self.progress(), (10, False))
+        activity.duration_minutes = 40
+        activity.save()
+        self.assertEqual(self.progress(), (40, True))
+        activity.activity_type = self.running
+        activity.duration_minutes = 5
+        activity.save()
+        self.assertEqual(self.progress(), (15, False))
+        # Moving an activity out of the window takes its contribution with it
+        activity.date_logged = '2026-04-02T10:00:00Z'
+        activity.save()
+        self.assertEqual(self.progress(), (0, False))
+        activity.date_logged = '2026-03-02T10:00:00Z'
+        activity.save()
+        self.assertEqual(self.progress(), (15, False))
+        activity.delete()
+        self.assertEqual(self.progress(), (0, False))
+
+    def test_team_counters(self):
+        self.team.members.add(self.user)
+        self.log(self.user, self.running, 20)
+        self.log(self.teammate, self.walking, 40)
+        self.assertEqual(self.team_progress(), (20, False))
+
+        # Joining brings the newcomer's activities in the window; leaving takes them out
+        self.team.members.add(self.teammate)
+        self.assertEqual(self.team_progress(), (60, True))
+        self.team.members.remove(self.teammate)
+        self.assertEqual(self.team_progress(), (20, False))
+
+    def test_editing_the_target_or_window_rebuilds_counters(self):
+        self.log(self.user, self.running, 10)
+        self.assertEqual(self.progress(), (30, True))
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.patch(
+            f'/api/challenges/{self.challenge.pk}/', {'target_metric': 'minutes', 'target_value': 20}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.progress(), (10, False))
+        client.patch(f'/api/challenges/{self.challenge.pk}/', {'target_value': 5}, format='json')
+        self.assertEqual(self.progress(), (10, True))
+        # Moving the window past the activity empties the counter
+        client.patch(f'/api/challenges/{self.challenge.pk}/', {'start_date': '2026-03-20T00:00:00Z'}, format='json')
+        self.assertIsNone(self.progress())
+
+    def test_rebuild_matches_incremental_counters(self):
+        self.team.members.add(self.user, self.teammate)
+        self.challenge.participants.add(self.teammate)
+        first = self.log(self.user, self.walking, 25)
+        self.log(self.user, self.running, 5, '2026-03-31T23:00:00Z')
+        self.log(self.teammate, self.walking, 10, '2026-03-01T00:00:00Z')
+        self.log(self.teammate, self.running, 10, '2026-04-01T00:00:00Z')
+        first.duration_minutes = 20
+        first.save()
+
+        def counters():
+            return (
+                sorted(ChallengeProgress.objects.values_list('challenge_id', 'user_id', 'value', 'completed_at')),
+                sorted(ChallengeTeamProgress.objects.values_list('challenge_id', 'team_id', 'value', 'completed_at')),
+            )
+
+        incremental = counters()
+        self.assertEqual(len(incremental[0]), 2)
+        ChallengeProgress.objects.update(value=0)
+        ChallengeTeamProgress.objects.all().delete()
+        for challenge in (self.challenge, self.team_challenge):
+            rebuild_progress(challenge)
+        self.assertEqual(counters(), incremental)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_user(username='poller')
+        self.activity_type = ActivityType.objects.create(name='Rowing', points_per_minute=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_conditional_get_is_answered_without_queries(self):
+        response = self.client.get('/api/leaderboard/teams/')
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/leaderboard/teams/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_is_not_trusted(self):
+        self.client.get('/api/leaderboard/teams/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Team.objects.create(name='Late', captain=self.user)
+        # Even a date after the change must not produce a 304; only the ETag validates
+        response = self.client.get('/api/leaderboard/teams/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Late', [team['name'] for team in response.json()])
+
+    def test_writes_invalidate_dependent_responses(self):
+        etag = self.client.get('/api/activities/stats/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(user=self.user, activity_type=self.activity_type, duration_minutes=10)
+
+        response = self.client.get('/api/activities/stats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_points'], 20)
+
+    def test_per_user_responses_are_not_shared(self):
+        other = User.objects.create_user(username='other')
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(user=other, activity_type=self.activity_type, duration_minutes=10)
+
+        self.assertEqual(self.client.get('/api/activities/stats/').json()['total_points'], 0)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/activities/stats/').json()['total_points'], 20)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        # One warning for the response cache and one for the token revocation cache
+        self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['fitness.W001'] * 2)
+        shared = {
+            alias: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': f'/tmp/{alias}'}
+            for alias in ('default', 'tokens')
+        }
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class AsyncReadPathTests(TestCase):
+    """The async endpoints must return the same bodies as the sync ones"""
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_user(username='async-runner')
+        self.activity_type = ActivityType.objects.create(name='Cycling', points_per_minute=3)
+        logged = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(25):
+                Activity.objects.create(
+                    user=self.user, activity_type=self.activity_type, duration_minutes=5 + i,
+                    date_logged=logged - timezone.timedelta(hours=i // 2),
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.async_client.force_login(self.user)
+
+    async def test_matches_sync_endpoints(self):
+        for sync_url, async_url in [
+            ('/api/leaderboard/users/', '/api/async/leaderboard/users/'),
+            ('/api/leaderboard/teams/', '/api/async/leaderboard/teams/'),
+            ('/api/activities/stats/?group_by=day', '/api/async/activities/stats/?group_by=day'),
+        ]:
+            expected = (await sync_to_async(self.client.get)(sync_url)).json()
+            response = await self.async_client.get(async_url)
+            self.assertEqual(response.status_code, 200, async_url)
+            self.assertEqual(response.json(), expected, async_url)
+
+    async def test_activity_list_walks_history(self):
+        seen = []
+        url = '/api/async/activities/?page_size=10'
+        while url:
+            page = (await self.async_client.get(url)).json()
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+
+        expected = [
+            pk async for pk in Activity.objects.order_by('-date_logged', '-id').values_list('id', flat=True)
+        ]
+        self.assertEqual(seen, expected)
+
+    async def test_malformed_cursor_is_rejected(self):
+        for cursor in ('!!!', base64.urlsafe_b64encode(b'yesterday|1').decode()):
+            response = await self.async_client.get('/api/async/activities/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    async def test_requires_authentication(self):
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.get('/api/async/leaderboard/users/')
+        self.assertEqual(response.status_code, 403)
+
+
+class ActivityExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter')
+        activity_type = ActivityType.objects.create(name='Swimming', points_per_minute=2)
+        self.logged = timezone.now()
+        for i in range(5):
+            Activity.objects.create(
+                user=self.user, activity_type=activity_type, duration_minutes=10 + i,
+                notes='lap, "pool"', date_logged=self.logged - timezone.timedelta(days=i),
+            )
+        Activity.objects.create(
+            user=User.objects.create_user(username='someone-else'), activity_type=activity_type, duration_minutes=1
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_csv(self):
+        response = self.client.get('/api/activities/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual([int(row['id']) for row in rows], list(
+            Activity.objects.filter(user=self.user).order_by('-date_logged').values_list('id', flat=True)
+        ))
+        self.assertEqual(rows[0]['activity_type'], 'Swimming')
+        self.assertEqual(rows[0]['notes'], 'lap, "pool"')
+
+    def test_ndjson_honors_date_filters(self):
+        start = (self.logged - timezone.timedelta(days=2, hours=1)).isoformat()
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson', 'start_date': start})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([row['duration_minutes'] for row in rows], [10, 11, 12])
+        self.assertEqual(rows[0]['points_awarded'], 20)
+
+
+class CompactViewTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        leaderboard.invalidate()
+        self.user = User.objects.create_user(username='compact')
+        activity_type = ActivityType.objects.create(name='Hiking', points_per_minute=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(user=self.user, activity_type=activity_type, duration_minutes=30)
+            team = Team.objects.create(name='Hikers', captain=self.user)
+            team.members.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_compact_rows_are_flat(self):
+        activity = self.client.get('/api/activities/', {'view': 'compact'}).json()['results'][0]
+        self.assertEqual(activity['activity_type_name'], 'Hiking')
+        self.assertNotIn('user', activity)
+
+        team = self.client.get('/api/teams/', {'view': 'compact'}).json()['results'][0]
+        self.assertEqual((team['member_count'], team['total_points']), (1, 60))
+
+        row = self.client.get('/api/leaderboard/users/', {'view': 'compact'}).json()[0]
+        self.assertEqual(row, {'rank': 1, 'user_id': self.user.pk, 'username': 'compact', 'total_points': 60})
+
+    def test_accept_profile_selects_compact_view(self):
+        rows = self.client.get('/api/leaderboard/teams/', HTTP_ACCEPT='application/json; profile=compact').json()
+        self.assertEqual(rows, [{'id': rows[0]['id'], 'name': 'Hikers', 'total_points': 60, 'member_count': 1, 'rank': 1}])
+        self.assertIn('total_team_points', self.client.get('/api/leaderboard/teams/').json()[0])
+
+
+@override_settings(JOB_CHUNK_SIZE=3)
+class RecalculatePointsJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='repriced')
+        self.team = Team.objects.create(name='Repricers', captain=self.user)
+        self.team.members.add(self.user)
+        self.activity_type = ActivityType.objects.create(name='Rowing', points_per_minute=2)
+        other_type = ActivityType.objects.create(name='Yoga', points_per_minute=1)
+        for minutes, intensity in [(10, 'low'), (15, 'medium'), (7, 'high'), (30, 'medium'), (11, 'high')]:
+            Activity.objects.create(
+                user=self.user, activity_type=self.activity_type, duration_minutes=minutes, intensity=intensity
+            )
+        Activity.objects.create(user=self.user, activity_type=other_type, duration_minutes=10)
+
+    def change_rate(self, points_per_minute):
+        activity_type = ActivityType.objects.get(pk=self.activity_type.pk)
+        activity_type.points_per_minute = points_per_minute
+        with self.captureOnCommitCallbacks(execute=True):
+            activity_type.save()
+
+    def test_rate_change_reprices_history(self):
+        self.change_rate(3.3)
+        self.change_rate(3.7)
+        self.assertEqual(Job.objects.filter(status='pending').count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.work('test-worker', once=True)
+
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.processed, job.total), ('done', 5, 5))
+        activities = Activity.objects.select_related('activity_type')
+        self.assertEqual([a.points_awarded for a in activities], [a.calculate_points() for a in activities])
+        expected_total = sum(a.points_awarded for a in activities)
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, expected_total)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).total_points, expected_total)
+        self.assertEqual(
+            DailyActivityRollup.objects.filter(activity_type=self.activity_type).get().points,
+            sum(a.points_awarded for a in activities if a.activity_type_id == self.activity_type.pk),
+        )
+
+    def test_failed_job_resumes_from_checkpoint(self):
+        self.change_rate(5)
+        with mock.patch.object(jobs, 'reconcile_user_points', side_effect=RuntimeError('boom')), \
+                self.assertLogs('fitness.jobs', 'ERROR'):
+            jobs.work('test-worker', once=True)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.state['stage']), ('failed', 'totals'))
+
+        job.status = 'pending'
+        job.save()
+        with mock.patch.object(jobs, 'recalculated_points', side_effect=AssertionError('re-ran activities')):
+            jobs.work('test-worker', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 2))
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, sum(
+            Activity.objects.values_list('points_awarded', flat=True)
+        ))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='ops', is_staff=True))
+
+    @override_settings(FITNESS_SLOW_QUERY_MS=0)
+    def test_records_requests_queries_and_slow_queries(self):
+        with self.assertLogs('fitness.slow_queries', 'WARNING') as logs:
+            self.client.get('/api/activities/stats/')
+        self.assertIn('SELECT', logs.output[0])
+        self.assertIn('File "', logs.output[0])
+
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('octofit_requests_total{view="activity-stats",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_db_queries_total{view="activity-stats",method="GET"} 1', body)
+        self.assertIn('octofit_slow_queries_total{view="activity-stats",method="GET"} 1', body)
+        self.assertIn('octofit_request_duration_seconds_count{view="activity-stats",method="GET"} 1', body)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='member'))
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+
+
+@override_settings(FITNESS_WRITE_COALESCING=True, FITNESS_WRITE_COALESCE_MS=100)
+class WriteCoalescingTests(TransactionTestCase):
+    def test_concurrent_inserts_share_a_transaction(self):
+        user = User.objects.create_user(username='burst')
+        activity_type = ActivityType.objects.create(name='Sprinting', points_per_minute=3)
+        saving_threads = set()
+        barrier = threading.Barrier(5)
+        errors = []
+
+        def record_thread(sender, **kwargs):
+            saving_threads.add(threading.get_ident())
+
+        def insert(minutes):
+            barrier.wait()
+            try:
+                save_coalesced(Activity(user=user, activity_type_id=activity_type.pk, duration_minutes=minutes))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        post_save.connect(record_thread, sender=Activity)
+        try:
+            threads = [threading.Thread(target=insert, args=(minutes,)) for minutes in range(1, 6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            post_save.disconnect(record_thread, sender=Activity)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(Activity.objects.values_list('duration_minutes', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(len(saving_threads), 1)
+        self.assertEqual(UserProfile.objects.get(user=user).total_points, 45)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_user(username='veteran')
+        activity_type = ActivityType.objects.create(name='Cycling', points_per_minute=2)
+        now = timezone.now()
+        for days in (1, 3, 400, 401, 500):
+            Activity.objects.create(
+                user=self.user, activity_type=activity_type, duration_minutes=days % 50 + 5,
+                date_logged=now - timezone.timedelta(days=days),
+            )
+        self.ids = list(Activity.objects.order_by('-date_logged', '-id').values_list('id', flat=True))
+        self.rollups = list(DailyActivityRollup.objects.order_by('date').values('date', 'count', 'points'))
+        self.total = UserProfile.objects.get(user=self.user).total_points
+        self.assertEqual(archive.archive_activities(archive.archive_cutoff()), 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_archived_activities_keep_their_points(self):
+        self.assertEqual((Activity.objects.count(), ArchivedActivity.objects.count()), (2, 3))
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, self.total)
+        self.assertEqual(reconcile_user_points(dry_run=True), [])
+        rollups.backfill()
+        self.assertEqual(list(DailyActivityRollup.objects.order_by('date').values('date', 'count', 'points')),
+                         self.rollups)
+
+    def test_reads_reach_the_archive_only_when_the_range_does(self):
+        response = self.client.get('/api/activities/', {'page_size': 3})
+        ids = [row['id'] for row in response.json()['results']]
+        ids += [row['id'] for row in self.client.get(response.json()['next']).json()['results']]
+        self.assertEqual(ids, self.ids)
+        # A start with a time of day reads raw activities instead of the rollups
+        start = (timezone.now() - timezone.timedelta(days=1000)).isoformat()
+        stats = self.client.get('/api/activities/stats/', {'start_date': start}).json()
+        self.assertEqual((stats['total_activities'], stats['total_points']), (5, self.total))
+
+        recent = (timezone.now() - timezone.timedelta(days=30)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/activities/', {'start_date': recent})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertFalse(any('fitness_activity_history' in query['sql'] for query in queries))
+
+    def test_archival_keeps_challenge_progress_and_batches(self):
+        now = timezone.now()
+        challenge = Challenge.objects.create(
+            title='Long haul', description='', target_value=1000, target_metric='minutes',
+            start_date=now - timezone.timedelta(days=60), end_date=now + timezone.timedelta(days=1),
+        )
+        challenge.participants.add(self.user)
+        response = self.client.post(
+            '/api/activities/bulk/',
+            [{'activity_type_id': ActivityType.objects.get().pk, 'duration_minutes': minutes,
+              'date_logged': (now - timezone.timedelta(days=days)).isoformat()} for minutes, days in ((7, 50), (9, 2))],
+            format='json', HTTP_IDEMPOTENCY_KEY='old-sync',
+        )
+        counter = ChallengeProgress.objects.get(challenge=challenge, user=self.user)
+
+        # The batch's older activity falls inside the challenge window
+        self.assertEqual(archive.archive_activities(archive.archive_cutoff(days=30)), 1)
+        archived = ArchivedActivity.objects.get(date_logged__gt=now - timezone.timedelta(days=60))
+        self.assertEqual(archived.batch.idempotency_key, 'old-sync')
+        rebuild_progress(challenge)
+        self.assertEqual(ChallengeProgress.objects.get(challenge=challenge, user=self.user).value, counter.value)
+        replay = self.client.post('/api/activities/bulk/', [], format='json', HTTP_IDEMPOTENCY_KEY='old-sync')
+        self.assertEqual(replay.json(), response.json())
+
+
+@override_settings(JOB_CHUNK_SIZE=2, SUGGESTIONS_PER_USER=2)
+class SuggestionGeneratorTests(TestCase):
+    def setUp(self):
+        self.runner = User.objects.create_user(username='runner')
+        self.newcomer = User.objects.create_user(username='newcomer')
+        UserProfile.objects.create(user=self.newcomer, fitness_level='advanced')
+        running = ActivityType.objects.create(name='Running', category='cardio')
+        ActivityType.objects.create(name='Yoga', category='flexibility')
+        ActivityType.objects.create(name='Weightlifting', category='strength')
+        for minutes in (40, 50, 60):
+            Activity.objects.create(user=self.runner, activity_type=running, duration_minutes=minutes)
+        self.kept = WorkoutSuggestion.objects.create(
+            user=self.runner, title='done', description='', recommended_duration=10,
+            difficulty_level='beginner', is_completed=True,
+        )
+        WorkoutSuggestion.objects.create(
+            user=self.runner, title='stale', description='', recommended_duration=10, difficulty_level='beginner',
+        )
+
+    def test_job_replaces_open_suggestions_for_every_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('generate_suggestions')
+        jobs.work('test-worker', once=True)
+
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.processed, job.total), ('done', 2, 2))
+        self.assertFalse(WorkoutSuggestion.objects.filter(title='stale').exists())
+        self.assertTrue(WorkoutSuggestion.objects.filter(pk=self.kept.pk).exists())
+
+        runner = WorkoutSuggestion.objects.filter(user=self.runner, is_completed=False)
+        # All of the runner's recent time is cardio, so balance points elsewhere; sessions average 50 minutes
+        self.assertEqual(
+            [(s.recommended_duration, [t.name for t in s.activity_types.all()]) for s in runner.order_by('pk')],
+            [(50, ['Yoga']), (50, ['Weightlifting'])],
+        )
+        newcomer = WorkoutSuggestion.objects.filter(user=self.newcomer)
+        self.assertEqual({s.difficulty_level for s in newcomer}, {'advanced'})
+        self.assertEqual(newcomer.first().recommended_duration, suggestions.LEVEL_DURATIONS['advanced'])
+
+    def test_chunk_runs_constant_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            suggestions.generate_chunk(0, 100)
+        # catalog, users, profiles, then delete links + suggestions and insert suggestions + links in a savepoint
+        self.assertEqual(len(queries), 9)
+
+
+class MembershipTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.captain = User.objects.create_user(username='captain')
+        self.team = Team.objects.create(name='Movers', captain=self.captain)
+        self.team.members.add(self.captain)
+        activity_type = ActivityType.objects.create(name='Walking', points_per_minute=1)
+        self.users = [User.objects.create_user(username=f'walker-{i}') for i in range(3)]
+        for i, user in enumerate(self.users):
+            Activity.objects.create(user=user, activity_type=activity_type, duration_minutes=10 * (i + 1))
+        self.client = APIClient()
+
+    def team_points(self):
+        return Team.objects.get(pk=self.team.pk).total_points
+
+    def test_join_and_leave_without_loading_members(self):
+        self.team.members.add(*[User.objects.create_user(username=f'extra-{i}') for i in range(20)])
+        self.client.force_authenticate(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/teams/{self.team.pk}/join/')
+        self.assertEqual(response.json(), {'status': 'joined', 'member_count': 22})
+        # No member rows are read, only the count and the joiner's points
+        self.assertFalse(any('"auth_user"."username"' in query['sql'] for query in queries))
+        self.assertEqual(self.team_points(), 10)
+
+        response = self.client.post(f'/api/teams/{self.team.pk}/join/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.team_points(), 10)
+
+        response = self.client.post(f'/api/teams/{self.team.pk}/leave/')
+        self.assertEqual(response.json(), {'status': 'left', 'member_count': 21})
+        self.assertEqual(self.team_points(), 0)
+
+    def test_bulk_members_are_captain_only(self):
+        self.client.force_authenticate(self.captain)
+        user_ids = [user.pk for user in self.users] + [999999]
+        response = self.client.post(f'/api/teams/{self.team.pk}/add_members/', {'user_ids': user_ids}, format='json')
+        self.assertEqual(response.json(), {'added': 3, 'member_count': 4})
+        self.assertEqual(self.team_points(), 60)
+
+        response = self.client.post(
+            f'/api/teams/{self.team.pk}/remove_members/',
+            {'user_ids': [self.captain.pk, self.users[2].pk]}, format='json',
+        )
+        self.assertEqual(response.json(), {'removed': 1, 'member_count': 3})
+        self.assertEqual(self.team_points(), 30)
+
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(f'/api/teams/{self.team.pk}/add_members/', {'user_ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_add_counts_only_its_own_users(self):
+        TeamMembership = Team.members.through
+        bulk_create = TeamMembership.objects.bulk_create
+        latecomer = User.objects.create_user(username='latecomer')
+
+        def racing_bulk_create(rows, **kwargs):
+            # Another request adds a different user just before this insert
+            TeamMembership.objects.create(team=self.team, user=latecomer)
+            return bulk_create(rows, **kwargs)
+
+        self.client.force_authenticate(self.captain)
+        with mock.patch.object(TeamMembership.objects, 'bulk_create', side_effect=racing_bulk_create):
+            response = self.client.post(
+                f'/api/teams/{self.team.pk}/add_members/', {'user_ids': [self.users[0].pk, self.users[1].pk]},
+                format='json',
+            )
+        self.assertEqual(response.json()['added'], 2)
+        self.assertEqual(self.team.members.count(), 4)
+        self.assertEqual(self.team_points(), 30)
+
+    def test_enroll_team_in_individual_challenge(self):
+        self.team.members.add(*self.users)
+        now = timezone.now()
+        challenge = Challenge.objects.create(
+            title='Walkathon', description='', target_value=25, target_metric='minutes',
+            start_date=now - timezone.timedelta(days=1), end_date=now + timezone.timedelta(days=1),
+        )
+        challenge.participants.add(self.users[0])
+        self.client.force_authenticate(self.captain)
+
+        response = self.client.post(f'/api/challenges/{challenge.pk}/enroll_team/', {'team': self.team.pk})
+        self.assertEqual(response.json(), {'status': 'enrolled', 'added': 3, 'participant_count': 4})
+        self.assertEqual(
+            dict(challenge.progress.values_list('user_id', 'value')),
+            {self.users[0].pk: 10, self.users[1].pk: 20, self.users[2].pk: 30},
+        )
+        response = self.client.post(f'/api/challenges/{challenge.pk}/enroll_team/', {'team': self.team.pk})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='root', password='pass')
+        self.client.force_login(self.admin)
+        activity_type = ActivityType.objects.create(name='Rowing')
+        for name in ('alice', 'albert', 'bob'):
+            user = User.objects.create_user(username=name)
+            team = Team.objects.create(name=f'{name}-team', captain=user)
+            team.members.add(user, self.admin)
+            Activity.objects.create(user=user, activity_type=activity_type, duration_minutes=5)
+
+    def test_team_changelist_counts_members_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/fitness/team/')
+        self.assertContains(response, 'alice-team')
+        Team.objects.create(name='extra', captain=self.admin).members.add(self.admin)
+        with CaptureQueriesContext(connection) as more:
+            self.client.get('/admin/fitness/team/')
+        self.assertEqual(len(more), len(queries))
+
+    def test_search_matches_related_prefix(self):
+        response = self.client.get('/admin/fitness/activity/', {'q': 'al'})
+        self.assertEqual(
+            sorted(activity.user.username for activity in response.context['cl'].result_list), ['albert', 'alice']
+        )
+
+    def test_count_stops_at_limit(self):
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 2):
+            self.assertEqual(self.client.get('/admin/fitness/activity/').context['cl'].result_count, 3)
+            response = self.client.get('/admin/fitness/activity/', {'intensity__exact': 'medium'})
+            self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_pages_past_the_limit_are_reachable(self):
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 2), \
+                mock.patch.object(ActivityAdmin, 'list_per_page', 1):
+            response = self.client.get('/admin/fitness/activity/', {'intensity__exact': 'medium', 'p': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        self.assertEqual(response.context['cl'].paginator.num_pages, 3)
+
+    def test_search_is_not_truncated(self):
+        activity_type = ActivityType.objects.get()
+        for i in range(5):
+            user = User.objects.create_user(username=f'alfie-{i}')
+            Activity.objects.create(user=user, activity_type=activity_type, duration_minutes=5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/fitness/activity/', {'q': 'al'})
+        self.assertEqual(len(response.context['cl'].result_list), 7)
+        # The related usernames are matched inside the changelist query, not fetched first
+        self.assertFalse(any(query['sql'].startswith('SELECT "auth_user"."id" FROM') for query in queries))
+
+
+class LiveLeaderboardTests(TestCase):
+    def setUp(self):
+        leaderboard.invalidate()
+        self.activity_type = ActivityType.objects.create(name='Skating', points_per_minute=1)
+        self.users = [User.objects.create_user(username=f'skater-{i}') for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, user in enumerate(self.users):
+                Activity.objects.create(user=user, activity_type=self.activity_type, duration_minutes=10 * (i + 1))
+        self.async_client.force_login(self.users[0])
+        self.broker = live.LeaderboardBroker()
+        patches = [
+            mock.patch.object(caching, 'bump_listeners', [self.broker.publish]),
+            mock.patch.object(async_views, 'broker', self.broker),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def log(self, user, minutes):
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(user=user, activity_type=self.activity_type, duration_minutes=minutes)
+
+    def event(self, chunk):
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().splitlines())
+        return fields['event'], json.loads(fields['data'])
+
+    async def test_stream_sends_snapshot_then_diffs(self):
+        response = await self.async_client.get('/api/live/leaderboard/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        first = self.broker.stream()
+        for stream in (content, first):
+            await anext(stream)  # retry
+        event, data = self.event(await anext(first))
+        self.assertEqual(event, 'snapshot')
+        self.assertEqual([row['username'] for row in data['users']], ['skater-2', 'skater-1', 'skater-0'])
+        await anext(content)
+
+        await sync_to_async(self.log)(self.users[0], 25)
+        with mock.patch.dict(live.LOADERS, {'users': mock.Mock(wraps=live.load_users)}):
+            await self.broker.tick()
+            self.assertEqual(live.LOADERS['users'].call_count, 1)
+        chunks = [await anext(first), await anext(content)]
+        # Encoded once, shared by every client
+        self.assertIs(chunks[0], chunks[1])
+        event, data = self.event(chunks[0])
+        self.assertEqual(event, 'users')
+        self.assertEqual(
+            [(row['username'], row['rank']) for row in data['changed']],
+            [('skater-0', 1), ('skater-2', 2), ('skater-1', 3)],
+        )
+        self.assertEqual(data['removed'], [])
+        await first.aclose()
+        self.assertEqual(len(self.broker._subscribers), 1)
+
+
+class TokenAuthTests(TestCase):
+    def setUp(self):
+        leaderboard.invalidate()
+        self.user = User.objects.create_user(username='runner', password='s3cret-pass')
+        self.client = APIClient()
+        self.pair = self.client.post(
+            '/api/auth/token/', {'username': 'runner', 'password': 's3cret-pass'}, format='json'
+        ).json()
+
+    def bearer(self, token):
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_access_token_authenticates_without_session_or_user_reads(self):
+        caching.get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/leaderboard/me/', **self.bearer(self.pair['access']))
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('django_session', sql)
+        self.assertNotIn('auth_user', sql)
+
+        response = self.client.get('/api/async/leaderboard/users/', **self.bearer(self.pair['access']))
+        self.assertEqual(response.status_code, 200)
+        user = tokens.token_user(tokens.verify(self.pair['access'], tokens.ACCESS))
+        self.assertEqual(user.get_deferred_fields(), {f.attname for f in User._meta.concrete_fields} - {'id', 'username'})
+        # Fields outside the token load on demand
+        self.assertTrue(user.is_active)
+
+    def test_rejects_bad_tokens(self):
+        tampered = self.pair['access'][:-1] + ('A' if self.pair['access'][-1] != 'A' else 'B')
+        with override_settings(AUTH_TOKEN_ACCESS_SECONDS=-1):
+            expired = tokens.issue(self.user, tokens.ACCESS)
+        for token in (tampered, expired, self.pair['refresh']):
+            self.assertEqual(self.client.get('/api/leaderboard/me/', **self.bearer(token)).status_code, 403)
+        response = self.client.post('/api/auth/token/', {'username': 'runner', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_refresh_rotates_and_revoke_logs_out(self):
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': self.pair['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        pair = response.json()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': self.pair['refresh']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            '/api/auth/token/revoke/', {'refresh': pair['refresh']}, format='json', **self.bearer(pair['access'])
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/leaderboard/me/', **self.bearer(pair['access'])).status_code, 403)
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': pair['refresh']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        other = tokens.issue(self.user, tokens.REFRESH)
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': other}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_revocations_are_shared_until_the_token_expires(self):
+        claims = tokens.verify(self.pair['access'], tokens.ACCESS)
+        cache = tokens.revocation_cache()
+        with mock.patch.object(cache, 'add', wraps=cache.add) as cache_add:
+            self.assertTrue(tokens.revoke(claims))
+        key, value, timeout = cache_add.call_args.args
+        self.assertEqual(key, tokens.REVOKED_KEY.format(claims['jti']))
+        self.assertAlmostEqual(timeout, claims['exp'] - time.time(), delta=2)
+        self.assertFalse(tokens.revoke(claims))
+
+        # Response cache churn cannot cull a revocation
+        for i in range(400):
+            caching.get_cache().set(f'churn-{i}', i)
+        self.assertEqual(self.client.get('/api/leaderboard/me/', **self.bearer(self.pair['access'])).status_code, 403)
+
+    def test_concurrent_refreshes_get_one_pair(self):
+        # Both requests verify the token before either has claimed it
+        with mock.patch.object(tokens, 'is_revoked', return_value=False):
+            first = self.client.post('/api/auth/token/refresh/', {'refresh': self.pair['refresh']}, format='json')
+            second = self.client.post('/api/auth/token/refresh/', {'refresh': self.pair['refresh']}, format='json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 400)
+
+
+class ActivityTypeCatalogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rower')
+        self.rowing = ActivityType.objects.create(name='Rowing', points_per_minute=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def type_queries(self, queries):
+        return [query['sql'] for query in queries.captured_queries if 'fitness_activitytype' in query['sql']]
+
+    def test_catalog_endpoints_read_the_registry(self):
+        self.client.get('/api/activity-types/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/activity-types/{self.rowing.pk}/')
+            self.assertEqual(response.json()['name'], 'Rowing')
+            self.assertEqual(self.client.get('/api/activity-types/', {'page': 1}).json()['count'], 1)
+            self.assertEqual(self.client.get('/api/activity-types/999/').status_code, 404)
+
+    def test_activity_writes_price_from_the_registry(self):
+        activity_catalog.all()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/activities/', {'activity_type_id': self.rowing.pk, 'duration_minutes': 10, 'intensity': 'high'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['points_awarded'], 26)
+        self.assertEqual(self.type_queries(queries), [])
+
+        response = self.client.post('/api/activities/', {'activity_type_id': 999, 'duration_minutes': 10}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Edits reach the registry at once in this process, and through the bumped version in others
+        with self.captureOnCommitCallbacks(execute=True):
+            ActivityType.objects.filter(pk=self.rowing.pk).update(points_per_minute=3)
+            caching.bump('activity_types')
+        self.assertEqual(activity_catalog.get(self.rowing.pk).points_per_minute, 3)
+        rowing = ActivityType.objects.get(pk=self.rowing.pk)
+        rowing.points_per_minute = 4
+        rowing.save()
+        self.assertEqual(activity_catalog.get(self.rowing.pk).points_per_minute, 4)
+
+
+@override_settings(READ_REPLICAS=['replica1'])
+class ReadReplicaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.activity_type = ActivityType.objects.create(name='Paddling', points_per_minute=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.snapshot = 0
+        patch = mock.patch.object(replicas, 'snapshot_ns', lambda alias: self.snapshot)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def sync(self):
+        self.snapshot = time.time_ns()
+
+    def read_targets(self, url):
+        """Replica chosen for each read the request made (None: primary)"""
+        targets = set()
+        db_for_read = replicas.ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            targets.add(replicas._replica.get())
+            return db_for_read(router, model, **hints)
+
+        with mock.patch.object(replicas.ReplicaRouter, 'db_for_read', spy):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return targets
+
+    def test_reads_follow_replica_freshness_and_own_writes(self):
+        # Never synced, then synced before the user's first request
+        self.assertEqual(self.read_targets('/api/activities/'), {None})
+        self.sync()
+        self.assertEqual(self.read_targets('/api/activities/'), {'replica1'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/activities/', {'activity_type_id': self.activity_type.pk, 'duration_minutes': 10}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.read_targets('/api/challenges/'), {None})
+        self.sync()
+        self.assertEqual(self.read_targets('/api/challenges/'), {'replica1'})
+
+        # A cached response is computed on the primary while its scope is newer than the replica
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump('teams')
+        self.assertEqual(self.read_targets('/api/leaderboard/teams/'), {None})
+
+        with override_settings(REPLICA_MAX_LAG_SECONDS=0):
+            self.assertEqual(self.read_targets('/api/challenges/'), {None})
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.sync()
+        with replicas.request_scope():
+            replicas.read_from_replica()
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Activity), 'replica1')
+                with replicas.primary_reads():
+                    self.assertIsNone(router.db_for_read(Activity))
+            # Reads inside a transaction stay with its writes
+            self.assertIsNone(router.db_for_read(Activity))
+            self.assertEqual(router.db_for_write(Activity), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'fitness'))
+
+    def test_replicas_require_a_shared_cache(self):
+        self.assertEqual([error.id for error in checks.check_replica_cache(None)], ['fitness.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_replica_cache(None), [])
+        with override_settings(READ_REPLICAS=[]):
+            self.assertEqual(checks.check_replica_cache(None), [])
@@ -0,0 +1,110 @@
+"""
+Stateless signed-token authentication.
+
+Tokens are ``django.core.signing`` payloads carrying the user id, username,
+token type, a random token id and an expiry, HMAC-signed with SECRET_KEY.
+Checking one is a signature check and two comparisons, so an API call sent
+with ``Authorization: Bearer <access token>`` reads neither
+``django_session`` nor ``auth_user``. ``request.user`` is then a ``User``
+with only ``id`` and ``username`` loaded; any other field is fetched from the
+database the first time something reads it.
+
+Access tokens are short-lived (AUTH_TOKEN_ACCESS_SECONDS). Clients trade a
+refresh token (AUTH_TOKEN_REFRESH_SECONDS) for a new pair, which is where
+deactivated users are turned away. Revoked token ids are kept in their own
+cache (FITNESS_TOKEN_CACHE_ALIAS), shared by every worker and sized so that
+culling never drops one, until the token would have expired anyway; checking
+a token also costs one cache lookup. Revoking adds the id only if it is not
+there yet, so of two concurrent refreshes of one token only one succeeds.
+"""
+import math
+import secrets
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import caches
+from rest_framework import authentication, exceptions
+
+SALT = 'fitness.tokens'
+ACCESS = 'access'
+REFRESH = 'refresh'
+REVOKED_KEY = 'fitness:token:revoked:{}'
+
+
+def revocation_cache():
+    return caches[getattr(settings, 'FITNESS_TOKEN_CACHE_ALIAS', 'tokens')]
+
+
+def issue(user, kind):
+    lifetime = settings.AUTH_TOKEN_ACCESS_SECONDS if kind == ACCESS else settings.AUTH_TOKEN_REFRESH_SECONDS
+    return signing.dumps({
+        'uid': user.pk,
+        'usr': user.get_username(),
+        'typ': kind,
+        'jti': secrets.token_urlsafe(12),
+        'exp': int(time.time()) + lifetime,
+    }, salt=SALT)
+
+
+def issue_pair(user):
+    return {
+        'access': issue(user, ACCESS),
+        'refresh': issue(user, REFRESH),
+        'expires_in': settings.AUTH_TOKEN_ACCESS_SECONDS,
+    }
+
+
+def verify(token, kind):
+    """The claims of a validly signed, unexpired, unrevoked token of ``kind``; None otherwise"""
+    try:
+        claims = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        return None
+    if claims.get('typ') != kind or claims.get('exp', 0) <= time.time() or is_revoked(claims.get('jti')):
+        return None
+    return claims
+
+
+def is_revoked(token_id):
+    return revocation_cache().get(REVOKED_KEY.format(token_id)) is not None
+
+
+def revoke(claims):
+    """
+    Reject the token from now on, in every worker, until it expires.
+
+    Returns False when it was already revoked, so a caller using the token
+    up (a refresh) can tell that another request claimed it first.
+    """
+    remaining = claims['exp'] - time.time()
+    if remaining <= 0:
+        return False
+    return revocation_cache().add(REVOKED_KEY.format(claims['jti']), True, math.ceil(remaining))
+
+
+def token_user(claims):
+    """A User holding the token's id and username, with every other field deferred"""
+    return User.from_db(None, ['id', 'username'], [claims['uid'], claims['usr']])
+
+
+def bearer_token(request):
+    """The token from an ``Authorization: Bearer`` header, or None"""
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """Authenticate from a bearer access token without touching the database"""
+
+    def authenticate(self, request):
+        token = bearer_token(request)
+        if token is None:
+            return None
+        claims = verify(token, ACCESS)
+        if claims is None:
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        return token_user(claims), claims
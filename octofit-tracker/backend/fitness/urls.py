@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'profiles', views.UserProfileViewSet, basename='userprofile')
@@ -13,4 +13,14 @@ router.register(r'leaderboard', views.LeaderboardViewSet, basename='leaderboard'
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('_metrics', views.metrics, name='metrics'),
+    path('auth/token/', views.obtain_token, name='token-obtain'),
+    path('auth/token/refresh/', views.refresh_token, name='token-refresh'),
+    path('auth/token/revoke/', views.revoke_token, name='token-revoke'),
+    # Async read path, for high-traffic polling under ASGI (octofit_tracker.asgi)
+    path('async/leaderboard/users/', async_views.leaderboard_users, name='async-leaderboard-users'),
+    path('async/leaderboard/teams/', async_views.leaderboard_teams, name='async-leaderboard-teams'),
+    path('async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('async/activities/stats/', async_views.activity_stats, name='async-activity-stats'),
+    path('live/leaderboard/', async_views.leaderboard_stream, name='live-leaderboard'),
 ]
\ No newline at end of file
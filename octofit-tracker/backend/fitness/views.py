@@ -1,87 +1,370 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action
+from rest_framework.decorators import (
+    action, api_view, authentication_classes, permission_classes, renderer_classes
+)
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.db.models import Q
-from .models import UserProfile, Team, ActivityType, Activity, Challenge, WorkoutSuggestion
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, Exists, OuterRef, Q, Count, Sum, Prefetch
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_header_parameters
+from .models import (
+    UserProfile, Team, ActivityType, Activity, ActivityBatch, DailyActivityRollup, Challenge, WorkoutSuggestion
+)
+from .archive import history_model
+from .caching import cache_response, get_versions
+from .catalog import activity_catalog
+from .leaderboard import leaderboard
+from . import caching, membership, replicas, tokens
+from .metrics import registry
+from .pagination import ActivityCursorPagination
+from .queries import related_count
+from .renderers import CSVRenderer, NDJSONRenderer, PrometheusRenderer
 from .serializers import (
     UserProfileSerializer, TeamSerializer, ActivityTypeSerializer, 
     ActivitySerializer, ChallengeSerializer, WorkoutSuggestionSerializer,
-    LeaderboardUserSerializer, LeaderboardTeamSerializer
+    LeaderboardUserSerializer, LeaderboardTeamSerializer,
+    ChallengeProgressSerializer, ChallengeTeamProgressSerializer,
+    CompactActivitySerializer, CompactTeamSerializer,
+    CompactLeaderboardUserSerializer, CompactLeaderboardTeamSerializer,
+    TeamMembersSerializer, EnrollTeamSerializer, TokenObtainSerializer, TokenRefreshSerializer
 )
 
 # Create your views here.
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+BULK_ACTIVITY_LIMIT = 1000
+
+EXPORT_CHUNK_SIZE = 2000
+
+# values_list() fields and the column names they are exported under
+EXPORT_FIELDS = (
+    'id', 'date_logged', 'activity_type__name', 'duration_minutes', 'intensity',
+    'distance', 'calories_burned', 'points_awarded', 'notes',
+)
+EXPORT_COLUMNS = (
+    'id', 'date_logged', 'activity_type', 'duration_minutes', 'intensity',
+    'distance', 'calories_burned', 'points_awarded', 'notes',
+)
+
+STATS_BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+def export_csv(rows):
+    """CSV lines for EXPORT_FIELDS rows, yielded a chunk at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(rows):
+    """One JSON object per line for EXPORT_FIELDS rows, yielded a chunk at a time"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), cls=DjangoJSONEncoder) + '\n')
+        if len(lines) == EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+def activity_queryset(user, start_date=None, end_date=None, history=False):
+    """
+    A user's activities, filtered by date range if provided.
+
+    With ``history``, read-only callers also get archived activities when the
+    range reaches into the archive.
+    """
+    model = history_model(start_date) if history else Activity
+    queryset = model.objects.filter(user=user).select_related('user', 'activity_type')
+    if start_date:
+        queryset = queryset.filter(date_logged__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date_logged__lte=end_date)
+    return queryset
+
+def stats_params_error(start_date=None, end_date=None, group_by=None):
+    """Error message for invalid activity stats parameters, or None"""
+    if group_by and group_by not in STATS_BUCKETS:
+        return f"group_by must be one of: {', '.join(STATS_BUCKETS)}"
+    for name, value in (('start_date', start_date), ('end_date', end_date)):
+        try:
+            # parse_datetime also accepts a bare date; both raise ValueError for impossible dates
+            valid = not value or parse_datetime(value) is not None
+        except ValueError:
+            valid = False
+        if not valid:
+            return f'{name} must be an ISO date or datetime'
+    return None
+
+def stats_querysets(user, start_date=None, end_date=None, group_by=None):
+    """
+    (breakdown, time series) querysets for a user's activity stats.
+
+    Whole-day date ranges are answered from the daily rollups; ranges with
+    a time of day need the raw activities. The time series is None without
+    group_by.
+    """
+    if all(value is None or parse_date(value) for value in (start_date, end_date)):
+        source = DailyActivityRollup.objects.filter(user=user)
+        if start_date:
+            source = source.filter(date__gte=start_date)
+        if end_date:
+            # date_logged__lte=<date> stops at midnight at the start of that day
+            source = source.filter(date__lt=end_date)
+        date_field = 'date'
+        aggregates = {
+            'count': Sum('count'),
+            'total_minutes': Sum('minutes'),
+            'total_points': Sum('points'),
+        }
+    else:
+        source = activity_queryset(user, start_date, end_date, history=True).order_by()
+        date_field = 'date_logged'
+        aggregates = {
+            'count': Count('id'),
+            'total_minutes': Sum('duration_minutes'),
+            'total_points': Sum('points_awarded'),
+        }
+
+    breakdown = source.values('activity_type__name').annotate(**aggregates)
+    time_series = None
+    if group_by:
+        time_series = source.annotate(
+            period=STATS_BUCKETS[group_by](date_field, output_field=DateField())
+        ).values('period').annotate(**aggregates).order_by('period')
+    return breakdown, time_series
+
+def stats_payload(breakdown_rows, time_series_rows=None):
+    """Stats response body from the rows of stats_querysets"""
+    # The overall totals are the sum of the per-type groups
+    activity_breakdown = {row.pop('activity_type__name'): row for row in breakdown_rows}
+    data = {
+        'total_activities': sum(row['count'] for row in activity_breakdown.values()),
+        'total_minutes': sum(row['total_minutes'] for row in activity_breakdown.values()),
+        'total_points': sum(row['total_points'] for row in activity_breakdown.values()),
+        'activity_breakdown': activity_breakdown
+    }
+    if time_series_rows is not None:
+        data['time_series'] = time_series_rows
+    return data
+
+def wants_compact(request):
+    """True for ?view=compact or an Accept profile such as application/json; profile=compact"""
+    if request.query_params.get('view') == 'compact':
+        return True
+    return parse_header_parameters(request.accepted_media_type or '')[1].get('profile') == 'compact'
+
+class CompactListMixin:
+    """Serve list() through compact_serializer_class when the client asks for the compact view"""
+    compact_serializer_class = None
+
+    def is_compact(self):
+        return self.action == 'list' and wants_compact(self.request)
+
+    def get_serializer_class(self):
+        if self.is_compact():
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.is_compact():
+            return self.compact_serializer_class.shape(queryset)
+        return queryset
+
+class ReplicaReadMixin:
+    """Serve safe requests from a read replica that already has the user's own writes"""
+
+    def dispatch(self, request, *args, **kwargs):
+        with replicas.request_scope():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if settings.READ_REPLICAS and request.method in permissions.SAFE_METHODS:
+            scope = replicas.writes_scope(request.user.pk)
+            replicas.read_from_replica(since_ns=get_versions([scope])[scope])
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            settings.READ_REPLICAS and request.method not in permissions.SAFE_METHODS
+            and response.status_code < 400 and request.user.is_authenticated
+        ):
+            caching.bump(replicas.writes_scope(request.user.pk))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+def team_leaderboard_queryset():
+    """Top 20 active teams; total_points is maintained by the points ledger, so this is one indexed query"""
+    return Team.objects.filter(is_active=True).annotate(
+        member_count=related_count(Team.members.through, 'team_id')
+    ).order_by('-total_points', 'pk')[:20]
+
+def team_queryset():
+    """Teams with everything TeamSerializer needs loaded up front"""
+    return Team.objects.select_related('captain').prefetch_related('members').annotate(
+        member_count=related_count(Team.members.through, 'team_id')
+    )
+
+class UserProfileViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return UserProfile.objects.filter(user=self.request.user)
+        return UserProfile.objects.filter(user=self.request.user).select_related('user')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class ActivityTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class ActivityTypeViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = ActivityType.objects.all()
     serializer_class = ActivityTypeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class ActivityViewSet(viewsets.ModelViewSet):
+    # Both actions read the in-process registry, so they run no queries once it is loaded
+    @cache_response('activity_types')
+    def list(self, request, *args, **kwargs):
+        activity_types = activity_catalog.all()
+        page = self.paginate_queryset(activity_types)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(activity_types, many=True).data)
+
+    @cache_response('activity_types')
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            activity_type = activity_catalog.get(int(kwargs['pk']))
+        except ValueError:
+            activity_type = None
+        if activity_type is None:
+            raise NotFound()
+        return Response(self.get_serializer(activity_type).data)
+
+class ActivityViewSet(ReplicaReadMixin, CompactListMixin, viewsets.ModelViewSet):
     serializer_class = ActivitySerializer
+    compact_serializer_class = CompactActivitySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ActivityCursorPagination
 
     def get_queryset(self):
-        queryset = Activity.objects.filter(user=self.request.user)
-        
-        # Filter by date range if provided
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        
-        if start_date:
-            queryset = queryset.filter(date_logged__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(date_logged__lte=end_date)
-            
-        return queryset
+        return activity_queryset(
+            self.request.user,
+            self.request.query_params.get('start_date'),
+            self.request.query_params.get('end_date'),
+            # Archived activities are read-only
+            history=self.action in ('list', 'export'),
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create many activities at once, e.g. from a wearable sync"""
+        idempotency_key = request.headers.get('Idempotency-Key')
+        key_length = ActivityBatch._meta.get_field('idempotency_key').max_length
+        if idempotency_key and len(idempotency_key) > key_length:
+            return Response(
+                {'error': f'Idempotency-Key must be at most {key_length} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if idempotency_key:
+            batch = ActivityBatch.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+            if batch:
+                # A retry of a batch that was already stored
+                # In creation order, as the first response listed them
+                # Archived activities keep their batch, so an old batch replays in full
+                activities = history_model(None).objects.filter(batch=batch).select_related(
+                    'user', 'activity_type'
+                ).order_by('pk')
+                serializer = self.get_serializer(activities, many=True)
+                return Response({'created': len(serializer.data), 'activities': serializer.data})
+
+        serializer = self.get_serializer(data=request.data, many=True, max_length=BULK_ACTIVITY_LIMIT)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            with transaction.atomic():
+                batch = None
+                if idempotency_key:
+                    batch = ActivityBatch.objects.create(user=request.user, idempotency_key=idempotency_key)
+                serializer.context['batch'] = batch
+                serializer.save()
+        except IntegrityError:
+            # A concurrent request with the same key won the race
+            return Response({'status': 'duplicate_batch'}, status=status.HTTP_409_CONFLICT)
+
+        return Response(
+            {'created': len(serializer.data), 'activities': serializer.data},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Stream the user's full activity history as CSV (default) or NDJSON.
+
+        Rows come straight from a chunked values_list() cursor, so memory
+        stays flat however long the history is.
+        """
+        rows = self.get_queryset().order_by('-date_logged', '-id').values_list(*EXPORT_FIELDS).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+        if request.accepted_renderer.format == 'ndjson':
+            content = export_ndjson(rows)
+        else:
+            content = export_csv(rows)
+
+        response = StreamingHttpResponse(
+            content, content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{request.accepted_renderer.format}"'
+        return response
 
     @action(detail=False, methods=['get'])
+    @cache_response('activities:{user}', 'activity_types', per_user=True)
     def stats(self, request):
-        """Get user's activity statistics"""
-        user_activities = Activity.objects.filter(user=request.user)
-        
-        total_activities = user_activities.count()
-        total_minutes = sum(activity.duration_minutes for activity in user_activities)
-        total_points = sum(activity.points_awarded for activity in user_activities)
-        
-        # Group by activity type
-        activity_breakdown = {}
-        for activity in user_activities:
-            activity_type = activity.activity_type.name
-            if activity_type not in activity_breakdown:
-                activity_breakdown[activity_type] = {
-                    'count': 0,
-                    'total_minutes': 0,
-                    'total_points': 0
-                }
-            activity_breakdown[activity_type]['count'] += 1
-            activity_breakdown[activity_type]['total_minutes'] += activity.duration_minutes
-            activity_breakdown[activity_type]['total_points'] += activity.points_awarded
+        """Get user's activity statistics, optionally with a day/week/month time series"""
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        group_by = request.query_params.get('group_by')
+        error = stats_params_error(start_date, end_date, group_by)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({
-            'total_activities': total_activities,
-            'total_minutes': total_minutes,
-            'total_points': total_points,
-            'activity_breakdown': activity_breakdown
-        })
+        breakdown, time_series = stats_querysets(request.user, start_date, end_date, group_by)
+        return Response(stats_payload(list(breakdown), list(time_series) if group_by else None))
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ReplicaReadMixin, CompactListMixin, viewsets.ModelViewSet):
     serializer_class = TeamSerializer
+    compact_serializer_class = CompactTeamSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Team.objects.filter(
+        if self.action in ('join', 'leave', 'add_members', 'remove_members'):
+            # Membership actions only report the member count, so the member list is never loaded
+            queryset = Team.objects.annotate(member_count=related_count(Team.members.through, 'team_id'))
+            if self.action == 'join':
+                # Any active team can be joined
+                return queryset.filter(is_active=True)
+        else:
+            queryset = team_queryset()
+        return queryset.filter(
             Q(members=self.request.user) | Q(captain=self.request.user)
         ).distinct()
 
@@ -89,45 +372,134 @@ class TeamViewSet(viewsets.ModelViewSet):
     def join(self, request, pk=None):
         """Join a team"""
         team = self.get_object()
-        if request.user not in team.members.all():
-            team.members.add(request.user)
-            return Response({'status': 'joined'})
+        if membership.add_member(team.pk, request.user.pk):
+            return Response({'status': 'joined', 'member_count': team.member_count + 1})
         return Response({'status': 'already_member'}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
     def leave(self, request, pk=None):
         """Leave a team"""
         team = self.get_object()
-        if request.user in team.members.all() and request.user != team.captain:
-            team.members.remove(request.user)
-            return Response({'status': 'left'})
+        if team.captain_id != request.user.pk and membership.remove_member(team.pk, request.user.pk):
+            return Response({'status': 'left', 'member_count': team.member_count - 1})
         return Response({'status': 'cannot_leave'}, status=status.HTTP_400_BAD_REQUEST)
 
-class ChallengeViewSet(viewsets.ModelViewSet):
+    def _captain_request(self, request):
+        """The team and user_ids of a bulk membership request made by the team's captain"""
+        team = self.get_object()
+        if team.captain_id != request.user.pk:
+            raise PermissionDenied('Only the team captain can change members')
+        serializer = TeamMembersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return team, serializer.validated_data['user_ids']
+
+    @action(detail=True, methods=['post'])
+    def add_members(self, request, pk=None):
+        """Add many users to a team (captain only); unknown ids and existing members are skipped"""
+        team, user_ids = self._captain_request(request)
+        added = membership.add_members(team.pk, user_ids)
+        return Response({'added': added, 'member_count': team.member_count + added})
+
+    @action(detail=True, methods=['post'])
+    def remove_members(self, request, pk=None):
+        """Remove many users from a team (captain only); the captain always stays"""
+        team, user_ids = self._captain_request(request)
+        removed = membership.remove_members(team.pk, [user_id for user_id in user_ids if user_id != team.captain_id])
+        return Response({'removed': removed, 'member_count': team.member_count - removed})
+
+class ChallengeViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = ChallengeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Challenge.objects.filter(
-            Q(participants=self.request.user) | Q(team_participants__members=self.request.user)
-        ).distinct()
+        if self.action in ('join', 'enroll_team'):
+            # Any active challenge can be joined; only the participant count is reported
+            return Challenge.objects.filter(is_active=True).annotate(
+                participant_count=(
+                    related_count(Challenge.participants.through, 'challenge_id')
+                    + related_count(Challenge.team_participants.through, 'challenge_id')
+                )
+            )
+
+        # EXISTS rather than joins, so no DISTINCT is needed and each challenge is one row for the counts
+        ChallengeParticipation = Challenge.participants.through
+        ChallengeTeamParticipation = Challenge.team_participants.through
+        queryset = Challenge.objects.filter(
+            Exists(ChallengeParticipation.objects.filter(challenge_id=OuterRef('pk'), user=self.request.user))
+            | Exists(ChallengeTeamParticipation.objects.filter(
+                challenge_id=OuterRef('pk'), team__members=self.request.user
+            ))
+        )
+        if self.action == 'progress':
+            # This action never serializes the nested challenge
+            return queryset
+
+        return queryset.prefetch_related(
+            'participants',
+            Prefetch('team_participants', queryset=team_queryset()),
+        ).annotate(
+            participant_count=(
+                related_count(Challenge.participants.through, 'challenge_id')
+                + related_count(Challenge.team_participants.through, 'challenge_id')
+            )
+        )
 
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         """Join a challenge"""
         challenge = self.get_object()
-        if challenge.challenge_type == 'individual':
-            if request.user not in challenge.participants.all():
-                challenge.participants.add(request.user)
-                return Response({'status': 'joined'})
+        if challenge.challenge_type == 'individual' and membership.join_challenge(challenge, request.user.pk):
+            return Response({'status': 'joined', 'participant_count': challenge.participant_count + 1})
         return Response({'status': 'already_participating'}, status=status.HTTP_400_BAD_REQUEST)
 
-class WorkoutSuggestionViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'])
+    def enroll_team(self, request, pk=None):
+        """
+        Enroll a team the user captains: the team itself in a team challenge,
+        every member as a participant in an individual one.
+        """
+        challenge = self.get_object()
+        serializer = EnrollTeamSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        team = serializer.validated_data['team']
+        if team.captain_id != request.user.pk:
+            raise PermissionDenied('Only the team captain can enroll a team')
+
+        added = membership.enroll_team(challenge, team.pk)
+        if not added:
+            return Response({'status': 'already_participating'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'enrolled', 'added': added, 'participant_count': challenge.participant_count + added})
+
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """Rank participants and teams by their progress towards the challenge target"""
+        challenge = self.get_object()
+        limit = 50
+
+        participants = challenge.progress.select_related('user').order_by('-value', 'pk')[:limit]
+        for idx, row in enumerate(participants):
+            row.rank = idx + 1
+
+        teams = challenge.team_progress.select_related('team').order_by('-value', 'pk')[:limit]
+        for idx, row in enumerate(teams):
+            row.rank = idx + 1
+
+        return Response({
+            'challenge': challenge.pk,
+            'target_metric': challenge.target_metric,
+            'target_value': challenge.target_value,
+            'participants': ChallengeProgressSerializer(participants, many=True).data,
+            'teams': ChallengeTeamProgressSerializer(teams, many=True).data,
+        })
+
+class WorkoutSuggestionViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = WorkoutSuggestionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return WorkoutSuggestion.objects.filter(user=self.request.user)
+        return WorkoutSuggestion.objects.filter(user=self.request.user).select_related(
+            'user'
+        ).prefetch_related('activity_types')
 
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
@@ -137,25 +509,71 @@ class WorkoutSuggestionViewSet(viewsets.ModelViewSet):
         suggestion.save()
         return Response({'status': 'completed'})
 
-class LeaderboardViewSet(viewsets.ViewSet):
+class LeaderboardViewSet(ReplicaReadMixin, viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
+    def _ranked_profiles(self, rows):
+        """Serialize leaderboard (rank, user_id, points) rows in rank order"""
+        profiles = UserProfile.objects.select_related('user').in_bulk(
+            [user_id for rank, user_id, points in rows], field_name='user_id'
+        )
+        ranked = []
+        for rank, user_id, points in rows:
+            profile = profiles.get(user_id)
+            if profile is not None:
+                profile.rank = rank
+                ranked.append(profile)
+        return LeaderboardUserSerializer(ranked, many=True).data
+
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
     def users(self, request):
         """Get user leaderboard"""
-        profiles = UserProfile.objects.select_related('user').order_by('-total_points')[:50]
-        
-        # Add rank to each profile
-        for idx, profile in enumerate(profiles):
-            profile.rank = idx + 1
-            
-        serializer = LeaderboardUserSerializer(profiles, many=True)
-        return Response(serializer.data)
+        rows = leaderboard.page(1, 50)
+        if wants_compact(request):
+            usernames = dict(User.objects.filter(
+                id__in=[user_id for rank, user_id, points in rows]
+            ).values_list('id', 'username'))
+            ranked = [
+                {'rank': rank, 'user_id': user_id, 'username': usernames[user_id], 'total_points': points}
+                for rank, user_id, points in rows if user_id in usernames
+            ]
+            return Response(CompactLeaderboardUserSerializer(ranked, many=True).data)
+        return Response(self._ranked_profiles(rows))
 
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard', per_user=True)
+    def me(self, request):
+        """Get the current user's rank"""
+        return Response({
+            'rank': leaderboard.rank(request.user.pk),
+            'total_points': leaderboard.points(request.user.pk),
+            'total_users': len(leaderboard),
+        })
+
+    @action(detail=False, methods=['get'])
+    @cache_response('leaderboard', per_user=True)
+    def around(self, request):
+        """Get the ranks around a user (default: the current user)"""
+        try:
+            user_id = int(request.query_params.get('user_id', request.user.pk))
+            radius = min(int(request.query_params.get('radius', 5)), 50)
+        except ValueError:
+            return Response({'error': 'user_id and radius must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self._ranked_profiles(leaderboard.around(user_id, max(radius, 0))))
+
+    @action(detail=False, methods=['get'])
+    @cache_response('teams')
     def teams(self, request):
         """Get team leaderboard"""
-        teams = Team.objects.filter(is_active=True).order_by('-total_team_points')[:20]
+        if wants_compact(request):
+            teams = list(CompactLeaderboardTeamSerializer.shape(team_leaderboard_queryset()))
+            for idx, team in enumerate(teams):
+                team['rank'] = idx + 1
+            return Response(CompactLeaderboardTeamSerializer(teams, many=True).data)
+
+        teams = team_leaderboard_queryset()
         
         # Add rank to each team
         for idx, team in enumerate(teams):
@@ -163,3 +581,51 @@ class LeaderboardViewSet(viewsets.ViewSet):
             
         serializer = LeaderboardTeamSerializer(teams, many=True)
         return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    """Per-view request, query and slow-query totals for Prometheus (staff only)"""
+    return Response(registry.render())
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def obtain_token(request):
+    """Exchange a username and password for an access and a refresh token"""
+    serializer = TokenObtainSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    return Response(tokens.issue_pair(serializer.validated_data['user']))
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def refresh_token(request):
+    """Exchange a refresh token for a new pair; the old refresh token stops working"""
+    serializer = TokenRefreshSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    claims = serializer.validated_data['refresh']
+    # Claiming the token is one atomic cache add, so concurrent refreshes cannot both get a pair
+    if not tokens.revoke(claims):
+        return Response({'refresh': ['Invalid or expired refresh token.']}, status=status.HTTP_400_BAD_REQUEST)
+    # The one DB read of the token flow, so deactivated users are locked out within an access lifetime
+    user = User.objects.filter(pk=claims['uid'], is_active=True).first()
+    if user is None:
+        return Response({'error': 'User is inactive or no longer exists'}, status=status.HTTP_401_UNAUTHORIZED)
+    return Response(tokens.issue_pair(user))
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def revoke_token(request):
+    """Revoke a refresh token, and the bearer access token sent with it"""
+    serializer = TokenRefreshSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    claims = serializer.validated_data['refresh']
+    tokens.revoke(claims)
+    access = tokens.bearer_token(request)
+    access_claims = access and tokens.verify(access, tokens.ACCESS)
+    if access_claims and access_claims['uid'] == claims['uid']:
+        tokens.revoke(access_claims)
+    return Response(status=status.HTTP_204_NO_CONTENT)
@@ -3,6 +3,10 @@ ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the async views and the live leaderboard stream with it, e.g.
+``uvicorn octofit_tracker.asgi:application --workers 4``: each worker
+holds its clients' event streams on one event loop.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
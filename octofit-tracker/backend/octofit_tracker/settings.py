@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the whole middleware stack
+    'fitness.metrics.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +87,102 @@ DATABASES = {
     }
 }
 
+# OCTOFIT_DB_PROFILE=production tunes SQLite for concurrent writers: the
+# SQLITE_PRAGMAS are applied to every new connection (fitness.db), connections
+# are kept open between requests, and concurrent activity inserts are
+# committed together in shared transactions.
+DATABASE_PROFILE = os.environ.get('OCTOFIT_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION_PRAGMAS = {
+    # Readers no longer block the writer, and commits append to the WAL
+    'journal_mode': 'WAL',
+    # Durable at checkpoints rather than at every commit; safe with WAL
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Milliseconds to wait for the write lock before "database is locked"
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
+}
+
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    })
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS
+    FITNESS_WRITE_COALESCING = True
+else:
+    SQLITE_PRAGMAS = {}
+    FITNESS_WRITE_COALESCING = False
+
+# How long a coalesced insert waits for others to join its transaction, and
+# the most inserts one transaction takes
+FITNESS_WRITE_COALESCE_MS = 5
+FITNESS_WRITE_COALESCE_MAX = 100
+
+# Read replicas (fitness.replicas): OCTOFIT_DB_REPLICAS lists SQLite files,
+# comma-separated, that `manage.py sync_replicas` keeps refreshed from the
+# primary. Safe requests to the fitness API read from the freshest one that
+# already has the user's own writes; everything else uses the primary.
+# Replicas need a cache shared by every worker (see Caches below).
+READ_REPLICAS = []
+for number, path in enumerate(filter(None, os.environ.get('OCTOFIT_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path.strip(),
+        # Closed after each request, so a newly synced copy is picked up
+        'CONN_MAX_AGE': 0,
+        'TEST': {'MIRROR': 'default'},
+    }
+    READ_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['fitness.replicas.ReplicaRouter']
+
+# Replicas whose snapshot is older than this are skipped
+REPLICA_MAX_LAG_SECONDS = 30
+REPLICA_SYNC_SECONDS = 5
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The fitness API caches rendered responses and their version counters here.
+# Local memory is per process; point FITNESS_CACHE_DIR at a shared directory
+# so every worker on the host sees the same invalidations (`manage.py check
+# --deploy` warns while it is unset).
+
+# Revoked API token ids (fitness.tokens) get a cache of their own, sized so
+# that culling never drops one before its token expires.
+
+TOKEN_CACHE_MAX_ENTRIES = 1_000_000
+
+if os.environ.get('FITNESS_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['FITNESS_CACHE_DIR'],
+        },
+        'tokens': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(os.environ['FITNESS_CACHE_DIR'], 'tokens'),
+            'OPTIONS': {'MAX_ENTRIES': TOKEN_CACHE_MAX_ENTRIES},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'octofit-tracker',
+        },
+        'tokens': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'octofit-tracker-tokens',
+            'OPTIONS': {'MAX_ENTRIES': TOKEN_CACHE_MAX_ENTRIES},
+        },
+    }
+
+FITNESS_TOKEN_CACHE_ALIAS = 'tokens'
+
+FITNESS_RESPONSE_CACHE_TIMEOUT = 300
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -100,6 +198,8 @@ CORS_ALLOW_ALL_ORIGINS = False  # Set to True for development if needed
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
+        # Bearer tokens from /api/auth/token/; authenticates without a DB read
+        'fitness.tokens.SignedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -152,3 +252,38 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# In-process user leaderboard: each worker rebuilds it from the database
+# at most this often so it picks up writes made by other workers
+LEADERBOARD_REBUILD_SECONDS = 300
+
+# Live leaderboard stream (/api/live/leaderboard/): how often changed boards
+# are diffed and pushed, how often boards are reloaded anyway to pick up
+# other workers' writes, and how long one stream lasts before the client
+# reconnects
+LIVE_LEADERBOARD_TICK_SECONDS = 1
+LIVE_LEADERBOARD_RESYNC_SECONDS = 30
+LIVE_LEADERBOARD_STREAM_SECONDS = 300
+
+# Lifetimes of the signed API tokens (fitness.tokens). Revoked token ids are
+# kept in the FITNESS_TOKEN_CACHE_ALIAS cache until the token expires
+AUTH_TOKEN_ACCESS_SECONDS = 15 * 60
+AUTH_TOKEN_REFRESH_SECONDS = 14 * 24 * 60 * 60
+
+# Activities older than this many days can be moved to the archive table
+# (manage.py archive_activities); reads reach them only when asked to
+ACTIVITY_ARCHIVE_AFTER_DAYS = 365
+
+# Background jobs (manage.py run_worker): rows written per chunk, and how long
+# a running job may go without a heartbeat before another worker resumes it
+JOB_CHUNK_SIZE = 5000
+JOB_STALE_SECONDS = 300
+
+# Workout suggestions (manage.py generate_suggestions): days of activity
+# each user's profile is built from, and suggestions generated per user
+SUGGESTION_WINDOW_DAYS = 28
+SUGGESTIONS_PER_USER = 3
+
+# Queries slower than this are logged to fitness.slow_queries with their SQL
+# and stack, and counted in /api/_metrics
+FITNESS_SLOW_QUERY_MS = 100
@@ -40,6 +40,7 @@ def api_root(request, format=None):
         'challenges': reverse('challenge-list', request=request, format=format),
         'workout-suggestions': reverse('workoutsuggestion-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-users', request=request, format=format),
+        'auth-token': reverse('token-obtain', request=request, format=format),
         'admin': f"{base_url}/admin/",
         'docs': 'Welcome to OctoFit Tracker API!'
     })